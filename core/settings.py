@@ -32,6 +32,11 @@ DEBUG = os.getenv('DEBUG', 'True') == 'True'
 
 ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', '').split(',') if os.getenv('ALLOWED_HOSTS') else []
 
+# 可信的反向代理地址（IP或CIDR），逗号分隔，例如 127.0.0.1,10.0.0.0/8
+# 只有请求直接来自这些地址时才从X-Forwarded-For读取客户端IP，为空时只使用REMOTE_ADDR；
+# 限流、短信发送次数和 /metrics/ 的访问控制都依赖客户端IP，不能信任客户端自己发送的请求头
+TRUSTED_PROXIES = [ip.strip() for ip in os.getenv('TRUSTED_PROXIES', '').split(',') if ip.strip()]
+
 # 腾讯云短信配置
 TENCENT_CLOUD_SMS = {
     'SECRET_ID': os.getenv('TENCENT_CLOUD_SMS_SECRET_ID'),
@@ -41,12 +46,115 @@ TENCENT_CLOUD_SMS = {
     'TEMPLATE_ID': os.getenv('TENCENT_CLOUD_SMS_TEMPLATE_ID'),
 }
 
+# 短信后端配置
+# 可选：users.utils.sms_backends.TencentSMSBackend（腾讯云）、ConsoleSMSBackend（写入日志）、
+# InMemorySMSBackend（保存在内存中，OPTIONS可设置latency、failure_rate、error_rate，用于压测）
+SMS_BACKEND = {
+    'BACKEND': os.getenv('SMS_BACKEND', 'users.utils.sms_backends.TencentSMSBackend'),
+    'OPTIONS': {},
+}
+
+# 腾讯云短信客户端池配置
+SMS_CLIENT_POOL = {
+    # 地域
+    'REGION': 'ap-guangzhou',
+    # 每个进程最多创建的客户端数，即与短信服务的最大并发连接数
+    'MAX_SIZE': 8,
+    # 建立连接超时时间（秒）
+    'CONNECT_TIMEOUT': 3,
+    # 读取响应超时时间（秒）
+    'READ_TIMEOUT': 10,
+    # 客户端全部借出时的最长等待时间（秒）
+    'ACQUIRE_TIMEOUT': 5,
+}
+
+# 短信服务熔断配置，服务商出错或变慢时快速失败，不再等待超时
+SMS_CIRCUIT_BREAKER = {
+    'ENABLED': True,
+    # 最近调用中失败比例达到该值时熔断
+    'FAILURE_RATE_THRESHOLD': 0.5,
+    # 超过该耗时（秒）的调用视为慢调用
+    'SLOW_CALL_DURATION': 3,
+    # 最近调用中慢调用比例达到该值时熔断
+    'SLOW_CALL_RATE_THRESHOLD': 0.8,
+    # 统计的最近调用次数
+    'WINDOW_SIZE': 20,
+    # 开始计算失败率的最少调用次数
+    'MINIMUM_CALLS': 10,
+    # 熔断持续时间（秒），之后放行少量探测调用
+    'OPEN_TIMEOUT': 30,
+    # 探测调用次数，全部成功后恢复
+    'HALF_OPEN_MAX_CALLS': 3,
+}
+
+# 短信对冲请求配置，主后端在最近耗时的指定分位数内未返回时，同时向备用后端发送
+SMS_HEDGE = {
+    # 备用后端，格式同SMS_BACKEND，为None时不对冲，例如其他地域：
+    # {'BACKEND': 'users.utils.sms_backends.TencentSMSBackend', 'OPTIONS': {'REGION': 'ap-beijing'}}
+    'BACKEND': None,
+    # 主后端耗时的分位数
+    'PERCENTILE': 95,
+    # 最短等待时间（秒）
+    'MIN_DELAY': 0.2,
+    # 耗时样本不足时的等待时间（秒）
+    'DEFAULT_DELAY': 1.0,
+    # 对冲发送的线程数
+    'MAX_WORKERS': 16,
+}
+
+# 短信批量发送配置
+# 腾讯云只能合并模板参数完全相同的短信，验证码各不相同时合并的机会很少，默认关闭
+SMS_BATCH = {
+    # 是否开启批量发送
+    'ENABLED': os.getenv('SMS_BATCH_ENABLED', 'False') == 'True',
+    # 每批最多的号码数，腾讯云单次请求上限为200
+    'MAX_SIZE': 200,
+    # 收集同组短信的最长等待时间（秒）
+    'MAX_WAIT': 0.005,
+}
+
 # 验证码有效期（分钟）
 SMS_CODE_EXPIRE_MINUTES = 5
 
 # 验证码缓存键前缀
 SMS_CODE_CACHE_PREFIX = 'sms_code_'
 
+# 短信发送频率限制，在调用短信服务之前检查
+SMS_SEND_LIMITS = {
+    # 同一手机号两次发送的最小间隔（秒）
+    'PHONE_COOLDOWN': 60,
+    # 同一IP地址两次发送的最小间隔（秒），同一出口IP下可能有多个用户，不宜过大
+    'IP_COOLDOWN': 2,
+    # 同一手机号24小时内最多发送次数
+    'PHONE_DAILY_LIMIT': 10,
+    # 同一IP地址24小时内最多发送次数
+    'IP_DAILY_LIMIT': 100,
+    # 验证码生成后多长时间内（秒）重新发送时复用同一个验证码，应小于验证码有效期
+    'CODE_REUSE_SECONDS': 180,
+}
+
+# 短信发送方式配置
+SMS_DISPATCH = {
+    # 是否异步发送，开启后验证码写入缓存即返回，由后台线程池调用短信接口
+    'ASYNC': os.getenv('SMS_DISPATCH_ASYNC', 'False') == 'True',
+    # 发送线程数
+    'MAX_WORKERS': 4,
+    # 最多等待发送的任务数，超出时拒绝新请求
+    'MAX_PENDING': 1000,
+    # 网络或SDK异常时的最大重试次数
+    'MAX_RETRIES': 3,
+    # 首次重试的等待时间（秒），之后每次翻倍
+    'RETRY_BACKOFF': 0.5,
+    # 发送状态的保留时间（秒）
+    'STATUS_TIMEOUT': 3600,
+}
+
+# 进程内一级缓存（L1）最大条目数
+LOCAL_CACHE_MAX_SIZE = 1024
+
+# 进程内一级缓存（L1）最长存活时间（秒）
+LOCAL_CACHE_TIMEOUT = 5
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -74,6 +182,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     'users.utils.logger.RequestLogMiddleware',
+    'users.utils.metrics.RequestMetricsMiddleware',
 ]
 
 ROOT_URLCONF = "core.urls"
@@ -107,6 +216,29 @@ DATABASES = {
     }
 }
 
+# 缓存配置
+# 验证码、限流计数、缓存标签版本等状态需要在所有worker进程之间共享，不能使用进程内的LocMemCache：
+# 配置了REDIS_URL时使用Redis；否则使用本机的SQLite文件，适用于单机多进程部署和本地测试
+REDIS_URL = os.getenv('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "users.utils.cache_backends.SQLiteCache",
+            "LOCATION": os.getenv('CACHE_SQLITE_PATH', str(BASE_DIR / "cache.sqlite3")),
+            "OPTIONS": {
+                "MAX_ENTRIES": 100000,
+            },
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -157,7 +289,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # 添加DRF配置
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.StatelessJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -165,6 +297,11 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler',
+    # 限流频率，对应 users.utils.throttling 中各限流类的scope
+    'DEFAULT_THROTTLE_RATES': {
+        'user': '600/min',
+        'sms': '10/min',
+    },
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
@@ -177,8 +314,9 @@ from datetime import timedelta
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
-    'ROTATE_REFRESH_TOKENS': False,
-    'BLACKLIST_AFTER_ROTATION': True,
+    # 刷新时签发新的刷新令牌，已使用的刷新令牌记录在缓存中直到过期，不需要黑名单表
+    'ROTATE_REFRESH_TOKENS': True,
+    'BLACKLIST_AFTER_ROTATION': False,
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY,
     'VERIFYING_KEY': None,
@@ -187,11 +325,38 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.UserTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.UserTokenRefreshSerializer',
+}
+
+# 异步认证接口的密码哈希线程池配置
+PASSWORD_HASH_POOL = {
+    # 计算线程数，一般不超过CPU核数
+    'MAX_WORKERS': os.cpu_count() or 4,
+    # 最多正在计算和等待计算的任务数，超出时返回503
+    'MAX_PENDING': 64,
+    # 返回503时建议客户端等待的时间（秒）
+    'RETRY_AFTER': 1,
 }
 
+# 批量创建、更新、删除接口配置
+BULK_OPERATIONS = {
+    # 单次请求最多处理的条目数
+    'MAX_ITEMS': 1000,
+    # 每条INSERT/UPDATE语句最多包含的条目数
+    'BATCH_SIZE': 500,
+}
+
+# 缓存用户令牌版本的时间（秒），撤销令牌时同步更新缓存，过期后从数据库重新读取
+TOKEN_VERSION_CACHE_TIMEOUT = 86400
+
 # 自定义用户模型
 AUTH_USER_MODEL = 'users.CustomUser'
 
+# 用户名、手机号只在未删除的用户中唯一（条件唯一约束），默认管理器只返回未删除的用户，按手机号登录不会出现重复；
+# 关闭auth.E003后由users.E001检查手机号至少在未删除的用户中唯一
+SILENCED_SYSTEM_CHECKS = ['auth.E003']
+
 # 日志配置
 LOGGING = {
     'version': 1,
@@ -220,9 +385,12 @@ LOGGING = {
         },
         'file': {
             'level': 'INFO',
-            'class': 'logging.FileHandler',
+            # 异步写入：请求线程只入队，后台线程批量写文件，队列满时丢弃
+            'class': 'users.utils.logger.QueuedFileHandler',
             'filename': BASE_DIR / 'logs/django.log',
             'formatter': 'verbose',
+            'queue_size': 10000,
+            'batch_size': 200,
         },
     },
     'loggers': {
@@ -234,6 +402,35 @@ LOGGING = {
     },
 }
 
+# 指标统计配置
+# 多进程部署时各进程共享指标数据的目录，为空时只统计当前进程
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '')
+# 各进程写入指标快照的间隔（秒）
+METRICS_FLUSH_INTERVAL = 5
+# 允许访问 /metrics/ 的IP地址，逗号分隔，默认只允许本机访问；为空时拒绝所有访问
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()]
+
+# API请求日志配置
+API_LOG = {
+    # 记录请求参数、请求体和响应数据的采样率（0~1），出错的请求总是记录
+    'DEFAULT_SAMPLE_RATE': 1.0,
+    # 按路由名称（url_name）单独配置采样率，例如 {'user-list': 0.1}
+    'SAMPLE_RATES': {},
+    # 请求体和响应数据在日志中的最大字节数，超出部分截断
+    'MAX_BODY_BYTES': 2048,
+    # 嵌套数据的最大记录深度
+    'MAX_DEPTH': 3,
+    # 日志中脱敏的字段
+    'REDACT_FIELDS': [
+        'password', 'password2', 'old_password', 'new_password', 'new_password2',
+        'access', 'refresh', 'token',
+    ],
+    # 只在请求数据中脱敏的字段（短信验证码；响应中的code是业务状态码，不脱敏）
+    'REDACT_REQUEST_FIELDS': ['code'],
+    # 是否记录响应数据，默认只在调试模式下记录
+    'LOG_RESPONSE_DATA': DEBUG,
+}
+
 # 确保日志目录存在
 if not os.path.exists(BASE_DIR / 'logs'):
     os.makedirs(BASE_DIR / 'logs')
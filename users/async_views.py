@@ -0,0 +1,173 @@
+"""
+异步认证视图，用于ASGI部署
+用户名密码登录、注册和修改密码都需要计算密码哈希，这些视图把哈希计算交给有界线程池，
+数据库操作使用Django的异步ORM，事件循环不会被阻塞，登录高峰时其他接口仍能及时响应；
+线程池任务已满时返回503并带有Retry-After，由客户端稍后重试
+"""
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.utils.translation import gettext_lazy as _
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, ParseError
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from .authentication import StatelessJWTAuthentication, UserRefreshToken
+from .serializers import ChangePasswordSerializer, UserCreateSerializer
+from .utils.passwords import PasswordHashPoolBusy, get_password_hash_pool
+from .utils.response import json_response
+
+User = get_user_model()
+
+# 登录时查询的用户字段：校验密码和签发令牌需要的字段
+LOGIN_USER_FIELDS = ['id', 'password', 'username', 'is_staff', 'is_superuser', 'is_active', 'is_deleted', 'token_version']
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """
+    异步视图基类
+    统一处理JSON请求体解析、DRF异常和密码哈希线程池已满的情况
+    """
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except PasswordHashPoolBusy:
+            retry_after = settings.PASSWORD_HASH_POOL.get('RETRY_AFTER', 1)
+            return json_response(
+                msg="服务繁忙，请稍后重试",
+                code=503,
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(retry_after)},
+            )
+        except APIException as exc:
+            # 与DRF默认的异常处理保持一致
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return JsonResponse(data, status=exc.status_code, safe=False)
+
+    @staticmethod
+    def parse_json(request):
+        """
+        解析JSON请求体
+        """
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            raise ParseError()
+        if not isinstance(data, dict):
+            raise ParseError()
+        return data
+
+    @staticmethod
+    async def authenticate(request):
+        """
+        JWT认证，认证过程可能读取缓存和数据库，在线程中执行
+        :return: 令牌对应的用户
+        """
+        result = await sync_to_async(StatelessJWTAuthentication().authenticate)(request)
+        if result is None:
+            raise NotAuthenticated()
+        return result[0]
+
+
+class AsyncTokenObtainView(AsyncAPIView):
+    """
+    用户名密码登录（异步）
+    """
+    async def post(self, request):
+        """
+        校验手机号和密码，返回的令牌格式与 token/ 接口相同
+        """
+        data = self.parse_json(request)
+        phone = data.get('phone')
+        password = data.get('password')
+        if not phone or not password:
+            return JsonResponse({'detail': _("手机号和密码不能为空")}, status=status.HTTP_400_BAD_REQUEST)
+
+        pool = get_password_hash_pool()
+        user = await User.objects.filter(phone=phone).only(*LOGIN_USER_FIELDS).afirst()
+        if user is None:
+            # 用户不存在时同样计算一次哈希，避免通过响应时间判断手机号是否已注册
+            await pool.make_password(password)
+            valid = False
+        else:
+            valid = await pool.check_password(password, user.password)
+
+        if not valid or not user.is_active or user.is_deleted:
+            raise AuthenticationFailed(
+                _("No active account found with the given credentials"),
+                code="no_active_account",
+            )
+
+        refresh = UserRefreshToken.for_user(user)
+        return JsonResponse({
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+        })
+
+
+class AsyncRegisterView(AsyncAPIView):
+    """
+    用户注册（异步）
+    """
+    async def post(self, request):
+        """
+        注册新用户，返回格式与 POST /api/users/ 相同
+        """
+        serializer = UserCreateSerializer(data=self.parse_json(request))
+        # 唯一性校验需要查询数据库
+        if not await sync_to_async(serializer.is_valid)():
+            return json_response(msg=serializer.errors, code=400, status_code=status.HTTP_400_BAD_REQUEST)
+
+        validated_data = dict(serializer.validated_data)
+        validated_data.pop('password2')
+        password = validated_data.pop('password')
+
+        user = User(**validated_data)
+        user.password = await get_password_hash_pool().make_password(password)
+        try:
+            await user.asave(force_insert=True)
+        except IntegrityError:
+            # 校验之后被并发请求抢先注册
+            return json_response(msg="手机号、用户名或邮箱已被注册", code=400, status_code=status.HTTP_400_BAD_REQUEST)
+
+        return json_response(
+            data=UserCreateSerializer(user).data,
+            msg="创建成功",
+            code=200,
+            status_code=status.HTTP_201_CREATED,
+        )
+
+
+class AsyncChangePasswordView(AsyncAPIView):
+    """
+    修改密码（异步）
+    """
+    async def put(self, request):
+        """
+        修改当前用户的密码，之前签发的令牌失效，返回新令牌
+        """
+        token_user = await self.authenticate(request)
+        serializer = ChangePasswordSerializer(data=self.parse_json(request))
+        if not serializer.is_valid():
+            return json_response(msg=serializer.errors, code=400, status_code=status.HTTP_400_BAD_REQUEST)
+
+        user = await User.objects.aget(pk=token_user.pk)
+        pool = get_password_hash_pool()
+        if not await pool.check_password(serializer.validated_data['old_password'], user.password):
+            return json_response(msg="旧密码不正确", code=400, status_code=status.HTTP_400_BAD_REQUEST)
+
+        user.password = await pool.make_password(serializer.validated_data['new_password'])
+        # 保存时撤销之前签发的所有令牌
+        await user.asave(update_fields=['password', 'updated_at'])
+
+        refresh = UserRefreshToken.for_user(user)
+        return json_response(data={
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+        }, msg="密码修改成功")
@@ -0,0 +1,173 @@
+import uuid
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from .utils.cache import cache_result
+
+class UserRefreshToken(RefreshToken):
+    """
+    刷新令牌，签发时写入认证所需的用户声明
+    由其生成的访问令牌会继承这些声明，认证时无需查询数据库
+    """
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token['username'] = user.username
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+        token['is_active'] = user.is_active
+        token['token_version'] = getattr(user, 'token_version', 0)
+        return token
+
+
+# 令牌版本的缓存键前缀
+TOKEN_VERSION_CACHE_PREFIX = 'token_version'
+
+
+def token_version_cache_key(user_id):
+    """
+    用户令牌版本的缓存键
+    """
+    return f"{TOKEN_VERSION_CACHE_PREFIX}:{user_id}"
+
+
+def cache_token_version(user_id, version):
+    """
+    写入用户当前的令牌版本
+    """
+    cache.set(token_version_cache_key(user_id), version, settings.TOKEN_VERSION_CACHE_TIMEOUT)
+
+
+def get_token_version(user_id):
+    """
+    获取用户当前的令牌版本，优先读取缓存，未命中时查询数据库并写入缓存
+    :param user_id: 用户ID
+    :return: 令牌版本，用户不存在或已删除时返回None
+    """
+    version = cache.get(token_version_cache_key(user_id))
+    if version is not None:
+        return version
+    
+    version = get_user_model().objects.filter(pk=user_id, is_deleted=False).values_list(
+        'token_version', flat=True
+    ).first()
+    if version is not None:
+        cache_token_version(user_id, version)
+    return version
+
+
+def check_token_version(token):
+    """
+    检查令牌中的版本是否为用户当前的令牌版本，没有版本声明的旧令牌视为版本0
+    :raises AuthenticationFailed: 令牌已被撤销或用户不存在
+    """
+    version = get_token_version(token[api_settings.USER_ID_CLAIM])
+    if version is None:
+        raise AuthenticationFailed(_("User not found"), code="user_not_found")
+    if version != token.get('token_version', 0):
+        raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+
+
+# 不写入缓存的用户字段，避免密码哈希等敏感数据保存在共享缓存中
+USER_CACHE_EXCLUDED_FIELDS = ('password',)
+
+
+@cache_result(timeout=60, prefix='auth_user', tags=['user:{user_id}'])
+def get_cached_user_fields(user_id):
+    """
+    获取用户的字段值，不包含 USER_CACHE_EXCLUDED_FIELDS 中的字段，结果短时间缓存，用户数据变更时失效
+    :param user_id: 用户ID
+    :return: 字段名到字段值的字典，不存在时返回None
+    """
+    User = get_user_model()
+    field_names = [
+        field.attname for field in User._meta.concrete_fields
+        if field.name not in USER_CACHE_EXCLUDED_FIELDS
+    ]
+    return User.objects.filter(pk=user_id).values(*field_names).first()
+
+
+def get_cached_user(user_id):
+    """
+    根据缓存的字段值构造完整的用户对象，未缓存的字段为延迟加载字段，访问时才查询数据库
+    :param user_id: 用户ID
+    :return: 用户对象，不存在时返回None
+    """
+    fields = get_cached_user_fields(user_id)
+    if fields is None:
+        return None
+    User = get_user_model()
+    return User.from_db(User.objects.db, list(fields), list(fields.values()))
+
+
+class StatelessUser:
+    """
+    根据令牌声明构造的轻量用户对象，认证时不查询数据库
+    声明之外的属性（如邮箱、头像）会从缓存的完整用户对象中读取；
+    需要修改并保存用户时，应从数据库重新获取用户对象
+    """
+    is_authenticated = True
+    is_anonymous = False
+    
+    def __init__(self, token):
+        self.token = token
+        self.id = self.pk = uuid.UUID(str(token[api_settings.USER_ID_CLAIM]))
+        self.username = token['username']
+        self.is_staff = token.get('is_staff', False)
+        self.is_superuser = token.get('is_superuser', False)
+        self.is_active = token.get('is_active', True)
+        self.token_version = token.get('token_version', 0)
+        self._full_user = None
+    
+    def __str__(self):
+        return self.username
+    
+    def __eq__(self, other):
+        return getattr(other, 'pk', None) == self.pk
+    
+    def __hash__(self):
+        return hash(self.pk)
+    
+    def get_full_user(self):
+        """
+        获取完整的用户对象
+        """
+        if self._full_user is None:
+            self._full_user = get_cached_user(self.pk)
+            if self._full_user is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        return self._full_user
+    
+    def __getattr__(self, name):
+        # 只有在实例属性中找不到时才会调用，私有属性不代理，避免复制、序列化时递归
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get_full_user(), name)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    无状态JWT认证，直接根据令牌中的用户声明构造用户对象，不查询数据库
+    没有用户声明的旧令牌回退到查询数据库的认证方式；
+    两种方式都会比较令牌版本，已撤销的令牌认证失败，正常情况下只需读取一次缓存
+    """
+    def get_user(self, validated_token):
+        if 'username' not in validated_token:
+            user = super().get_user(validated_token)
+            if user.token_version != validated_token.get('token_version', 0):
+                raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+            return user
+        
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        
+        if api_settings.CHECK_USER_IS_ACTIVE and not validated_token.get('is_active', True):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        
+        check_token_version(validated_token)
+        return StatelessUser(validated_token)
@@ -0,0 +1,34 @@
+"""
+系统检查
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import checks
+from django.db import models
+
+
+@checks.register(checks.Tags.models)
+def check_username_field_unique(app_configs=None, **kwargs):
+    """
+    auth.E003 要求USERNAME_FIELD在所有行中唯一，已在settings中关闭；
+    这里改为要求USERNAME_FIELD至少在未删除的用户中唯一，否则按手机号登录可能查到多个用户
+    """
+    if 'auth.E003' not in settings.SILENCED_SYSTEM_CHECKS:
+        return []
+
+    user_model = get_user_model()
+    username_field = user_model.USERNAME_FIELD
+    if user_model._meta.get_field(username_field).unique:
+        return []
+    for constraint in user_model._meta.constraints:
+        if (isinstance(constraint, models.UniqueConstraint)
+                and tuple(constraint.fields) == (username_field,)
+                and constraint.condition == models.Q(is_deleted=False)):
+            return []
+
+    return [checks.Error(
+        f"'{user_model.__name__}.{username_field}' 必须唯一，或者有只包含未删除用户的条件唯一约束",
+        hint="auth.E003 已被关闭，请为USERNAME_FIELD添加 condition=Q(is_deleted=False) 的UniqueConstraint",
+        obj=user_model,
+        id='users.E001',
+    )]
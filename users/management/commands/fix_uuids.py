@@ -1,36 +1,131 @@
-from django.core.management.base import BaseCommand
-from django.db import connection
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+import time
 import uuid
 
+User = get_user_model()
+
 class Command(BaseCommand):
     help = '修复数据库中的UUID格式问题'
 
+    # 两次进度输出之间的最短间隔（秒）
+    PROGRESS_INTERVAL = 2
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='每批读取和校验的ID数，每批的修复在一个事务中执行')
+        parser.add_argument('--dry-run', action='store_true', help='只检查并输出需要修复的ID，不修改数据库')
+        parser.add_argument('--canonicalize', action='store_true',
+                            help='同时把可以解析为UUID、但存储格式与Django不一致的ID（如带连字符）转换为标准格式')
+
     def handle(self, *args, **options):
-        self.stdout.write(self.style.SUCCESS('开始修复UUID格式...'))
-        
-        # 使用原始SQL查询获取所有用户ID
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT id FROM users_customuser")
-            user_ids = cursor.fetchall()
-        
-        fixed_count = 0
-        
-        for (user_id,) in user_ids:
+        batch_size = options['batch_size']
+        if not 1 <= batch_size <= 100000:
+            raise CommandError('--batch-size 必须在1到100000之间')
+
+        self.dry_run = options['dry_run']
+        self.canonicalize = options['canonicalize']
+        self.verbosity = options['verbosity']
+        self.pk_field = User._meta.pk
+        quote = connection.ops.quote_name
+        table = quote(User._meta.db_table)
+        column = quote(self.pk_field.column)
+        # 使用原始SQL，格式错误的ID无法转换为UUID对象，不能通过ORM读取
+        first_sql = f"SELECT {column} FROM {table} ORDER BY {column} LIMIT %s"
+        next_sql = f"SELECT {column} FROM {table} WHERE {column} > %s ORDER BY {column} LIMIT %s"
+        # 主键和引用用户主键的外键（分组、权限、管理日志等）一起更新
+        self.update_sqls = [f"UPDATE {table} SET {column} = %s WHERE {column} = %s"] + [
+            f"UPDATE {quote(ref_table)} SET {quote(ref_column)} = %s WHERE {quote(ref_column)} = %s"
+            for ref_table, ref_column in self._referencing_columns()
+        ]
+
+        self.stdout.write(self.style.SUCCESS('开始修复UUID格式...' + ('（试运行）' if self.dry_run else '')))
+
+        scanned = fixed = 0
+        last = None
+        start = last_report = time.perf_counter()
+
+        # 按主键键集分页读取，每次只在内存中保留一批ID
+        while True:
+            with connection.cursor() as cursor:
+                if last is None:
+                    cursor.execute(first_sql, [batch_size])
+                else:
+                    cursor.execute(next_sql, [last, batch_size])
+                ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                break
+
+            fixed += self._fix_batch(ids)
+            scanned += len(ids)
+            last = ids[-1]
+
+            now = time.perf_counter()
+            if now - last_report >= self.PROGRESS_INTERVAL:
+                last_report = now
+                self.stdout.write(f'已检查 {scanned} 条，需修复 {fixed} 条，{scanned / (now - start):.0f} 条/秒')
+
+            if len(ids) < batch_size:
+                break
+
+        elapsed = time.perf_counter() - start
+        rate = scanned / elapsed if elapsed > 0 else 0
+        if self.dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f'检查完成！共检查 {scanned} 个用户记录，{fixed} 个需要修复，耗时 {elapsed:.1f} 秒（{rate:.0f} 条/秒）'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'UUID修复完成！共检查 {scanned} 个用户记录，修复了 {fixed} 个，耗时 {elapsed:.1f} 秒（{rate:.0f} 条/秒）'
+            ))
+
+    def _referencing_columns(self):
+        """
+        引用用户主键的 (表, 列)
+        """
+        columns = []
+        for field in User._meta.many_to_many:
+            through = field.remote_field.through
+            columns.append((through._meta.db_table, through._meta.get_field(field.m2m_field_name()).column))
+        for rel in User._meta.related_objects:
+            if rel.many_to_many:
+                through = rel.through
+                columns.append((through._meta.db_table, through._meta.get_field(rel.field.m2m_reverse_field_name()).column))
+            elif rel.field.concrete:
+                columns.append((rel.related_model._meta.db_table, rel.field.column))
+        return columns
+
+    def _fix_batch(self, ids):
+        """
+        校验一批ID，格式错误的在一个事务中批量修复
+        无法解析的ID替换为新的UUID；指定--canonicalize时，可以解析为UUID但存储格式与Django不一致的ID
+        转换为标准格式，保持原有的UUID值
+        :return: 需要修复的数量
+        """
+        fixes = []
+        for user_id in ids:
             try:
-                # 尝试将ID转换为UUID对象
-                uuid_obj = uuid.UUID(str(user_id))
-                # ID格式正确，不需要修复
-                continue
+                value = uuid.UUID(str(user_id))
             except ValueError:
-                # 如果ID不是有效的UUID格式，则生成新的UUID
-                new_uuid = str(uuid.uuid4())
+                value = uuid.uuid4()
+            else:
+                if not self.canonicalize:
+                    continue
+            new_id = self.pk_field.get_db_prep_value(value, connection)
+            if new_id != user_id:
+                fixes.append((new_id, user_id))
+
+        if not fixes:
+            return 0
+
+        if self.verbosity >= 2 or self.dry_run:
+            for new_id, user_id in fixes:
+                self.stdout.write(self.style.WARNING(f'用户ID格式无效: {user_id} -> {new_id}'))
+
+        if not self.dry_run:
+            with transaction.atomic():
                 with connection.cursor() as cursor:
-                    cursor.execute(
-                        "UPDATE users_customuser SET id = %s WHERE id = %s",
-                        [new_uuid, user_id]
-                    )
-                    if cursor.rowcount > 0:
-                        fixed_count += 1
-                        self.stdout.write(self.style.WARNING(f'用户ID格式无效，已从 {user_id} 更新为 {new_uuid}'))
-        
-        self.stdout.write(self.style.SUCCESS(f'UUID修复完成！共修复了 {fixed_count} 个用户记录。')) 
\ No newline at end of file
+                    for sql in self.update_sqls:
+                        cursor.executemany(sql, fixes)
+        return len(fixes)
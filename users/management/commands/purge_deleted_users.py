@@ -0,0 +1,121 @@
+import json
+import os
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+User = get_user_model()
+
+class Command(BaseCommand):
+    help = '清理软删除超过指定天数的用户：按 (deleted_at, id) 分批归档到NDJSON文件后硬删除'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='清理删除时间早于多少天之前的用户')
+        parser.add_argument('--batch-size', type=int, default=500, help='每批处理的用户数，每批在单独的短事务中删除')
+        parser.add_argument('--sleep', type=float, default=0.1, help='每批之间暂停的时间（秒），降低对线上数据库的压力')
+        parser.add_argument('--archive', default=os.path.join(settings.BASE_DIR, 'archive', 'deleted_users.ndjson'),
+                            help='归档文件路径，每行一个用户的JSON，追加写入')
+        parser.add_argument('--no-archive', action='store_true', help='不归档，直接删除')
+        parser.add_argument('--dry-run', action='store_true', help='只统计将要清理的用户数，不归档也不删除')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError('--days 不能小于0')
+        if not 1 <= options['batch_size'] <= 10000:
+            raise CommandError('--batch-size 必须在1到10000之间')
+
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # 归档除密码外的所有字段，values() 直接返回字段值，不构造模型对象
+        self.fields = [field.attname for field in User._meta.concrete_fields if field.attname != 'password']
+        self.stdout.write(f"清理删除时间早于 {cutoff.isoformat()} 的用户")
+
+        archive = None
+        if not options['dry_run'] and not options['no_archive']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['archive'])), exist_ok=True)
+            archive = open(options['archive'], 'a', encoding='utf-8')
+
+        try:
+            total, chunks, elapsed = self._purge(cutoff, archive, options)
+        finally:
+            if archive is not None:
+                archive.close()
+
+        rate = total / elapsed if elapsed > 0 else 0
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"试运行：共 {total} 个用户待清理，分 {chunks} 批"))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"清理完成！共删除 {total} 个用户，{chunks} 批，耗时 {elapsed:.1f} 秒（{rate:.0f} 条/秒）"
+            ))
+            if archive is not None:
+                self.stdout.write(f"归档文件: {options['archive']}")
+
+    def _purge(self, cutoff, archive, options):
+        """
+        按 (deleted_at, id) 键集分页，依次处理每一批
+        已处理的用户被删除，中断后重新执行即从剩余的用户继续
+        :return: (处理的用户数, 批数, 耗时)
+        """
+        base = User.all_objects.filter(is_deleted=True, deleted_at__lt=cutoff).order_by('deleted_at', 'id')
+        batch_size = options['batch_size']
+        last = None
+        total = chunks = 0
+        start = time.perf_counter()
+
+        while True:
+            queryset = base
+            if last is not None:
+                queryset = queryset.filter(Q(deleted_at__gt=last[0]) | Q(deleted_at=last[0], id__gt=last[1]))
+
+            if options['dry_run']:
+                keys = list(queryset.values_list('deleted_at', 'id')[:batch_size])
+                if not keys:
+                    break
+                count = len(keys)
+            else:
+                keys, count = self._purge_chunk(queryset, batch_size, archive)
+                if not keys:
+                    break
+
+            last = keys[-1]
+            total += count
+            chunks += 1
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"第 {chunks} 批: {count} 条，累计 {total} 条，{total / elapsed:.0f} 条/秒")
+
+            if len(keys) < batch_size:
+                break
+            if options['sleep'] > 0:
+                time.sleep(options['sleep'])
+
+        return total, chunks, time.perf_counter() - start
+
+    def _purge_chunk(self, queryset, batch_size, archive):
+        """
+        在一个事务中锁定一批用户，归档后删除
+        归档写入在删除提交之前，删除失败时归档中的记录会在下次执行时重复写入，读取归档时应按id去重
+        :return: (本批用户的 (deleted_at, id) 列表, 删除的用户数)
+        """
+        with transaction.atomic():
+            rows = list(queryset.select_for_update().values(*self.fields)[:batch_size])
+            if not rows:
+                return [], 0
+
+            if archive is not None:
+                archive.write(''.join(
+                    json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for row in rows
+                ))
+                archive.flush()
+                os.fsync(archive.fileno())
+
+            pks = [row['id'] for row in rows]
+            # 通过Django删除，同时删除用户的分组、权限等关联数据并触发缓存清理信号
+            _total, per_model = User.all_objects.filter(pk__in=pks).hard_delete()
+
+        return [(row['deleted_at'], row['id']) for row in rows], per_model.get(User._meta.label, 0)
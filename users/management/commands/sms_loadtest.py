@@ -0,0 +1,192 @@
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from users.utils.sms import SMSUtil
+from users.utils.sms_backends import get_backend
+
+User = get_user_model()
+
+class Command(BaseCommand):
+    help = '短信验证码登录压测：并发执行“发送验证码-验证码登录”流程，统计吞吐量和延迟分位数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--flows', type=int, default=200, help='执行的登录流程数，每个流程使用一个新手机号')
+        parser.add_argument('--concurrency', type=int, default=20, help='并发数')
+        parser.add_argument('--base-url', help='压测已部署的服务，例如 http://127.0.0.1:8000；'
+                            '验证码从缓存读取，要求与服务共用同一个缓存；服务的TRUSTED_PROXIES需包含压测机地址，'
+                            '否则所有流程按同一个客户端IP限流。不指定时在当前进程内压测')
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help='进程内压测时内存短信后端的模拟延迟（秒）')
+        parser.add_argument('--failure-rate', type=float, default=0,
+                            help='进程内压测时内存短信后端拒绝发送的比例')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='进程内压测时内存短信后端抛出异常的比例')
+        parser.add_argument('--phone-prefix', default='199', help='压测手机号前缀')
+        parser.add_argument('--cleanup', action='store_true', help='压测结束后删除压测创建的用户')
+
+    def handle(self, *args, **options):
+        if options['flows'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--flows 和 --concurrency 必须大于0')
+
+        if options['flows'] > 10000:
+            raise CommandError('--flows 最大为10000')
+
+        # 每次压测使用不同的号段，避免与上次压测的数据冲突
+        prefix = options['phone_prefix']
+        run_prefix = f"{prefix}{random.randint(0, 10 ** (7 - len(prefix)) - 1):0{7 - len(prefix)}d}"
+        phones = [f"{run_prefix}{i:04d}" for i in range(options['flows'])]
+
+        if options['base_url']:
+            self.base_url = options['base_url'].rstrip('/')
+            self.request = self._http_request
+            self.get_code = lambda phone: SMSUtil.get_code(phone)
+            results = self._run(phones, options['concurrency'])
+        else:
+            backend_config = {
+                'BACKEND': 'users.utils.sms_backends.InMemorySMSBackend',
+                'OPTIONS': {
+                    'latency': options['latency'],
+                    'failure_rate': options['failure_rate'],
+                    'error_rate': options['error_rate'],
+                },
+            }
+            host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS and settings.ALLOWED_HOSTS[0] != '*' else 'localhost'
+            with override_settings(SMS_BACKEND=backend_config):
+                backend = get_backend()
+                self._local = threading.local()
+                self._host = host
+                self.request = self._client_request
+                self.get_code = lambda phone: self._wait_for_code(backend, phone)
+                results = self._run(phones, options['concurrency'])
+                self.stdout.write(f"短信后端调用次数: {backend.send_count}")
+
+        if options['cleanup']:
+            deleted, _ = User.all_objects.filter(phone__startswith=run_prefix).hard_delete()
+            self.stdout.write(f"已删除压测数据 {deleted} 条")
+
+        self._report(*results)
+
+    def _run(self, phones, concurrency):
+        """
+        并发执行所有流程
+        :return: (各阶段耗时, 各阶段失败数, 总耗时)
+        """
+        durations = {'send': [], 'login': [], 'flow': []}
+        failures = {'send': 0, 'code': 0, 'login': 0}
+        lock = threading.Lock()
+
+        def flow(index, phone):
+            # 每个流程使用不同的客户端IP，避免按IP限流影响压测结果
+            ip = f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}"
+            flow_start = time.perf_counter()
+            try:
+                start = time.perf_counter()
+                ok = self.request('/api/users/sms/send/', {'phone': phone}, ip)
+                with lock:
+                    durations['send'].append(time.perf_counter() - start)
+                if not ok:
+                    with lock:
+                        failures['send'] += 1
+                    return
+
+                code = self.get_code(phone)
+                if not code:
+                    with lock:
+                        failures['code'] += 1
+                    return
+
+                start = time.perf_counter()
+                ok = self.request('/api/users/sms/login/', {'phone': phone, 'code': code}, ip)
+                login_time = time.perf_counter() - start
+                with lock:
+                    if ok:
+                        durations['login'].append(login_time)
+                        durations['flow'].append(time.perf_counter() - flow_start)
+                    else:
+                        failures['login'] += 1
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(flow, i, phone) for i, phone in enumerate(phones)]:
+                future.result()
+        return durations, failures, time.perf_counter() - start
+
+    def _client_request(self, path, data, ip):
+        """
+        进程内发送请求，每个线程使用自己的测试客户端
+        """
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client(HTTP_HOST=self._host)
+        # 直接设置连接地址模拟不同的客户端，X-Forwarded-For只有来自可信代理时才会被采用
+        response = client.post(path, data, content_type='application/json', REMOTE_ADDR=ip)
+        return response.status_code == 200 and response.json().get('code') == 200
+
+    def _http_request(self, path, data, ip):
+        """
+        向已部署的服务发送请求
+        服务只信任TRUSTED_PROXIES转发的X-Forwarded-For，压测机的地址不在其中时所有流程按同一个IP限流
+        """
+        request = urllib.request.Request(
+            f"{self.base_url}{path}",
+            data=json.dumps(data).encode(),
+            headers={'Content-Type': 'application/json', 'X-Forwarded-For': ip},
+            method='POST',
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return json.loads(response.read()).get('code') == 200
+        except (urllib.error.URLError, OSError, ValueError):
+            return False
+
+    @staticmethod
+    def _wait_for_code(backend, phone, timeout=5):
+        """
+        从内存短信后端读取验证码，异步发送时等待后台线程发送完成
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            params = backend.last_params(phone)
+            if params:
+                return params[0]
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(0.01)
+
+    def _report(self, durations, failures, elapsed):
+        """
+        输出压测结果
+        """
+        completed = len(durations['flow'])
+        self.stdout.write(self.style.SUCCESS('压测完成'))
+        self.stdout.write(f"总耗时: {elapsed:.2f}s, 完成流程: {completed}, "
+                          f"吞吐量: {completed / elapsed:.1f} 流程/s")
+        self.stdout.write(f"失败: 发送 {failures['send']}, 未收到验证码 {failures['code']}, 登录 {failures['login']}")
+
+        for stage, label in (('send', '发送验证码'), ('login', '验证码登录'), ('flow', '完整流程')):
+            values = sorted(durations[stage])
+            if not values:
+                continue
+            p50, p95, p99 = (self._percentile(values, p) * 1000 for p in (50, 95, 99))
+            self.stdout.write(f"{label}: 请求数 {len(values)}, p50 {p50:.1f}ms, p95 {p95:.1f}ms, "
+                              f"p99 {p99:.1f}ms, 最大 {values[-1] * 1000:.1f}ms")
+
+    @staticmethod
+    def _percentile(values, percent):
+        """
+        计算已排序数据的分位数（最近秩法）
+        """
+        index = max(0, -(-len(values) * percent // 100) - 1)
+        return values[int(index)]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_alter_customuser_email_alter_customuser_phone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0, verbose_name='令牌版本'),
+        ),
+    ]
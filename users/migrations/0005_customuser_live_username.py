@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_customuser_token_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customuser',
+            name='username',
+            field=models.CharField(max_length=150, verbose_name='用户名'),
+        ),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_deleted', False)), fields=('username',), name='users_live_username_uniq'),
+        ),
+    ]
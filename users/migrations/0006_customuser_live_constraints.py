@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_customuser_live_username'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customuser',
+            name='email',
+            field=models.EmailField(blank=True, max_length=254, null=True, verbose_name='邮箱地址'),
+        ),
+        migrations.AlterField(
+            model_name='customuser',
+            name='phone',
+            field=models.CharField(default='00000000000', max_length=15, verbose_name='手机号码'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['-created_at'], name='users_live_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['deleted_at', 'id'], name='users_deleted_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_deleted', False)), fields=('phone',), name='users_live_phone_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_deleted', False)), fields=('email',), name='users_live_email_uniq'),
+        ),
+    ]
@@ -1,10 +1,61 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+from django.core.cache import cache
+from .utils.cache import invalidate_tags
+from .signals import USER_LIST_CACHE_TAG, user_cache_tag
 import uuid
 
-class SoftDeleteManager(models.Manager):
+class SoftDeleteQuerySet(models.QuerySet):
+    """
+    软删除查询集，批量删除和恢复都只执行一条UPDATE语句
+    """
+    def alive(self):
+        """
+        只返回未删除的对象
+        """
+        return self.filter(is_deleted=False)
+    
+    def dead(self):
+        """
+        只返回已删除的对象
+        """
+        return self.filter(is_deleted=True)
+    
+    def delete(self):
+        """
+        批量软删除，已删除的对象保留原来的删除时间
+        update不逐个调用模型的delete方法，也不触发信号
+        :return: 与QuerySet.delete相同的 (删除数量, {模型: 删除数量})
+        """
+        count = self.alive().update(is_deleted=True, deleted_at=timezone.now())
+        return count, {self.model._meta.label: count}
+    
+    delete.alters_data = True
+    delete.queryset_only = True
+    
+    def restore(self):
+        """
+        批量恢复已删除的对象
+        :return: 恢复的数量
+        """
+        return self.dead().update(is_deleted=False, deleted_at=None)
+    
+    restore.alters_data = True
+    restore.queryset_only = True
+    
+    def hard_delete(self):
+        """
+        批量硬删除，真正从数据库中删除对象
+        没有级联对象和删除信号时只执行一条DELETE语句，否则由Django处理级联删除并发送信号
+        """
+        return super().delete()
+    
+    hard_delete.alters_data = True
+    hard_delete.queryset_only = True
+
+class SoftDeleteManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
     """
     软删除管理器，默认只返回未删除的对象
     """
@@ -43,7 +94,7 @@ class SoftDeleteModel(BaseModel):
     
     # 定义两个管理器
     objects = SoftDeleteManager()  # 默认管理器，只返回未删除的对象
-    all_objects = models.Manager()  # 返回所有对象，包括已删除的
+    all_objects = SoftDeleteQuerySet.as_manager()  # 返回所有对象，包括已删除的
     
     class Meta:
         abstract = True
@@ -80,9 +131,93 @@ class TimeStampedModel(models.Model):
     class Meta:
         abstract = True
 
-class CustomUserManager(BaseUserManager):
+class UserQuerySet(SoftDeleteQuerySet):
+    """
+    用户查询集
+    update、bulk_create、bulk_update不触发信号，批量操作后需要手动使用户缓存失效；批量删除同时递增令牌版本，
+    被删除用户之前签发的令牌立即失效
+    """
+    # 每条UPDATE语句最多更新的用户数，避免IN列表超过数据库的参数个数限制
+    BULK_BATCH_SIZE = 500
+    
+    def _bulk_update(self, queryset, **values):
+        """
+        按主键分批更新，并使被更新用户的缓存失效
+        先取出主键再按主键更新，确保失效的缓存与实际更新的行一致
+        :return: 更新的数量
+        """
+        from .authentication import token_version_cache_key
+        
+        pks = list(queryset.values_list('pk', flat=True))
+        if not pks:
+            return 0
+        
+        manager = self.model.all_objects.db_manager(self.db)
+        count = 0
+        with transaction.atomic(using=self.db):
+            for start in range(0, len(pks), self.BULK_BATCH_SIZE):
+                batch = pks[start:start + self.BULK_BATCH_SIZE]
+                count += manager.filter(pk__in=batch).update(**values)
+        
+        # 删除缓存的令牌版本，认证时从数据库重新读取
+        cache.delete_many([token_version_cache_key(pk) for pk in pks])
+        invalidate_tags(*[user_cache_tag(pk) for pk in pks], USER_LIST_CACHE_TAG)
+        return count
+    
+    def delete(self):
+        """
+        批量软删除用户，同时撤销这些用户的所有令牌
+        """
+        count = self._bulk_update(
+            self.alive(),
+            is_deleted=True,
+            deleted_at=timezone.now(),
+            token_version=models.F('token_version') + 1,
+        )
+        return count, {self.model._meta.label: count}
+    
+    delete.alters_data = True
+    delete.queryset_only = True
+    
+    def restore(self):
+        """
+        批量恢复已删除的用户
+        """
+        return self._bulk_update(self.dead(), is_deleted=False, deleted_at=None)
+    
+    restore.alters_data = True
+    restore.queryset_only = True
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        批量创建用户，使用户列表缓存失效
+        """
+        objs = super().bulk_create(objs, *args, **kwargs)
+        invalidate_tags(USER_LIST_CACHE_TAG)
+        return objs
+    
+    bulk_create.alters_data = True
+    
+    def bulk_update(self, objs, fields, batch_size=None):
+        """
+        批量更新用户，使被更新用户的缓存失效；修改了令牌声明字段时同时撤销令牌
+        """
+        rows = super().bulk_update(objs, fields, batch_size=batch_size)
+        if set(fields) & set(self.model.TOKEN_CLAIM_FIELDS):
+            # 修改了令牌声明字段，撤销这些用户的令牌，_bulk_update同时使缓存失效
+            self._bulk_update(
+                self.model.all_objects.filter(pk__in=[obj.pk for obj in objs]),
+                token_version=models.F('token_version') + 1,
+            )
+        else:
+            invalidate_tags(*[user_cache_tag(obj.pk) for obj in objs], USER_LIST_CACHE_TAG)
+        return rows
+    
+    bulk_update.alters_data = True
+
+class CustomUserManager(SoftDeleteManager.from_queryset(UserQuerySet), BaseUserManager):
     """
-    自定义用户管理器，使用邮箱作为唯一标识符
+    自定义用户管理器，使用手机号作为唯一标识符，默认只返回未删除的用户
     """
     def create_user(self, phone, username, password=None, **extra_fields):
         """
@@ -115,16 +250,57 @@ class CustomUserManager(BaseUserManager):
             raise ValueError(_('超级用户必须设置is_superuser=True'))
             
         return self.create_user(phone, username, password, **extra_fields)
+    
+    def get_or_create_by_phone(self, phone, fields=None, max_attempts=3):
+        """
+        按手机号获取用户，不存在时创建一个没有密码的用户
+        用户名由新用户的UUID主键生成，不需要先查询是否重复；并发首次登录同一手机号时，
+        只有一个请求插入成功，其余请求捕获唯一约束冲突后读取已创建的用户
+        :param phone: 手机号
+        :param fields: 只查询的字段，为None时查询所有字段
+        :param max_attempts: 用户名冲突时的最大尝试次数
+        :return: (用户, 是否新创建)
+        """
+        queryset = self.get_queryset()
+        if fields:
+            queryset = queryset.only(*fields)
+        
+        try:
+            return queryset.get(phone=phone), False
+        except self.model.DoesNotExist:
+            pass
+        
+        for _attempt in range(max_attempts):
+            pk = uuid.uuid4()
+            user = self.model(pk=pk, phone=phone, username=f"user_{pk.hex[:12]}")
+            # 不设置密码，只能通过短信验证码登录
+            user.set_unusable_password()
+            try:
+                # 单独的保存点，冲突时不影响外层事务
+                with transaction.atomic(using=self.db):
+                    user.save(using=self.db, force_insert=True)
+                return user, True
+            except IntegrityError:
+                try:
+                    return queryset.get(phone=phone), False
+                except self.model.DoesNotExist:
+                    # 手机号没有冲突，是生成的用户名重复，换一个主键重试
+                    continue
+        
+        raise IntegrityError(_('创建用户失败，用户名重复'))
 
 class CustomUser(AbstractUser, SoftDeleteModel):
     """
     自定义用户模型，使用邮箱作为唯一标识符，并继承软删除模型
     """
-    username = models.CharField(_('用户名'), max_length=150, unique=True)
-    email = models.EmailField(_('邮箱地址'), unique=True, blank=True, null=True)
-    phone = models.CharField(_('手机号码'), max_length=15, unique=True, default='00000000000')
+    # 用户名、手机号和邮箱只在未删除的用户中唯一，见Meta.constraints
+    username = models.CharField(_('用户名'), max_length=150)
+    email = models.EmailField(_('邮箱地址'), blank=True, null=True)
+    phone = models.CharField(_('手机号码'), max_length=15, default='00000000000')
     is_active = models.BooleanField(_('激活状态'), default=True)
     is_staff = models.BooleanField(_('员工状态'), default=False)
+    # 令牌版本，签发的令牌中带有该值，递增后之前签发的所有令牌失效
+    token_version = models.PositiveIntegerField(_('令牌版本'), default=0)
     
     # 自定义字段
     bio = models.TextField(_('个人简介'), blank=True, null=True)
@@ -132,20 +308,118 @@ class CustomUser(AbstractUser, SoftDeleteModel):
     
     # 使用自定义管理器
     objects = CustomUserManager()
+    all_objects = UserQuerySet.as_manager()
     
     USERNAME_FIELD = 'phone'
     REQUIRED_FIELDS = ['username']
     
+    # 写入令牌声明或用于登录的字段，这些字段变化时之前签发的令牌全部失效
+    TOKEN_CLAIM_FIELDS = ('username', 'password', 'is_staff', 'is_superuser', 'is_active')
+    
     class Meta:
         verbose_name = _('用户')
         verbose_name_plural = _('用户')
+        # 部分索引只包含未删除的行，软删除的用户越来越多时，按手机号、邮箱查询和按创建时间列表仍然只扫描有效数据；
+        # 用户被删除后其用户名、手机号和邮箱可以重新注册
+        constraints = [
+            models.UniqueConstraint(
+                fields=['username'],
+                condition=models.Q(is_deleted=False),
+                name='users_live_username_uniq',
+            ),
+            models.UniqueConstraint(
+                fields=['phone'],
+                condition=models.Q(is_deleted=False),
+                name='users_live_phone_uniq',
+            ),
+            models.UniqueConstraint(
+                fields=['email'],
+                condition=models.Q(is_deleted=False),
+                name='users_live_email_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['-created_at'],
+                condition=models.Q(is_deleted=False),
+                name='users_live_created_idx',
+            ),
+            # 已删除用户列表和清理按删除时间查询
+            models.Index(
+                fields=['deleted_at', 'id'],
+                condition=models.Q(is_deleted=True),
+                name='users_deleted_at_idx',
+            ),
+        ]
         
     def __str__(self):
         return self.phone
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        记录从数据库读取时的令牌声明字段值，保存时据此判断是否需要撤销令牌
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._remember_token_claims()
+        return instance
+    
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        # 包括延迟加载字段在首次访问时的读取
+        self._remember_token_claims(fields)
+    
+    def _remember_token_claims(self, update_fields=None):
+        """
+        记录数据库中令牌声明字段的当前值，update_fields不为None时只更新其中的字段
+        """
+        claims = getattr(self, '_token_claims', {}) if update_fields is not None else {}
+        self._token_claims = {**claims, **{
+            name: self.__dict__[name] for name in self.TOKEN_CLAIM_FIELDS
+            if name in self.__dict__ and (update_fields is None or name in update_fields)
+        }}
+    
+    def _token_claims_changed(self, update_fields=None):
+        """
+        判断本次保存是否修改了令牌声明字段
+        读取时延迟加载、之后才取值或赋值的字段没有记录原值，从数据库查询原值比较
+        """
+        if self._state.adding:
+            return False
+        names = [
+            name for name in self.TOKEN_CLAIM_FIELDS
+            if name in self.__dict__ and (update_fields is None or name in update_fields)
+        ]
+        loaded = getattr(self, '_token_claims', {})
+        unknown = [name for name in names if name not in loaded]
+        if unknown:
+            loaded = {**loaded, **(type(self).all_objects.filter(pk=self.pk).values(*unknown).first() or {})}
+        return any(name in loaded and loaded[name] != self.__dict__[name] for name in names)
+    
+    def revoke_tokens(self):
+        """
+        递增令牌版本，使该用户之前签发的所有令牌失效
+        在数据库中原子递增，并发撤销不会丢失；新版本号同时写入缓存，认证时只需读取缓存
+        """
+        from .authentication import cache_token_version
+        
+        type(self).all_objects.filter(pk=self.pk).update(token_version=models.F('token_version') + 1)
+        self.refresh_from_db(fields=['token_version'])
+        cache_token_version(self.pk, self.token_version)
+        # update不触发post_save信号，需要手动使缓存的用户对象失效
+        invalidate_tags(user_cache_tag(self.pk))
+    
+    def delete(self, using=None, keep_parents=False):
+        """
+        软删除用户，同时撤销该用户的所有令牌
+        """
+        self.revoke_tokens()
+        super().delete(using=using, keep_parents=keep_parents)
         
     def save(self, *args, **kwargs):
         """
         重写保存方法，确保UUID格式正确
+        用户名、密码、权限或激活状态变化时撤销之前签发的令牌，令牌中的声明不会与数据库不一致
         """
         # 如果是新创建的用户且ID不是UUID格式，则生成新的UUID
         if not self.pk or not isinstance(self.pk, uuid.UUID):
@@ -156,4 +430,10 @@ class CustomUser(AbstractUser, SoftDeleteModel):
             except (ValueError, AttributeError):
                 # 如果转换失败，生成新的UUID
                 self.pk = uuid.uuid4()
+        
+        update_fields = kwargs.get('update_fields')
+        claims_changed = self._token_claims_changed(update_fields)
         super().save(*args, **kwargs)
+        self._remember_token_claims(update_fields)
+        if claims_changed:
+            self.revoke_tokens()
@@ -1,12 +1,18 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
-from .utils.serializers import SoftDeleteModelSerializer, DynamicFieldsModelSerializer
+from django.db import IntegrityError
+from .utils.serializers import SoftDeleteModelSerializer, DynamicFieldsModelSerializer, BulkListSerializer
 from django.utils.translation import gettext_lazy as _
-from rest_framework_simplejwt.tokens import RefreshToken
+from django.core.cache import cache
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import aware_utcnow, datetime_from_epoch
 from users.utils.sms import SMSUtil
+from .utils.passwords import get_password_hash_pool
+from .authentication import UserRefreshToken
 import re
-import uuid
 
 User = get_user_model()
 
@@ -19,6 +25,51 @@ class UserSerializer(SoftDeleteModelSerializer, DynamicFieldsModelSerializer):
         fields = ['id', 'email', 'username', 'phone', 'bio', 'avatar', 'created_at', 'updated_at', 'is_active', 'is_deleted', 'deleted_at']
         read_only_fields = ['created_at', 'updated_at', 'is_active', 'is_deleted', 'deleted_at']
 
+class UserTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    用户名密码登录序列化器，签发带有用户声明的令牌
+    """
+    token_class = UserRefreshToken
+
+class UserTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    刷新令牌序列化器
+    刷新时从数据库读取用户，令牌版本不一致或用户已停用时拒绝，新令牌的用户声明按数据库中的值重新生成，
+    过期的权限声明不会随刷新延续；
+    开启刷新令牌轮换时，已使用过的刷新令牌的jti写入缓存直到其过期，同一个刷新令牌只能使用一次
+    """
+    token_class = UserRefreshToken
+    
+    # 已使用的刷新令牌jti的缓存键前缀
+    USED_JTI_CACHE_PREFIX = 'token_used_jti'
+    # 刷新时查询的用户字段：令牌中的用户声明
+    USER_FIELDS = ['id', 'username', 'is_staff', 'is_superuser', 'is_active', 'token_version']
+    
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        
+        if api_settings.USER_ID_CLAIM not in refresh:
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        
+        user = User.objects.filter(pk=refresh[api_settings.USER_ID_CLAIM]).only(*self.USER_FIELDS).first()
+        if user is None or not user.is_active:
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        if user.token_version != refresh.get('token_version', 0):
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+        
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            # cache.add是原子的，并发使用同一个刷新令牌时只有一个请求成功
+            remaining = (datetime_from_epoch(refresh['exp']) - aware_utcnow()).total_seconds()
+            used_key = f"{self.USED_JTI_CACHE_PREFIX}:{refresh[api_settings.JTI_CLAIM]}"
+            if not cache.add(used_key, 1, max(1, int(remaining) + 1)):
+                raise AuthenticationFailed(_("Token has already been used"), 'token_used')
+        
+        new_refresh = self.token_class.for_user(user)
+        data = {'access': str(new_refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            data['refresh'] = str(new_refresh)
+        return data
+
 class UserCreateSerializer(serializers.ModelSerializer):
     """
     用户创建序列化器，用于用户注册
@@ -29,6 +80,7 @@ class UserCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['email', 'username', 'password', 'password2', 'phone', 'bio']
+        list_serializer_class = BulkListSerializer
 
     def validate(self, attrs):
         if attrs['password'] != attrs['password2']:
@@ -39,6 +91,19 @@ class UserCreateSerializer(serializers.ModelSerializer):
         validated_data.pop('password2')
         user = User.objects.create_user(**validated_data)
         return user
+    
+    def build_instances(self, validated_data):
+        """
+        批量创建时构造未保存的用户，密码哈希在线程池中并行计算
+        """
+        passwords = []
+        for attrs in validated_data:
+            attrs.pop('password2')
+            passwords.append(attrs.pop('password'))
+        users = [User(**attrs) for attrs in validated_data]
+        for user, encoded in zip(users, get_password_hash_pool().make_passwords(passwords)):
+            user.password = encoded
+        return users
 
 class UserUpdateSerializer(serializers.ModelSerializer):
     """
@@ -47,6 +112,7 @@ class UserUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['username', 'phone', 'bio', 'avatar']
+        list_serializer_class = BulkListSerializer
 
 class ChangePasswordSerializer(serializers.Serializer):
     """
@@ -106,6 +172,9 @@ class SMSLoginSerializer(SMSVerificationSerializer):
     """
     短信验证码登录序列化器
     """
+    # 登录时查询的用户字段：返回的用户信息和令牌中的用户声明
+    USER_FIELDS = UserSerializer.Meta.fields + ['is_staff', 'is_superuser', 'token_version']
+    
     def validate(self, attrs):
         """
         验证短信验证码并返回用户信息和token
@@ -113,21 +182,18 @@ class SMSLoginSerializer(SMSVerificationSerializer):
         attrs = super().validate(attrs)
         phone = attrs.get('phone')
         
+        # 获取或创建用户，只查询返回用户信息和签发令牌需要的字段
         try:
-            user = User.objects.get(phone=phone)
-        except User.DoesNotExist:
-            # 如果用户不存在，则创建一个新用户
-            user = User.objects.create_user(
-                phone=phone,
-                username=str(uuid.uuid4())[:8],  # 使用UUID生成用户名
-                password=None  # 不设置密码，只能通过短信验证码登录
-            )
+            user, created = User.objects.get_or_create_by_phone(phone, fields=self.USER_FIELDS)
+        except IntegrityError as exc:
+            raise serializers.ValidationError({'phone': str(exc)})
         
         # 生成JWT令牌
-        refresh = RefreshToken.for_user(user)
+        refresh = UserRefreshToken.for_user(user)
         
         return {
             'user': user,
+            'created': created,
             'refresh': str(refresh),
             'access': str(refresh.access_token),
         } 
\ No newline at end of file
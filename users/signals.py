@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .utils.cache import invalidate_tags
+
+# 用户列表类缓存的标签，任意用户变更时失效
+USER_LIST_CACHE_TAG = 'users'
+
+def user_cache_tag(user_id):
+    """
+    单个用户相关缓存的标签
+    """
+    return f"user:{user_id}"
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_cache(sender, instance, **kwargs):
+    """
+    用户数据变更（包括软删除，软删除同样通过save完成）时，使相关缓存失效
+    """
+    invalidate_tags(user_cache_tag(instance.pk), USER_LIST_CACHE_TAG)
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def clear_token_version(sender, instance, **kwargs):
+    """
+    用户被真正删除后清除缓存的令牌版本，认证时查询不到用户即拒绝该用户的令牌
+    """
+    from .authentication import token_version_cache_key
+    cache.delete(token_version_cache_key(instance.pk))
@@ -1,3 +1,1555 @@
-from django.test import TestCase
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+import weakref
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser, Group
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .authentication import UserRefreshToken, get_cached_user, get_cached_user_fields
+from .utils.cache import (
+    LocalLRUCache, RateLimiter, cache_result, compare_and_delete, get_local_cache, get_or_compute,
+    invalidate_tags,
+)
+from .utils.cache_backends import SQLiteCache
+from .utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from .utils.helpers import get_client_ip
+from .utils.logger import REDACTED, QueuedFileHandler, RequestLogMiddleware, get_request_log, summarize_payload
+from .utils.passwords import PasswordHashPoolBusy
+from .utils.sms import SMSBatcher, SMSDispatcher, SMSSender, SMSUtil
+from .utils.sms_backends import (
+    ConsoleSMSBackend, InMemorySMSBackend, SMSBackendError, SMSClientPool, TencentSMSBackend,
+    _reset_pools_after_fork, get_backend, load_backend,
+)
+from .utils.throttling import UserRateLimitThrottle
 
-# Create your tests here.
+User = get_user_model()
+
+
+@override_settings(
+    ALLOWED_HOSTS=['*'],
+    # 测试中使用快速的密码哈希和进程内缓存，不读写本机的缓存文件
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class UserTestCase(TestCase):
+    """
+    用户测试基类，每个测试前清空缓存
+    """
+    password = 'Vx-test-pass-2024'
+
+    def setUp(self):
+        cache.clear()
+        get_local_cache().clear()
+        self.client = APIClient(HTTP_HOST='localhost')
+
+    def create_user(self, phone, username=None, **extra_fields):
+        return User.objects.create_user(phone, username or f'user_{phone}', self.password, **extra_fields)
+
+    def authenticate(self, user):
+        """
+        使用为用户签发的访问令牌认证之后的请求
+        """
+        token = UserRefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+
+class TokenRevocationTests(UserTestCase):
+    """
+    令牌版本撤销和刷新令牌轮换
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('13800000001')
+
+    def refresh(self, token):
+        return self.client.post('/api/users/token/refresh/', {'refresh': str(token)}, format='json')
+
+    def test_revoke_tokens_rejects_issued_access_token(self):
+        self.authenticate(self.user)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+
+        self.user.revoke_tokens()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_token_version_mismatch_is_rejected(self):
+        token = UserRefreshToken.for_user(self.user)
+        token['token_version'] = self.user.token_version + 1
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token.access_token}')
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_changing_claim_fields_revokes_tokens(self):
+        for field, value in (('is_staff', True), ('is_active', False), ('username', 'renamed')):
+            with self.subTest(field=field):
+                user = User.objects.get(pk=self.user.pk)
+                version = user.token_version
+                setattr(user, field, value)
+                user.save()
+                self.assertEqual(User.objects.get(pk=user.pk).token_version, version + 1)
+
+    def test_saving_other_fields_keeps_tokens(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.bio = 'hello'
+        user.save()
+        self.assertEqual(User.objects.get(pk=user.pk).token_version, self.user.token_version)
+
+    def test_self_rename_returns_new_tokens(self):
+        self.authenticate(self.user)
+
+        response = self.client.patch(f'/api/users/{self.user.pk}/', {'username': 'renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['username'], 'renamed')
+        # 旧令牌已撤销，使用响应中的新令牌继续访问
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['tokens']['access']}")
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['username'], 'renamed')
+
+    def test_update_without_claim_changes_keeps_tokens(self):
+        self.authenticate(self.user)
+
+        response = self.client.patch(f'/api/users/{self.user.pk}/', {'bio': 'hello'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('tokens', response.data)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+
+    def test_cached_user_excludes_password_hash(self):
+        self.assertNotIn('password', get_cached_user_fields(self.user.pk))
+
+        user = get_cached_user(self.user.pk)
+        self.assertEqual(user.phone, self.user.phone)
+        self.assertIn('password', user.get_deferred_fields())
+        # 密码哈希在需要时从数据库读取
+        self.assertTrue(user.check_password(self.password))
+
+    def test_refresh_token_can_only_be_used_once(self):
+        token = UserRefreshToken.for_user(self.user)
+
+        response = self.refresh(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('refresh', response.data)
+
+        self.assertEqual(self.refresh(token).status_code, 401)
+        self.assertEqual(self.refresh(response.data['refresh']).status_code, 200)
+
+    def test_refresh_rejects_revoked_token(self):
+        token = UserRefreshToken.for_user(self.user)
+        self.user.revoke_tokens()
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_refresh_rebuilds_claims_from_database(self):
+        token = UserRefreshToken.for_user(self.user)
+        # update不调用save，不撤销令牌，刷新时仍应读取数据库中的最新值
+        User.objects.filter(pk=self.user.pk).update(username='renamed', is_staff=True)
+
+        response = self.refresh(token)
+        self.assertEqual(response.status_code, 200)
+        access = UserRefreshToken(response.data['refresh']).access_token
+        self.assertEqual(access['username'], 'renamed')
+        self.assertTrue(access['is_staff'])
+
+
+class SMSLoginTests(UserTestCase):
+    """
+    短信验证码登录
+    """
+    phone = '13800000002'
+
+    def login(self, code='123456'):
+        return self.client.post('/api/users/sms/login/', {'phone': self.phone, 'code': code}, format='json')
+
+    def setUp(self):
+        super().setUp()
+        SMSUtil.store_code(self.phone, '123456')
+
+    def test_existing_user_login_uses_one_query(self):
+        user = self.create_user(self.phone)
+
+        with self.assertNumQueries(1):
+            response = self.login()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['data']['is_new_user'])
+        self.assertEqual(response.data['data']['user']['id'], str(user.pk))
+        access = UserRefreshToken(response.data['data']['refresh']).access_token
+        self.assertEqual(access['token_version'], user.token_version)
+
+    def test_first_login_creates_user(self):
+        response = self.login()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['data']['is_new_user'])
+        user = User.objects.get(phone=self.phone)
+        self.assertFalse(user.has_usable_password())
+
+    def test_code_can_only_be_used_once(self):
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login().status_code, 400)
+
+    def test_wrong_code_is_rejected(self):
+        self.assertEqual(self.login(code='654321').status_code, 400)
+        self.assertFalse(User.objects.filter(phone=self.phone).exists())
+
+
+class BulkOperationTests(UserTestCase):
+    """
+    批量创建、更新、删除接口
+    """
+    def setUp(self):
+        super().setUp()
+        self.admin = self.create_user('13800000010', is_staff=True)
+        self.authenticate(self.admin)
+
+    def new_user_data(self, phone, username=None):
+        return {
+            'phone': phone,
+            'username': username or f'bulk_{phone}',
+            'password': self.password,
+            'password2': self.password,
+        }
+
+    def test_bulk_actions_require_admin(self):
+        user = self.create_user('13800000011')
+        self.authenticate(user)
+
+        responses = [
+            self.client.post('/api/users/bulk_create/', [self.new_user_data('13800000012')], format='json'),
+            self.client.patch('/api/users/bulk_update/', [{'id': str(user.pk), 'bio': 'x'}], format='json'),
+            self.client.post('/api/users/bulk_delete/', {'ids': [str(user.pk)]}, format='json'),
+        ]
+        self.assertEqual([response.status_code for response in responses], [403, 403, 403])
+        self.assertFalse(User.objects.filter(phone='13800000012').exists())
+
+    def test_bulk_create(self):
+        response = self.client.post('/api/users/bulk_create/', [
+            self.new_user_data('13800000012'),
+            self.new_user_data('13800000013'),
+        ], format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(User.objects.filter(phone__in=['13800000012', '13800000013']).count(), 2)
+        self.assertTrue(User.objects.get(phone='13800000012').check_password(self.password))
+
+    def test_bulk_create_rejects_duplicates(self):
+        response = self.client.post('/api/users/bulk_create/', [
+            self.new_user_data('13800000012', username='same'),
+            self.new_user_data('13800000013', username='same'),
+            self.new_user_data('13800000010'),
+        ], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        errors = response.data['message']
+        self.assertEqual(errors[0], {})
+        self.assertIn('username', errors[1])
+        self.assertIn('phone', errors[2])
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_bulk_requests_must_be_non_empty_and_bounded(self):
+        self.assertEqual(self.client.post('/api/users/bulk_create/', [], format='json').status_code, 400)
+        with override_settings(BULK_OPERATIONS={'MAX_ITEMS': 1}):
+            response = self.client.post('/api/users/bulk_delete/', {'ids': ['a', 'b']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_update(self):
+        first, second = self.create_user('13800000011'), self.create_user('13800000012')
+
+        response = self.client.patch('/api/users/bulk_update/', [
+            {'id': str(first.pk), 'bio': 'first'},
+            {'id': str(second.pk), 'username': 'second'},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 200)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.bio, 'first')
+        self.assertEqual(second.username, 'second')
+        # 修改了令牌声明字段，之前签发的令牌被撤销
+        self.assertEqual(first.token_version, 1)
+        self.assertEqual(second.token_version, 1)
+
+    def test_bulk_update_rejects_unknown_id(self):
+        user = self.create_user('13800000011')
+
+        response = self.client.patch('/api/users/bulk_update/', [
+            {'id': str(user.pk), 'bio': 'x'},
+            {'id': '00000000-0000-0000-0000-000000000000', 'bio': 'x'},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('id', response.data['message'][1])
+        user.refresh_from_db()
+        self.assertIsNone(user.bio)
+
+    def test_bulk_update_rejects_taken_value(self):
+        user = self.create_user('13800000011')
+
+        response = self.client.patch('/api/users/bulk_update/', [
+            {'id': str(user.pk), 'phone': '13800000010'},
+            {'id': str(self.admin.pk), 'username': self.admin.username},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        # 与其他用户的值重复时报错，与自身原有的值相同时不报错
+        self.assertIn('phone', response.data['message'][0])
+        self.assertEqual(response.data['message'][1], {})
+        user.refresh_from_db()
+        self.assertEqual(user.phone, '13800000011')
+
+    def test_bulk_delete(self):
+        user = self.create_user('13800000011')
+
+        response = self.client.post('/api/users/bulk_delete/', {'ids': [str(user.pk), 'not-a-uuid']}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['status'] for item in response.data['data']], ['deleted', 'not_found'])
+        deleted = User.all_objects.get(pk=user.pk)
+        self.assertTrue(deleted.is_deleted)
+        self.assertEqual(deleted.token_version, 1)
+
+
+class AsyncAuthViewTests(UserTestCase):
+    """
+    异步认证接口：登录、注册、修改密码
+    """
+    new_password = 'Nw-test-pass-2025'
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('13800000101')
+        self.async_client = AsyncClient(HTTP_HOST='localhost')
+
+    async def post(self, url, data, **kwargs):
+        return await self.async_client.post(url, data, content_type='application/json', **kwargs)
+
+    def bearer(self, access):
+        return {'Authorization': f'Bearer {access}'}
+
+    async def test_token_returns_working_tokens(self):
+        response = await self.post('/api/users/async/token/', {'phone': self.user.phone, 'password': self.password})
+        self.assertEqual(response.status_code, 200)
+
+        access = response.json()['access']
+        response = await self.async_client.get('/api/users/me/', headers=self.bearer(access))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['phone'], self.user.phone)
+
+    async def test_token_rejects_bad_credentials(self):
+        response = await self.post('/api/users/async/token/', {'phone': self.user.phone, 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+        response = await self.post('/api/users/async/token/', {'phone': '13800000109', 'password': self.password})
+        self.assertEqual(response.status_code, 401)
+        response = await self.post('/api/users/async/token/', {'phone': self.user.phone})
+        self.assertEqual(response.status_code, 400)
+        response = await self.post('/api/users/async/token/', '[]')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_register(self):
+        data = {'phone': '13800000102', 'username': 'async_user', 'password': self.new_password,
+                'password2': self.new_password}
+        response = await self.post('/api/users/async/register/', data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['data']['username'], 'async_user')
+
+        user = await User.objects.aget(phone='13800000102')
+        self.assertTrue(user.check_password(self.new_password))
+        # 手机号已注册
+        response = await self.post('/api/users/async/register/', dict(data, username='other'))
+        self.assertEqual(response.status_code, 400)
+
+    async def test_change_password_revokes_old_tokens(self):
+        old_access = str(UserRefreshToken.for_user(self.user).access_token)
+        data = {'old_password': self.password, 'new_password': self.new_password,
+                'new_password2': self.new_password}
+
+        response = await self.async_client.put('/api/users/async/change_password/', data,
+                                               content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+        response = await self.async_client.put('/api/users/async/change_password/', data,
+                                               content_type='application/json', headers=self.bearer(old_access))
+        self.assertEqual(response.status_code, 200)
+        new_access = response.json()['data']['access']
+
+        response = await self.async_client.get('/api/users/me/', headers=self.bearer(old_access))
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get('/api/users/me/', headers=self.bearer(new_access))
+        self.assertEqual(response.status_code, 200)
+        user = await User.objects.aget(pk=self.user.pk)
+        self.assertTrue(user.check_password(self.new_password))
+
+    async def test_change_password_rejects_wrong_old_password(self):
+        access = str(UserRefreshToken.for_user(self.user).access_token)
+        data = {'old_password': 'wrong', 'new_password': self.new_password, 'new_password2': self.new_password}
+        response = await self.async_client.put('/api/users/async/change_password/', data,
+                                               content_type='application/json', headers=self.bearer(access))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], '旧密码不正确')
+
+    async def test_busy_hash_pool_returns_503(self):
+        pool = mock.Mock()
+        pool.check_password = mock.AsyncMock(side_effect=PasswordHashPoolBusy)
+        with mock.patch('users.async_views.get_password_hash_pool', return_value=pool):
+            response = await self.post('/api/users/async/token/', {'phone': self.user.phone, 'password': self.password})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+
+
+class SoftDeleteManagerTests(UserTestCase):
+    """
+    软删除管理器和批量软删除、恢复
+    """
+    def setUp(self):
+        super().setUp()
+        self.alive = self.create_user('13800000021')
+        self.deleted = self.create_user('13800000022')
+        self.deleted.delete()
+
+    def test_default_manager_excludes_deleted_users(self):
+        self.assertEqual(list(User.objects.all()), [self.alive])
+        self.assertEqual(list(User.objects.only_deleted()), [self.deleted])
+        self.assertEqual(User.objects.all_with_deleted().count(), 2)
+        self.assertEqual(User.all_objects.count(), 2)
+
+    def test_delete_is_soft_and_revokes_tokens(self):
+        self.alive.delete()
+
+        user = User.all_objects.get(pk=self.alive.pk)
+        self.assertTrue(user.is_deleted)
+        self.assertIsNotNone(user.deleted_at)
+        self.assertEqual(user.token_version, 1)
+
+    def test_queryset_delete_and_restore(self):
+        count, per_model = User.objects.all().delete()
+        self.assertEqual(count, 1)
+        self.assertEqual(per_model, {User._meta.label: 1})
+        self.assertEqual(User.all_objects.get(pk=self.alive.pk).token_version, 1)
+        # 已删除的用户保留原来的删除时间
+        self.assertEqual(User.all_objects.get(pk=self.deleted.pk).deleted_at, self.deleted.deleted_at)
+
+        self.assertEqual(User.all_objects.all().restore(), 2)
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_hard_delete(self):
+        User.all_objects.filter(pk=self.deleted.pk).hard_delete()
+        self.assertFalse(User.all_objects.filter(pk=self.deleted.pk).exists())
+
+
+class LiveUniquenessTests(UserTestCase):
+    """
+    用户名、手机号和邮箱只在未删除的用户中唯一
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('13800000031', username='taken', email='taken@example.com')
+
+    def register(self, **data):
+        data = {'phone': '13800000032', 'username': 'fresh', 'password': self.password, 'password2': self.password, **data}
+        return self.client.post('/api/users/', data, format='json')
+
+    def test_live_duplicates_violate_constraints(self):
+        for field, value in (('username', 'taken'), ('phone', '13800000031'), ('email', 'taken@example.com')):
+            with self.subTest(field=field):
+                data = {'phone': '13800000032', 'username': 'fresh', field: value}
+                with self.assertRaises(IntegrityError), transaction.atomic():
+                    User.objects.create_user(password=self.password, **data)
+
+    def test_deleted_user_values_can_be_reused(self):
+        self.user.delete()
+
+        self.create_user('13800000031', username='taken', email='taken@example.com')
+        self.assertEqual(User.all_objects.filter(username='taken').count(), 2)
+
+        # 原用户的值已被新用户使用，不能恢复
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.all_objects.filter(pk=self.user.pk).restore()
+
+    def test_register_rejects_live_duplicates(self):
+        for field, value in (('username', 'taken'), ('phone', '13800000031')):
+            with self.subTest(field=field):
+                response = self.register(**{field: value})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.data)
+
+    def test_register_reuses_deleted_username(self):
+        self.user.delete()
+
+        response = self.register(username='taken', phone='13800000031')
+        self.assertEqual(response.status_code, 201)
+
+
+class RateLimiterTests(UserTestCase):
+    """
+    滑动窗口和令牌桶限流的边界
+    """
+    def test_sliding_window_allows_exactly_limit(self):
+        limiter = RateLimiter('test', limit=3, period=60)
+        with mock.patch('users.utils.cache.time.time', return_value=6000.0):
+            self.assertEqual([limiter.is_allowed('a') for _ in range(4)], [True, True, True, False])
+            self.assertEqual(limiter.get_remaining('a'), 0)
+            self.assertEqual(limiter.get_remaining('b'), 3)
+
+    def test_sliding_window_weights_previous_window(self):
+        limiter = RateLimiter('test', limit=4, period=60)
+        with mock.patch('users.utils.cache.time.time', return_value=6000.0):
+            for _ in range(4):
+                limiter.is_allowed('a')
+        # 下一窗口过去一半时，上一窗口的4次按一半计算
+        with mock.patch('users.utils.cache.time.time', return_value=6090.0):
+            self.assertEqual([limiter.is_allowed('a') for _ in range(3)], [True, True, False])
+
+    def test_check_counts_all_identifiers_or_none(self):
+        limiter = RateLimiter('test', limit=1, period=60)
+        self.assertTrue(limiter.is_allowed('ip'))
+
+        self.assertEqual(limiter.check(['user', 'ip']), (False, 'ip'))
+        # 拒绝时其他标识符不计数
+        self.assertEqual(limiter.get_remaining('user'), 1)
+
+    def test_token_bucket_burst_and_release(self):
+        limiter = RateLimiter('test', limit=3, period=60, algorithm=RateLimiter.TOKEN_BUCKET)
+        self.assertEqual([limiter.is_allowed('a') for _ in range(4)], [True, True, True, False])
+
+        limiter.release('a')
+        self.assertTrue(limiter.is_allowed('a'))
+        self.assertFalse(limiter.is_allowed('a'))
+
+    def test_release_restores_sliding_window_count(self):
+        limiter = RateLimiter('test', limit=1, period=60)
+        self.assertTrue(limiter.is_allowed('a'))
+        limiter.release('a')
+        limiter.release('a')
+        self.assertEqual(limiter.get_remaining('a'), 1)
+        self.assertTrue(limiter.is_allowed('a'))
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(ValueError):
+            RateLimiter('test', algorithm='leaky_bucket')
+
+
+class ThrottleTests(UserTestCase):
+    """
+    按客户端IP的接口限流
+    """
+    def test_forged_forwarded_for_does_not_bypass_sms_throttle(self):
+        # sms限流频率为每分钟10次，每次使用不同的手机号和伪造的X-Forwarded-For
+        statuses = [
+            self.client.post('/api/users/sms/login/', {'phone': f'139000000{i:02d}', 'code': '000000'},
+                             format='json', REMOTE_ADDR='203.0.113.7', HTTP_X_FORWARDED_FOR=f'1.1.1.{i}').status_code
+            for i in range(11)
+        ]
+        self.assertEqual(statuses[:10], [400] * 10)
+        self.assertEqual(statuses[10], 429)
+
+    def test_anonymous_user_throttle_uses_trusted_client_ip(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='203.0.113.7', HTTP_X_FORWARDED_FOR='1.1.1.1')
+        request.user = AnonymousUser()
+        self.assertEqual(UserRateLimitThrottle().get_identifiers(request, None), ['ip:203.0.113.7'])
+
+
+class SMSSendLimitTests(UserTestCase):
+    """
+    发送验证码前的发送间隔和每日次数限制
+    """
+    phone = '13800000041'
+
+    def limits(self, **config):
+        return override_settings(SMS_SEND_LIMITS={
+            'PHONE_COOLDOWN': 0, 'IP_COOLDOWN': 0, 'PHONE_DAILY_LIMIT': 0, 'IP_DAILY_LIMIT': 0, **config,
+        })
+
+    def check(self, phone=None, ip='10.0.0.1'):
+        allowed, _reason = SMSUtil.check_send_limits(phone or self.phone, ip)
+        return allowed
+
+    def test_phone_cooldown(self):
+        with self.limits(PHONE_COOLDOWN=60):
+            self.assertTrue(self.check())
+            allowed, reason = SMSUtil.check_send_limits(self.phone, '10.0.0.2')
+            self.assertFalse(allowed)
+            self.assertIn('60', reason)
+            self.assertTrue(self.check(phone='13800000042'))
+
+            SMSUtil.release_send_limits(self.phone)
+            self.assertTrue(self.check())
+
+    def test_ip_cooldown_rejection_releases_phone_cooldown(self):
+        with self.limits(PHONE_COOLDOWN=60, IP_COOLDOWN=60):
+            self.assertTrue(self.check(phone='13800000042'))
+            self.assertFalse(self.check())
+            self.assertTrue(self.check(ip='10.0.0.2'))
+
+    def test_phone_daily_limit(self):
+        with self.limits(PHONE_DAILY_LIMIT=3):
+            self.assertEqual([self.check(ip=f'10.0.0.{i}') for i in range(4)], [True, True, True, False])
+
+    def test_ip_daily_limit_does_not_consume_phone_quota(self):
+        with self.limits(PHONE_DAILY_LIMIT=2, IP_DAILY_LIMIT=1):
+            self.assertTrue(self.check(phone='13800000042'))
+            self.assertFalse(self.check())
+            self.assertFalse(self.check())
+            # 被IP限制拒绝的请求没有计入手机号的每日次数
+            self.assertEqual([self.check(ip='10.0.0.2'), self.check(ip='10.0.0.3'), self.check(ip='10.0.0.4')],
+                             [True, True, False])
+
+    def test_daily_limit_rejection_releases_cooldown(self):
+        with self.limits(PHONE_COOLDOWN=60, IP_DAILY_LIMIT=1):
+            self.assertTrue(self.check(phone='13800000042'))
+            self.assertFalse(self.check())
+            self.assertTrue(self.check(ip='10.0.0.2'))
+
+
+@override_settings(
+    SMS_BACKEND={'BACKEND': 'users.utils.sms_backends.InMemorySMSBackend', 'OPTIONS': {}},
+    SMS_DISPATCH={'ASYNC': False},
+)
+class SMSSendViewTests(UserTestCase):
+    """
+    发送验证码接口按客户端IP的限制
+    """
+    def send(self, phone, forwarded_for):
+        return self.client.post('/api/users/sms/send/', {'phone': phone}, format='json',
+                                REMOTE_ADDR='203.0.113.7', HTTP_X_FORWARDED_FOR=forwarded_for)
+
+    def test_forged_forwarded_for_does_not_bypass_ip_cooldown(self):
+        with override_settings(SMS_SEND_LIMITS={'PHONE_COOLDOWN': 0, 'IP_COOLDOWN': 60}):
+            self.assertEqual(self.send('13800000043', '1.1.1.1').status_code, 200)
+            self.assertEqual(self.send('13800000044', '2.2.2.2').status_code, 400)
+
+    def test_forged_forwarded_for_does_not_bypass_ip_daily_limit(self):
+        with override_settings(SMS_SEND_LIMITS={'IP_DAILY_LIMIT': 2}):
+            statuses = [self.send(f'1380000005{i}', f'1.1.1.{i}').status_code for i in range(3)]
+        self.assertEqual(statuses, [200, 200, 400])
+
+
+@override_settings(
+    SMS_DISPATCH={'ASYNC': True},
+    SMS_SEND_LIMITS={'PHONE_COOLDOWN': 60, 'IP_COOLDOWN': 60, 'PHONE_DAILY_LIMIT': 1, 'IP_DAILY_LIMIT': 1},
+)
+class AsyncSMSDispatchTests(UserTestCase):
+    """
+    异步发送验证码，最终发送失败时的清理
+    """
+    phone = '13800000045'
+    ip = '10.0.0.1'
+
+    def dispatch(self, sender):
+        dispatcher = SMSDispatcher(sender=sender, max_workers=1, max_retries=1, retry_backoff=0)
+        with mock.patch('users.utils.sms.get_dispatcher', return_value=dispatcher):
+            success, _message, task_id = SMSUtil.dispatch_verification_code(self.phone, self.ip)
+        self.assertTrue(success)
+
+        deadline = time.monotonic() + 5
+        while dispatcher.get_status(task_id)['status'] not in (SMSDispatcher.STATUS_SENT, SMSDispatcher.STATUS_FAILED):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        # 失败状态在清理之后写入，此时清理已完成；关闭测试用的线程池
+        dispatcher._get_executor().shutdown(wait=True)
+        return dispatcher.get_status(task_id)
+
+    def assert_released(self):
+        self.assertIsNone(SMSUtil.get_code(self.phone))
+        # 发送间隔和每日次数都已撤销，可以立即重新发送
+        self.assertEqual(SMSUtil.check_send_limits(self.phone, self.ip), (True, None))
+
+    def test_rejected_send_releases_limits_and_code(self):
+        status = self.dispatch(mock.Mock(return_value=(False, '号码无效')))
+        self.assertEqual(status['status'], SMSDispatcher.STATUS_FAILED)
+        self.assert_released()
+
+    def test_failed_retries_release_limits_and_code(self):
+        sender = mock.Mock(side_effect=SMSBackendError('timeout'))
+        status = self.dispatch(sender)
+        self.assertEqual(status['status'], SMSDispatcher.STATUS_FAILED)
+        self.assertEqual(sender.call_count, 2)
+        self.assert_released()
+
+    def test_delivered_code_keeps_limits(self):
+        status = self.dispatch(mock.Mock(return_value=(True, 'ok')))
+        self.assertEqual(status['status'], SMSDispatcher.STATUS_SENT)
+        self.assertIsNotNone(SMSUtil.get_code(self.phone))
+        self.assertFalse(SMSUtil.check_send_limits(self.phone, self.ip)[0])
+
+
+class CircuitBreakerTests(TestCase):
+    """
+    熔断器的状态切换
+    """
+    def setUp(self):
+        self.breaker = CircuitBreaker('test', window_size=4, minimum_calls=4, open_timeout=30,
+                                      half_open_max_calls=2, slow_call_duration=1.0)
+
+    def open_breaker(self):
+        for failed in (False, False, True, True):
+            self.breaker.allow()
+            self.breaker.record(0.01, failed)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def after_open_timeout(self):
+        # 只替换熔断器模块中的time，不影响其他线程
+        clock = mock.Mock(**{'monotonic.return_value': self.breaker._opened_at + 31})
+        return mock.patch('users.utils.circuit_breaker.time', clock)
+
+    def test_opens_when_failure_rate_reached(self):
+        for _ in range(3):
+            self.breaker.record(0.01, True)
+        # 调用次数未达到minimum_calls，不打开
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.record(0.01, False)
+        self.assertEqual(self.breaker.state, OPEN)
+
+        with self.assertRaises(CircuitOpenError) as ctx:
+            self.breaker.allow()
+        self.assertGreater(ctx.exception.retry_after, 0)
+
+    def test_opens_on_slow_calls(self):
+        for _ in range(4):
+            self.breaker.record(2.0, False)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_half_open_probes_close_the_breaker(self):
+        self.open_breaker()
+        with self.after_open_timeout():
+            self.assertEqual(self.breaker.state, HALF_OPEN)
+            self.breaker.allow()
+            self.breaker.allow()
+            # 探测调用已满，其余调用被拒绝
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.allow()
+            self.breaker.record(0.01, False)
+            self.assertEqual(self.breaker.state, HALF_OPEN)
+            self.breaker.record(0.01, False)
+            self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_failed_probe_reopens(self):
+        self.open_breaker()
+        with self.after_open_timeout():
+            self.breaker.allow()
+            self.breaker.record(0.01, True)
+            self.assertEqual(self.breaker.state, OPEN)
+
+    def test_call_records_exceptions(self):
+        def fail():
+            raise SMSBackendError('timeout')
+
+        for _ in range(4):
+            with self.assertRaises(SMSBackendError):
+                self.breaker.call(fail)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(fail)
+
+
+class SMSSenderTests(TestCase):
+    """
+    短信发送器的熔断、对冲和备用后端
+    """
+    phones = ['13800000046']
+    params = ['123456', '5']
+
+    def sender(self, primary, secondary=None, **kwargs):
+        kwargs.setdefault('hedge_min_delay', 0.01)
+        kwargs.setdefault('hedge_default_delay', 0.05)
+        sender = SMSSender(primary, secondary, **kwargs)
+        self.addCleanup(lambda: sender._executor and sender._executor.shutdown(wait=True))
+        return sender
+
+    def test_fast_primary_is_not_hedged(self):
+        primary, secondary = InMemorySMSBackend(), InMemorySMSBackend()
+
+        result = self.sender(primary, secondary).send(self.phones, self.params)
+        self.assertEqual(result, {self.phones[0]: (True, 'send success')})
+        self.assertEqual(primary.send_count, 1)
+        self.assertEqual(secondary.send_count, 0)
+
+    def test_slow_primary_is_hedged(self):
+        primary, secondary = InMemorySMSBackend(latency=0.5), InMemorySMSBackend()
+
+        start = time.monotonic()
+        result = self.sender(primary, secondary).send(self.phones, self.params)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(result, {self.phones[0]: (True, 'send success')})
+        self.assertEqual(secondary.last_params(self.phones[0]), self.params)
+
+    def test_failed_primary_falls_back_to_secondary(self):
+        primary, secondary = InMemorySMSBackend(error_rate=1), InMemorySMSBackend()
+
+        result = self.sender(primary, secondary).send(self.phones, self.params)
+        self.assertTrue(result[self.phones[0]][0])
+        self.assertEqual(primary.send_count, 1)
+        self.assertEqual(secondary.send_count, 1)
+
+    def test_all_backends_failing_raises(self):
+        sender = self.sender(InMemorySMSBackend(error_rate=1), InMemorySMSBackend(error_rate=1))
+        with self.assertRaises(SMSBackendError):
+            sender.send(self.phones, self.params)
+
+    def test_open_breaker_skips_primary(self):
+        primary, secondary = InMemorySMSBackend(error_rate=1), InMemorySMSBackend()
+        sender = self.sender(primary, secondary, breaker_options={
+            'window_size': 2, 'minimum_calls': 2, 'open_timeout': 60,
+        })
+        for _ in range(2):
+            sender.send(self.phones, self.params)
+        self.assertEqual(sender.breakers[id(primary)].state, OPEN)
+
+        self.assertTrue(sender.send(self.phones, self.params)[self.phones[0]][0])
+        # 熔断打开后不再调用主后端
+        self.assertEqual(primary.send_count, 2)
+        self.assertEqual(secondary.send_count, 3)
+
+    def test_open_breaker_without_secondary_fails_fast(self):
+        primary = InMemorySMSBackend(error_rate=1)
+        sender = self.sender(primary, breaker_options={'window_size': 2, 'minimum_calls': 2})
+        for _ in range(2):
+            with self.assertRaises(SMSBackendError):
+                sender.send(self.phones, self.params)
+
+        with self.assertRaisesMessage(SMSBackendError, 'sms_primary'):
+            sender.send(self.phones, self.params)
+        self.assertEqual(primary.send_count, 2)
+
+
+class SMSClientPoolTests(TestCase):
+    """
+    腾讯云短信客户端池的复用和fork后重置
+    """
+    def pool(self, **kwargs):
+        pool = SMSClientPool(**kwargs)
+        pool._create_client = mock.Mock(side_effect=object)
+        return pool
+
+    def test_reuses_released_clients(self):
+        pool = self.pool(max_size=2)
+        with pool.client() as first:
+            pass
+        with pool.client() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(pool._create_client.call_count, 1)
+
+    def test_discards_client_after_error(self):
+        pool = self.pool(max_size=1)
+        with self.assertRaises(SMSBackendError):
+            with pool.client() as client:
+                raise SMSBackendError('timeout')
+
+        with pool.client() as other:
+            self.assertIsNot(other, client)
+        self.assertEqual(pool._create_client.call_count, 2)
+
+    def test_exhausted_pool_raises(self):
+        pool = self.pool(max_size=1, acquire_timeout=0.01)
+        pool.acquire()
+        with self.assertRaisesMessage(SMSBackendError, '短信客户端池已耗尽'):
+            pool.acquire()
+
+    def test_fork_hook_resets_live_pools(self):
+        pool = self.pool()
+        pool.release(pool.acquire())
+
+        _reset_pools_after_fork()
+        self.assertEqual(pool._created, 0)
+        self.assertTrue(pool._idle.empty())
+
+        # 钩子只弱引用客户端池，不阻止其被回收
+        ref = weakref.ref(pool)
+        del pool
+        self.assertIsNone(ref())
+
+    @override_settings(SMS_CLIENT_POOL={'MAX_SIZE': 2})
+    def test_tencent_backend_reuses_client(self):
+        client = mock.Mock()
+        client.SendSms.return_value.SendStatusSet = [
+            mock.Mock(PhoneNumber='+8613800000091', Code='Ok', Message='send success'),
+            mock.Mock(PhoneNumber='+8613800000092', Code='LimitExceeded', Message='超出频率限制'),
+        ]
+        backend = TencentSMSBackend()
+        with mock.patch.object(SMSClientPool, '_create_client', return_value=client) as create_client:
+            for _ in range(2):
+                results = backend.send(['13800000091', '13800000092'], ['123456', '5'])
+
+        self.assertEqual(create_client.call_count, 1)
+        self.assertEqual(client.SendSms.call_count, 2)
+        self.assertEqual(results, {
+            '13800000091': (True, 'send success'),
+            '13800000092': (False, '超出频率限制'),
+        })
+        self.assertEqual(backend.pool.max_size, 2)
+
+
+class SMSBackendSelectionTests(TestCase):
+    """
+    按settings.SMS_BACKEND选择短信后端
+    """
+    def test_load_backend_passes_options(self):
+        backend = load_backend({
+            'BACKEND': 'users.utils.sms_backends.InMemorySMSBackend',
+            'OPTIONS': {'latency': 0.5, 'max_outbox': 10},
+        })
+        self.assertIsInstance(backend, InMemorySMSBackend)
+        self.assertEqual(backend.latency, 0.5)
+        self.assertEqual(backend.outbox.maxlen, 10)
+
+    def test_get_backend_is_created_once_per_setting(self):
+        with override_settings(SMS_BACKEND={'BACKEND': 'users.utils.sms_backends.InMemorySMSBackend'}):
+            backend = get_backend()
+            self.assertIsInstance(backend, InMemorySMSBackend)
+            self.assertIs(get_backend(), backend)
+
+        # 配置变化时重新创建后端
+        with override_settings(SMS_BACKEND={'BACKEND': 'users.utils.sms_backends.ConsoleSMSBackend'}):
+            self.assertIsInstance(get_backend(), ConsoleSMSBackend)
+
+    @override_settings(SMS_BACKEND={'BACKEND': 'users.utils.sms_backends.InMemorySMSBackend'},
+                       SMS_BATCH={'ENABLED': False}, SMS_HEDGE={'BACKEND': None})
+    def test_deliver_uses_configured_backend(self):
+        self.assertEqual(SMSUtil.deliver('13800000093', '123456'), (True, '验证码发送成功'))
+        self.assertEqual(get_backend().last_params('13800000093'), ['123456'])
+
+    @override_settings(DEBUG=False)
+    def test_console_backend_redacts_params(self):
+        with self.assertLogs('django', 'INFO') as logs:
+            ConsoleSMSBackend().send(['13800000094'], ['123456'])
+        self.assertNotIn('123456', logs.output[0])
+        self.assertIn(REDACTED, logs.output[0])
+
+
+class SMSBatcherTests(TestCase):
+    """
+    相同模板参数的短信合并发送
+    """
+    params = ['123456', '5']
+
+    def send_concurrently(self, batcher, phones, params=None):
+        """
+        多个线程同时发送，返回 {手机号: 发送结果或异常}
+        """
+        results = {}
+
+        def send(phone):
+            try:
+                results[phone] = batcher.send(phone, params or self.params)
+            except Exception as exc:
+                results[phone] = exc
+
+        threads = [threading.Thread(target=send, args=(phone,)) for phone in phones]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_flushes_when_batch_is_full(self):
+        sender = mock.Mock(side_effect=lambda phones, params: {phone: (True, 'ok') for phone in phones})
+        # 等待时间足够长，只有凑满批次才会在超时前发送
+        batcher = SMSBatcher(sender=sender, max_size=3, max_wait=10)
+        phones = ['13800000071', '13800000072', '13800000073']
+
+        start = time.monotonic()
+        results = self.send_concurrently(batcher, phones)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(results, {phone: (True, 'ok') for phone in phones})
+        sender.assert_called_once()
+        self.assertCountEqual(sender.call_args.args[0], phones)
+        self.assertEqual(sender.call_args.args[1], self.params)
+
+    def test_flushes_after_max_wait(self):
+        sender = mock.Mock(return_value={'13800000071': (True, 'ok')})
+        batcher = SMSBatcher(sender=sender, max_size=200, max_wait=0.01)
+
+        self.assertEqual(batcher.send('13800000071', self.params), (True, 'ok'))
+        sender.assert_called_once_with(['13800000071'], self.params)
+
+    def test_different_params_are_not_merged(self):
+        sender = mock.Mock(side_effect=lambda phones, params: {phone: (True, params[0]) for phone in phones})
+        batcher = SMSBatcher(sender=sender, max_size=200, max_wait=0.01)
+
+        self.assertEqual(batcher.send('13800000071', ['111111', '5']), (True, '111111'))
+        self.assertEqual(batcher.send('13800000072', ['222222', '5']), (True, '222222'))
+        self.assertEqual(sender.call_count, 2)
+
+    def test_splits_batch_results_per_phone(self):
+        sender = mock.Mock(return_value={'13800000071': (True, 'ok'), '13800000072': (False, '号码无效')})
+        batcher = SMSBatcher(sender=sender, max_size=3, max_wait=5)
+
+        results = self.send_concurrently(batcher, ['13800000071', '13800000072', '13800000073'])
+        self.assertEqual(results, {
+            '13800000071': (True, 'ok'),
+            '13800000072': (False, '号码无效'),
+            '13800000073': (False, '未返回发送结果'),
+        })
+
+    def test_failed_batch_raises_for_every_caller(self):
+        sender = mock.Mock(side_effect=SMSBackendError('timeout'))
+        batcher = SMSBatcher(sender=sender, max_size=2, max_wait=5)
+
+        results = self.send_concurrently(batcher, ['13800000071', '13800000072'])
+        self.assertEqual(sender.call_count, 1)
+        for result in results.values():
+            self.assertIsInstance(result, SMSBackendError)
+
+
+class PurgeDeletedUsersTests(UserTestCase):
+    """
+    清理长期软删除用户的命令
+    """
+    def setUp(self):
+        super().setUp()
+        self.live = self.create_user('13800000051')
+        self.recent = self.create_user('13800000052')
+        self.recent.delete()
+        self.old = [self.create_user(f'1380000006{i}') for i in range(3)]
+        User.objects.filter(pk__in=[user.pk for user in self.old]).delete()
+        User.all_objects.filter(pk__in=[user.pk for user in self.old]).update(
+            deleted_at=timezone.now() - timedelta(days=100),
+        )
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.archive = os.path.join(tmpdir.name, 'deleted_users.ndjson')
+
+    def purge(self, *args):
+        call_command('purge_deleted_users', '--sleep', '0', '--archive', self.archive, *args, stdout=StringIO())
+
+    def test_purges_in_batches_and_archives(self):
+        self.purge('--batch-size', '2')
+
+        self.assertEqual(set(User.all_objects.values_list('pk', flat=True)), {self.live.pk, self.recent.pk})
+        with open(self.archive, encoding='utf-8') as archive:
+            rows = [json.loads(line) for line in archive]
+        self.assertEqual({row['id'] for row in rows}, {str(user.pk) for user in self.old})
+        self.assertNotIn('password', rows[0])
+
+    def test_dry_run_and_no_archive(self):
+        self.purge('--dry-run')
+        self.assertEqual(User.all_objects.count(), 5)
+        self.assertFalse(os.path.exists(self.archive))
+
+        self.purge('--no-archive', '--days', '0')
+        self.assertEqual(list(User.all_objects.all()), [self.live])
+        self.assertFalse(os.path.exists(self.archive))
+
+    def test_invalid_arguments(self):
+        for args in (('--days', '-1'), ('--batch-size', '0')):
+            with self.subTest(args=args), self.assertRaises(CommandError):
+                self.purge(*args)
+
+
+class FixUUIDsTests(UserTestCase):
+    """
+    修复主键UUID格式的命令
+    """
+    def setUp(self):
+        super().setUp()
+        self.users = [self.create_user(f'1380000007{i}') for i in range(3)]
+        self.group = Group.objects.create(name='fix_uuids')
+        for user in self.users:
+            user.groups.add(self.group)
+
+    def set_raw_id(self, user, raw_id):
+        """
+        绕过ORM把用户主键及其分组关联改为指定的原始值
+        """
+        with connection.cursor() as cursor:
+            for table, column in (('users_customuser', 'id'), ('users_customuser_groups', 'customuser_id')):
+                cursor.execute(f'UPDATE {table} SET {column} = %s WHERE {column} = %s', [raw_id, user.pk.hex])
+
+    def fix(self, *args):
+        stdout = StringIO()
+        call_command('fix_uuids', '--batch-size', '2', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_fixes_unparsable_ids_and_references(self):
+        parsable, broken, valid = self.users
+        self.set_raw_id(parsable, str(parsable.pk))
+        self.set_raw_id(broken, 'not-a-uuid')
+
+        self.assertIn('修复了 1 个', self.fix())
+
+        # 可以解析的ID默认不改写，无法解析的ID替换为新的UUID
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM users_customuser')
+            raw_ids = {row[0] for row in cursor.fetchall()}
+        self.assertIn(str(parsable.pk), raw_ids)
+        self.assertNotIn('not-a-uuid', raw_ids)
+        ids = set(User.objects.values_list('pk', flat=True))
+        self.assertIn(valid.pk, ids)
+        self.assertNotIn(broken.pk, ids)
+        self.assertEqual(set(self.group.user_set.values_list('pk', flat=True)), ids)
+
+    def test_canonicalize(self):
+        parsable, broken, valid = self.users
+        self.set_raw_id(parsable, str(parsable.pk))
+        self.set_raw_id(broken, 'not-a-uuid')
+
+        self.assertIn('修复了 2 个', self.fix('--canonicalize'))
+
+        ids = set(User.objects.values_list('pk', flat=True))
+        self.assertEqual(len(ids), 3)
+        # 可以解析的ID转换为标准格式，保持原有的UUID值
+        self.assertIn(parsable.pk, ids)
+        self.assertIn(valid.pk, ids)
+        self.assertNotIn(broken.pk, ids)
+        self.assertEqual(set(self.group.user_set.values_list('pk', flat=True)), ids)
+
+    def test_dry_run(self):
+        self.set_raw_id(self.users[0], 'not-a-uuid')
+
+        self.assertIn('1 个需要修复', self.fix('--dry-run'))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM users_customuser WHERE id = %s', ['not-a-uuid'])
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class LocalLRUCacheTests(TestCase):
+    """
+    进程内LRU缓存的容量淘汰和过期
+    """
+    def test_evicts_least_recently_used(self):
+        local_cache = LocalLRUCache(max_size=2, timeout=60)
+        local_cache.set('a', 1)
+        local_cache.set('b', 2)
+        # 访问a后，b成为最久未使用的条目
+        self.assertEqual(local_cache.get('a'), 1)
+        local_cache.set('c', 3)
+
+        self.assertIsNone(local_cache.get('b', None))
+        self.assertEqual(local_cache.get('a'), 1)
+        self.assertEqual(local_cache.get('c'), 3)
+        self.assertEqual(local_cache.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        local_cache = LocalLRUCache(max_size=10, timeout=5)
+        local_cache.set('short', 1, timeout=1)
+        # 存活时间不超过默认存活时间
+        local_cache.set('long', 2, timeout=60)
+
+        now = time.monotonic()
+        with mock.patch('users.utils.cache.time.monotonic', return_value=now + 2):
+            self.assertIsNone(local_cache.get('short', None))
+            self.assertEqual(local_cache.get('long'), 2)
+        with mock.patch('users.utils.cache.time.monotonic', return_value=now + 6):
+            self.assertIsNone(local_cache.get('long', None))
+        self.assertEqual(local_cache.stats()['size'], 0)
+
+    def test_delete_tags(self):
+        local_cache = LocalLRUCache(max_size=10, timeout=60)
+        local_cache.set('a', 1, tags=['user:1'])
+        local_cache.set('b', 2, tags=['user:1', 'user_list'])
+        local_cache.set('c', 3, tags=['user:2'])
+
+        local_cache.delete_tags(['user:1'])
+        self.assertIsNone(local_cache.get('a', None))
+        self.assertIsNone(local_cache.get('b', None))
+        self.assertEqual(local_cache.get('c'), 3)
+        self.assertNotIn('user_list', local_cache._tag_index)
+
+
+class CacheResultTagTests(UserTestCase):
+    """
+    按标签使cache_result的缓存失效
+    """
+    def cached(self, **kwargs):
+        compute = mock.Mock(side_effect=lambda user_id: f'profile:{user_id}:{compute.call_count}')
+
+        @cache_result(prefix='test', tags=['user:{user_id}', 'user_list'], **kwargs)
+        def get_profile(user_id):
+            return compute(user_id)
+
+        return get_profile, compute
+
+    def test_invalidate_tags_makes_entries_miss(self):
+        get_profile, compute = self.cached()
+        self.assertEqual(get_profile(1), 'profile:1:1')
+        self.assertEqual(get_profile(2), 'profile:2:2')
+        self.assertEqual(get_profile(1), 'profile:1:1')
+
+        invalidate_tags('user:1')
+        self.assertEqual(get_profile(1), 'profile:1:3')
+        # 其他标签的缓存不受影响
+        self.assertEqual(get_profile(2), 'profile:2:2')
+
+        invalidate_tags('user_list')
+        self.assertEqual(get_profile(2), 'profile:2:4')
+        self.assertEqual(compute.call_count, 4)
+
+    def test_invalidate_tags_clears_local_cache(self):
+        get_profile, compute = self.cached(local_timeout=60)
+        self.assertEqual(get_profile(1), 'profile:1:1')
+        self.assertEqual(get_profile(1), 'profile:1:1')
+
+        invalidate_tags('user:1')
+        self.assertEqual(get_profile(1), 'profile:1:2')
+        self.assertEqual(compute.call_count, 2)
+
+    def test_invalidate_single_call(self):
+        get_profile, compute = self.cached()
+        get_profile(1)
+        get_profile.invalidate(1)
+        get_profile(1)
+        self.assertEqual(compute.call_count, 2)
+
+
+class GetOrComputeTests(UserTestCase):
+    """
+    单飞重算的缓存读取
+    """
+    def test_computes_once(self):
+        compute = mock.Mock(return_value='value')
+        self.assertEqual(get_or_compute('key', compute), 'value')
+        self.assertEqual(get_or_compute('key', compute), 'value')
+        self.assertEqual(compute.call_count, 1)
+
+    def test_timeout_none_never_expires(self):
+        compute = mock.Mock(return_value='value')
+        self.assertEqual(get_or_compute('key', compute, timeout=None), 'value')
+
+        # 永不过期的缓存不会提前刷新
+        with mock.patch('users.utils.cache.time.time', return_value=10 ** 10):
+            self.assertEqual(get_or_compute('key', compute, timeout=None), 'value')
+        self.assertEqual(compute.call_count, 1)
+        self.assertIsNone(cache.get('key').expire_at)
+
+    def test_uncached_result_releases_waiters(self):
+        self.assertIsNone(get_or_compute('key', lambda: None, cache_none=False))
+        self.assertIsNotNone(cache.get('key:done'))
+
+        # 其他进程持有锁且已结束计算，等待的进程读到标记后立即自行计算，不等到超时
+        cache.add('key:lock', 1)
+        compute = mock.Mock(return_value=None)
+        with mock.patch('users.utils.cache.time.sleep') as sleep:
+            self.assertIsNone(get_or_compute('key', compute, cache_none=False))
+        self.assertEqual(sleep.call_count, 1)
+        compute.assert_called_once_with()
+
+    def test_leader_clears_done_marker(self):
+        cache.set('key:done', 1)
+        self.assertEqual(get_or_compute('key', lambda: 'value'), 'value')
+        self.assertIsNone(cache.get('key:done'))
+
+
+class PageCacheTests(UserTestCase):
+    """
+    视图响应缓存的ETag和按标签失效
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('13800000001')
+        self.authenticate(self.user)
+
+    def test_matching_etag_returns_304(self):
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get('/api/users/me/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # 弱比较同样匹配
+        self.assertEqual(self.client.get('/api/users/me/', HTTP_IF_NONE_MATCH=f'W/{etag}').status_code, 304)
+        self.assertEqual(self.client.get('/api/users/me/', HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_user_change_invalidates_cached_pages(self):
+        etag = self.client.get('/api/users/me/')['ETag']
+        retrieve_etag = self.client.get(f'/api/users/{self.user.pk}/')['ETag']
+
+        user = User.objects.get(pk=self.user.pk)
+        user.bio = 'hello'
+        user.save()
+
+        response = self.client.get('/api/users/me/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['bio'], 'hello')
+        self.assertNotEqual(response['ETag'], etag)
+        response = self.client.get(f'/api/users/{self.user.pk}/', HTTP_IF_NONE_MATCH=retrieve_etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class SQLiteCacheTests(TestCase):
+    """
+    SQLite缓存后端的原子操作、过期和淘汰
+    """
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cache = SQLiteCache(
+            os.path.join(tmpdir.name, 'cache.sqlite3'),
+            {'OPTIONS': {'MAX_ENTRIES': 4, 'CULL_FREQUENCY': 2}},
+        )
+        self.addCleanup(self.cache.close)
+
+    def test_add_only_when_missing_or_expired(self):
+        self.assertTrue(self.cache.add('key', 1))
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertEqual(self.cache.get('key'), 1)
+
+        self.cache.set('key', 1, timeout=-1)
+        self.assertTrue(self.cache.add('key', 3))
+        self.assertEqual(self.cache.get('key'), 3)
+
+    def test_incr_keeps_expiry(self):
+        self.cache.set('counter', 1, timeout=60)
+        expires = self.cache.connection.execute('SELECT expires FROM cache').fetchone()[0]
+
+        self.assertEqual(self.cache.incr('counter', 2), 3)
+        self.assertEqual(self.cache.connection.execute('SELECT expires FROM cache').fetchone()[0], expires)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_compare_and_delete(self):
+        self.cache.set('code', '123456')
+
+        self.assertFalse(self.cache.compare_and_delete('code', '000000'))
+        self.assertTrue(self.cache.compare_and_delete('code', '123456'))
+        self.assertFalse(self.cache.compare_and_delete('code', '123456'))
+        self.assertIsNone(self.cache.get('code'))
+
+    def test_expired_entries_miss(self):
+        self.cache.set('key', 'value', timeout=60)
+        with mock.patch('users.utils.cache_backends.time.time', return_value=time.time() + 61):
+            self.assertIsNone(self.cache.get('key'))
+            self.assertFalse(self.cache.has_key('key'))
+            self.assertFalse(self.cache.compare_and_delete('key', 'value'))
+            with self.assertRaises(ValueError):
+                self.cache.incr('key')
+
+    def test_cull(self):
+        with mock.patch.object(SQLiteCache, 'CULL_PROBABILITY', 0):
+            self.cache.set('expired', 0, timeout=-1)
+            for i in range(5):
+                self.cache.set(f'key{i}', i, timeout=60 + i)
+            self.cache.set('forever', 'value', timeout=None)
+
+        with mock.patch.object(SQLiteCache, 'CULL_PROBABILITY', 1):
+            self.cache.set('key5', 5, timeout=65)
+
+        # 先删除过期条目，剩余7条超过上限，按过期时间淘汰最早的3条，永不过期的最后淘汰
+        keys = {row[0] for row in self.cache.connection.execute('SELECT key FROM cache')}
+        self.assertEqual(keys, {self.cache.make_key(key) for key in ('key3', 'key4', 'key5', 'forever')})
+
+    def test_connection_per_thread(self):
+        other = SQLiteCache(self.cache._path, {})
+        self.assertIs(other.connection, self.cache.connection)
+
+        connections = []
+        thread = threading.Thread(target=lambda: connections.append(other.connection))
+        thread.start()
+        thread.join()
+        self.assertIsNot(connections[0], self.cache.connection)
+
+    def test_close_reconnects(self):
+        self.cache.set('key', 'value')
+        conn = self.cache.connection
+
+        self.cache.close()
+        self.assertIsNot(self.cache.connection, conn)
+        self.assertEqual(self.cache.get('key'), 'value')
+
+
+class CompareAndDeleteTests(UserTestCase):
+    """
+    不支持原子比较删除的缓存后端上的比较删除
+    """
+    def test_deletes_once(self):
+        cache.set('code', '123456')
+
+        self.assertTrue(compare_and_delete('code', '123456'))
+        self.assertFalse(compare_and_delete('code', '123456'))
+        self.assertIsNone(cache.get('code:cad_lock'))
+
+    def test_locked_by_another_caller(self):
+        cache.set('code', '123456')
+        cache.add('code:cad_lock', 1)
+
+        self.assertFalse(compare_and_delete('code', '123456'))
+        self.assertEqual(cache.get('code'), '123456')
+
+
+class QueuedFileHandlerTests(TestCase):
+    """
+    异步文件日志处理器
+    """
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.filename = os.path.join(tmpdir.name, 'test.log')
+        self.handler = QueuedFileHandler(self.filename)
+        self.handler.setFormatter(logging.Formatter('{levelname} {message}', style='{'))
+        self.addCleanup(self.handler.close)
+
+        self.logger = logging.getLogger('users.tests.queued')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def read_log(self):
+        with open(self.filename, encoding='utf-8') as f:
+            return f.read()
+
+    def test_records_reach_file_through_queue(self):
+        self.logger.info('第一条 %s', 1)
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            self.logger.exception('出错了')
+
+        # 关闭时等待后台线程写完队列中的日志，异常堆栈在入队前已格式化
+        self.handler.close()
+        content = self.read_log()
+        self.assertIn('INFO 第一条 1\n', content)
+        self.assertIn('ERROR 出错了\n', content)
+        self.assertIn('ValueError: boom', content)
+
+    def test_full_queue_drops_records(self):
+        # 不启动后台线程，队列只能容纳一条日志
+        self.handler._queue = queue.Queue(maxsize=1)
+        self.handler._pid = os.getpid()
+
+        self.logger.info('保留')
+        self.logger.info('丢弃')
+        self.assertEqual(self.handler.dropped, 1)
+
+        self.handler._write([self.handler._queue.get_nowait()])
+        content = self.read_log()
+        self.assertIn('INFO 保留\n', content)
+        self.assertIn('累计丢弃 1 条日志', content)
+
+
+class RequestLogMiddlewareTests(UserTestCase):
+    """
+    每个请求只输出一条包含视图信息的日志
+    """
+    def request_logs(self, logs):
+        return [record for record in logs.records if record.msg.startswith(('HTTP Request', 'API Request'))]
+
+    def assert_single_log(self, logs, **expected):
+        records = self.request_logs(logs)
+        self.assertEqual([record.msg for record in records], ['HTTP Request: %s'])
+        request_log = records[0].args[0].data
+        for key, value in expected.items():
+            self.assertEqual(request_log[key], value)
+        return request_log
+
+    def test_sync_request_logs_once_with_view_details(self):
+        user = self.create_user('13800000081')
+        self.authenticate(user)
+
+        with self.assertLogs('django', 'INFO') as logs:
+            response = self.client.patch(f'/api/users/{user.pk}/', {'bio': 'hello'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        request_log = self.assert_single_log(logs, method='PATCH', status_code=200, user_id=user.pk)
+        self.assertEqual(request_log['views'], ['UserViewSet.dispatch', 'UserViewSet.update'])
+        self.assertEqual(request_log['data'], {'bio': 'hello'})
+
+    def test_async_middleware_logs_once(self):
+        async def get_response(request):
+            get_request_log()['views'] = ['AsyncView.get']
+            return HttpResponse(status=201)
+
+        middleware = RequestLogMiddleware(get_response)
+        request = RequestFactory().get('/async/')
+        with self.assertLogs('django', 'INFO') as logs:
+            response = async_to_sync(middleware)(request)
+        self.assertEqual(response.status_code, 201)
+        self.assert_single_log(logs, method='GET', path='/async/', status_code=201, views=['AsyncView.get'])
+        # 请求结束后不再保留日志上下文
+        self.assertIsNone(get_request_log())
+
+    def test_async_view_logs_once(self):
+        self.create_user('13800000082')
+        client = AsyncClient(HTTP_HOST='localhost')
+
+        async def login():
+            return await client.post('/api/users/async/token/', {'phone': '13800000082', 'password': self.password},
+                                     content_type='application/json')
+
+        with self.assertLogs('django', 'INFO') as logs:
+            response = async_to_sync(login)()
+        self.assertEqual(response.status_code, 200)
+        self.assert_single_log(logs, method='POST', path='/api/users/async/token/', status_code=200)
+
+
+class SummarizePayloadTests(TestCase):
+    """
+    日志中请求和响应数据的摘要
+    """
+    config = {'MAX_BODY_BYTES': 10, 'MAX_DEPTH': 3, 'REDACT_FIELDS': ['password'], 'REDACT_REQUEST_FIELDS': ['code']}
+
+    def test_truncates_by_utf8_bytes(self):
+        summary = summarize_payload('验证码' * 10, self.config)
+        self.assertTrue(summary['truncated'])
+        # 每个汉字3个字节，10个字节只能保留3个完整的汉字
+        self.assertEqual(summary['data'], '验证码')
+
+    def test_short_payload_is_unchanged(self):
+        self.assertEqual(summarize_payload('ok', self.config), 'ok')
+
+    def test_redacts_fields(self):
+        config = {**self.config, 'MAX_BODY_BYTES': 100}
+        self.assertEqual(summarize_payload({'password': 'x', 'code': '1'}, config),
+                         {'password': REDACTED, 'code': REDACTED})
+        self.assertEqual(summarize_payload({'code': '1'}, config, is_request=False), {'code': '1'})
+
+
+class MetricsViewTests(UserTestCase):
+    """
+    指标接口的访问来源限制
+    """
+    def test_allows_loopback_by_default(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 200)
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+    def test_empty_allow_list_denies_all(self):
+        with override_settings(METRICS_ALLOWED_IPS=[]):
+            self.assertEqual(self.client.get('/metrics/').status_code, 403)
+
+    def test_spoofed_forwarded_for_is_ignored(self):
+        response = self.client.get('/metrics/', REMOTE_ADDR='203.0.113.7', HTTP_X_FORWARDED_FOR='127.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+    def test_forwarded_for_from_trusted_proxy(self):
+        with override_settings(TRUSTED_PROXIES=['10.0.0.0/8']):
+            # 可信代理转发的客户端地址为本机
+            response = self.client.get('/metrics/', REMOTE_ADDR='10.0.0.2', HTTP_X_FORWARDED_FOR='127.0.0.1')
+            self.assertEqual(response.status_code, 200)
+            # 客户端伪造的靠左部分不被采用
+            response = self.client.get('/metrics/', REMOTE_ADDR='10.0.0.2',
+                                       HTTP_X_FORWARDED_FOR='127.0.0.1, 203.0.113.7')
+            self.assertEqual(response.status_code, 403)
+
+
+class ClientIPTests(TestCase):
+    """
+    根据可信代理解析客户端IP
+    """
+    def client_ip(self, remote_addr, forwarded_for=None):
+        request = RequestFactory().get('/', REMOTE_ADDR=remote_addr)
+        if forwarded_for is not None:
+            request.META['HTTP_X_FORWARDED_FOR'] = forwarded_for
+        return get_client_ip(request)
+
+    def test_without_trusted_proxies_uses_remote_addr(self):
+        self.assertEqual(self.client_ip('203.0.113.7', '127.0.0.1'), '203.0.113.7')
+
+    @override_settings(TRUSTED_PROXIES=['10.0.0.1', '192.168.0.0/16'])
+    def test_skips_trusted_proxies_from_the_right(self):
+        self.assertEqual(self.client_ip('10.0.0.1', '1.1.1.1, 203.0.113.7, 192.168.1.1'), '203.0.113.7')
+        self.assertEqual(self.client_ip('10.0.0.1', '192.168.1.1'), '192.168.1.1')
+        self.assertEqual(self.client_ip('10.0.0.1'), '10.0.0.1')
+        self.assertEqual(self.client_ip('10.0.0.1', 'garbage'), '10.0.0.1')
+        # 请求不是来自可信代理时忽略请求头
+        self.assertEqual(self.client_ip('203.0.113.7', '1.1.1.1'), '203.0.113.7')
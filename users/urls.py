@@ -4,7 +4,8 @@ from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
 )
-from .views import UserViewSet, SMSVerificationView, SMSLoginView
+from .views import UserViewSet, SMSVerificationView, SMSStatusView, SMSLoginView
+from .async_views import AsyncTokenObtainView, AsyncRegisterView, AsyncChangePasswordView
 
 # 创建路由器
 router = DefaultRouter()
@@ -17,8 +18,14 @@ urlpatterns = [
     
     # 短信验证码相关
     path('sms/send/', SMSVerificationView.as_view(), name='sms_send'),
+    path('sms/status/<str:task_id>/', SMSStatusView.as_view(), name='sms_status'),
     path('sms/login/', SMSLoginView.as_view(), name='sms_login'),
     
+    # 异步认证接口，用于ASGI部署
+    path('async/token/', AsyncTokenObtainView.as_view(), name='async_token_obtain_pair'),
+    path('async/register/', AsyncRegisterView.as_view(), name='async_register'),
+    path('async/change_password/', AsyncChangePasswordView.as_view(), name='async_change_password'),
+    
     # 用户相关，使用视图集路由
     path('', include(router.urls)),
 ] 
\ No newline at end of file
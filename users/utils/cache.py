@@ -1,54 +1,509 @@
+from django.conf import settings
 from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from collections import OrderedDict, namedtuple
 from functools import wraps
 import hashlib
+import inspect
 import json
+import math
+import random
+import threading
 import time
 
+# 标签版本号的缓存键前缀
+TAG_VERSION_PREFIX = 'cache_tag'
+
+# 本地缓存未命中时的返回值，用于区分缓存的None
+_MISSING = object()
+
+# 重新计算缓存时加锁的最长时间（秒），防止计算进程异常退出后锁无法释放
+STAMPEDE_LOCK_TIMEOUT = 10
+
+# 没有旧值可用时，等待其他进程计算结果的最长时间（秒）
+STAMPEDE_WAIT_TIMEOUT = 3
+
+# 等待其他进程计算结果时的轮询间隔（秒）
+STAMPEDE_POLL_INTERVAL = 0.05
+
+# 计算结果未写入缓存时（如不缓存的None结果、计算出错），通知等待中的进程不再等待的标记存活时间（秒）
+STAMPEDE_DONE_TIMEOUT = 1
+
+# 不支持原子比较删除的缓存后端上，比较删除时加锁的最长时间（秒）
+COMPARE_AND_DELETE_LOCK_TIMEOUT = 5
+
+# 缓存条目：值、逻辑过期时间（时间戳）、上次计算耗时（秒）
+# 值被包装在条目中，因此结果为None时也可以被缓存
+CacheEntry = namedtuple('CacheEntry', ['value', 'expire_at', 'delta'])
+
+# 缓存的视图响应：渲染后的响应体、内容类型、HTTP状态码、强ETag
+CachedPage = namedtuple('CachedPage', ['content', 'content_type', 'status', 'etag'])
+
+class LocalLRUCache:
+    """
+    进程内LRU缓存，作为Django缓存（L2）前面的一级缓存（L1）
+    同时限制条目数量和存活时间，并记录命中、未命中和淘汰次数
+    注意：命中时返回的是同一个对象，调用方不应修改返回值
+    """
+    def __init__(self, max_size=1024, timeout=5):
+        """
+        :param max_size: 最大条目数量，超出后淘汰最久未使用的条目
+        :param timeout: 默认存活时间，单位为秒
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()  # key -> (过期时间, 值, 标签)
+        self._tag_index = {}  # 标签 -> 键集合
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key, default=_MISSING):
+        """
+        获取缓存值，不存在或已过期时返回default
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            
+            expire_at, value, _ = entry
+            if expire_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key, value, timeout=None, tags=()):
+        """
+        写入缓存值
+        :param timeout: 存活时间，单位为秒，不超过默认存活时间
+        :param tags: 标签，按标签失效时一并删除
+        """
+        if timeout is None or timeout > self.timeout:
+            timeout = self.timeout
+        if timeout <= 0 or self.max_size <= 0:
+            return
+        
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + timeout, value, tuple(tags))
+            for tag in tags:
+                self._tag_index.setdefault(tag, set()).add(key)
+            
+            # 超出容量时淘汰最久未使用的条目
+            while len(self._data) > self.max_size:
+                oldest_key = next(iter(self._data))
+                self._remove(oldest_key)
+                self.evictions += 1
+    
+    def delete(self, key):
+        """
+        删除缓存值
+        """
+        with self._lock:
+            self._remove(key)
+    
+    def delete_tags(self, tags):
+        """
+        删除带有指定标签的所有缓存值
+        """
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tag_index.get(tag, ())):
+                    self._remove(key)
+    
+    def clear(self):
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._data.clear()
+            self._tag_index.clear()
+    
+    def stats(self):
+        """
+        获取缓存统计信息
+        """
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+    
+    def _remove(self, key):
+        """
+        删除条目并清理标签索引，调用方需持有锁
+        """
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+
+_local_cache = None
+_local_cache_lock = threading.Lock()
+
+def get_local_cache():
+    """
+    获取进程内一级缓存实例
+    """
+    global _local_cache
+    if _local_cache is None:
+        with _local_cache_lock:
+            if _local_cache is None:
+                _local_cache = LocalLRUCache(
+                    max_size=getattr(settings, 'LOCAL_CACHE_MAX_SIZE', 1024),
+                    timeout=getattr(settings, 'LOCAL_CACHE_TIMEOUT', 5),
+                )
+    return _local_cache
+
 def generate_cache_key(prefix, *args, **kwargs):
     """
     生成缓存键
     """
-    # 将参数转换为字符串
-    args_str = json.dumps(args, sort_keys=True)
-    kwargs_str = json.dumps(kwargs, sort_keys=True)
+    # 将参数转换为字符串，无法直接序列化的参数（如UUID）使用str()
+    args_str = json.dumps(args, sort_keys=True, default=str)
+    kwargs_str = json.dumps(kwargs, sort_keys=True, default=str)
     
     # 使用MD5生成唯一键
     key = f"{prefix}:{args_str}:{kwargs_str}"
     return hashlib.md5(key.encode()).hexdigest()
 
-def cache_result(timeout=300, prefix='cache'):
+def _tag_version_key(tag):
+    """
+    生成标签版本号的缓存键
+    """
+    return f"{TAG_VERSION_PREFIX}:{tag}"
+
+def _initial_tag_version():
+    """
+    标签的初始版本号，使用毫秒时间戳，
+    即使版本号被缓存淘汰，重新初始化后也不会回退到旧的版本号
+    """
+    return int(time.time() * 1000)
+
+def get_tag_versions(tags, local_timeout=None):
+    """
+    批量获取标签的当前版本号，不存在的标签会被初始化
+    :param tags: 标签列表
+    :param local_timeout: 版本号在一级缓存中的存活时间，为None时不使用一级缓存
+    :return: {标签: 版本号}
+    """
+    if not tags:
+        return {}
+    
+    versions = {}
+    keys = {}
+    local_cache = get_local_cache() if local_timeout else None
+    for tag in tags:
+        key = _tag_version_key(tag)
+        version = local_cache.get(key) if local_cache else _MISSING
+        if version is _MISSING:
+            keys[key] = tag
+        else:
+            versions[tag] = version
+    
+    if not keys:
+        return versions
+    
+    found = cache.get_many(list(keys))
+    for key, tag in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = _initial_tag_version()
+            # 其他进程可能已经初始化了该标签，以缓存中的值为准
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+        versions[tag] = version
+        if local_cache:
+            local_cache.set(key, version, local_timeout, tags=(tag,))
+    return versions
+
+def invalidate_tags(*tags):
+    """
+    使带有指定标签的所有缓存失效
+    只需递增标签的版本号，依赖该标签的缓存键随之改变，无需逐个删除
+    :param tags: 标签，例如 'user:<id>'
+    """
+    # 本进程一级缓存中的版本号和数据直接删除，其他进程的一级缓存在其存活时间内过期
+    get_local_cache().delete_tags(tags)
+    for tag in tags:
+        key = _tag_version_key(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # 标签版本号不存在，写入新的初始版本号
+            cache.add(key, _initial_tag_version(), None)
+
+def _versioned_key(base_key, tags, local_timeout=None):
+    """
+    将标签版本号拼接到缓存键中
+    """
+    if not tags:
+        return base_key
+    versions = get_tag_versions(tags, local_timeout)
+    version_str = '.'.join(str(versions[tag]) for tag in sorted(versions))
+    return f"{base_key}:{version_str}"
+
+def _resolve_tags(tags, format_kwargs, /, *args, **kwargs):
+    """
+    解析标签声明
+    :param tags: 标签列表，元素可以是格式化字符串（如'user:{user_id}'），
+                 也可以是接收被装饰函数参数、返回标签或标签列表的可调用对象
+    :param format_kwargs: 格式化字符串使用的参数
+    :return: 去重后的标签列表
+    """
+    resolved = []
+    for tag in tags or ():
+        if callable(tag):
+            value = tag(*args, **kwargs)
+            if value is None:
+                continue
+            if isinstance(value, str):
+                resolved.append(value)
+            else:
+                resolved.extend(str(item) for item in value)
+        else:
+            resolved.append(tag.format(**format_kwargs))
+    return sorted(set(resolved))
+
+def _should_refresh(entry, now, beta):
+    """
+    判断缓存条目是否需要重新计算
+    在逻辑过期前按概率提前刷新（XFetch算法），计算耗时越长、越接近过期，提前刷新的概率越大；
+    永不过期的条目不提前刷新
+    """
+    if entry.expire_at is None:
+        return False
+    if now >= entry.expire_at:
+        return True
+    if beta <= 0:
+        return False
+    # 1 - random() 的取值范围是 (0, 1]，避免 log(0)
+    return now - entry.delta * beta * math.log(1.0 - random.random()) >= entry.expire_at
+
+def _compute_entry(cache_key, compute, timeout, stale_timeout, cache_none):
+    """
+    执行计算并将结果写入缓存
+    物理过期时间比逻辑过期时间多出stale_timeout，期间旧值可以提供给等待中的请求；
+    timeout为None时与Django缓存一致，表示永不过期
+    """
+    start = time.time()
+    value = compute()
+    end = time.time()
+    
+    if value is not None or cache_none:
+        if timeout is None:
+            entry = CacheEntry(value, None, end - start)
+            cache.set(cache_key, entry, None)
+        else:
+            entry = CacheEntry(value, end + timeout, end - start)
+            cache.set(cache_key, entry, timeout + stale_timeout)
+    return value
+
+def get_or_compute(cache_key, compute, timeout=300, stale_timeout=60, beta=1.0, cache_none=True):
+    """
+    读取缓存，缓存缺失或过期时只允许一个进程重新计算（single-flight）
+    :param cache_key: 缓存键
+    :param compute: 无参数的计算函数
+    :param timeout: 缓存逻辑过期时间，单位为秒，为None时永不过期
+    :param stale_timeout: 逻辑过期后旧值继续保留的时间，单位为秒，
+                          其他进程重新计算期间直接返回旧值
+    :param beta: 提前刷新系数，为0时不提前刷新，越大越倾向于提前刷新
+    :param cache_none: 是否缓存None结果
+    :return: 缓存的值或计算结果
+    """
+    entry = cache.get(cache_key)
+    if not isinstance(entry, CacheEntry):
+        entry = None
+    
+    now = time.time()
+    if entry is not None and not _should_refresh(entry, now, beta):
+        return entry.value
+    
+    # 通过缓存的add操作加锁，只有加锁成功的进程执行计算
+    lock_key = f"{cache_key}:lock"
+    done_key = f"{cache_key}:done"
+    if cache.add(lock_key, 1, STAMPEDE_LOCK_TIMEOUT):
+        stored = False
+        try:
+            cache.delete(done_key)
+            value = _compute_entry(cache_key, compute, timeout, stale_timeout, cache_none)
+            stored = value is not None or cache_none
+            return value
+        finally:
+            if not stored:
+                # 结果没有写入缓存，等待中的进程读不到结果，通知其立即自行计算
+                cache.set(done_key, 1, STAMPEDE_DONE_TIMEOUT)
+            cache.delete(lock_key)
+    
+    # 其他进程正在计算，存在旧值时直接返回旧值
+    if entry is not None:
+        return entry.value
+    
+    # 没有旧值，轮询等待其他进程的计算结果，计算进程结束但没有写入结果时不再等待
+    deadline = now + STAMPEDE_WAIT_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(STAMPEDE_POLL_INTERVAL)
+        found = cache.get_many([cache_key, done_key])
+        if isinstance(found.get(cache_key), CacheEntry):
+            return found[cache_key].value
+        if done_key in found:
+            break
+    
+    # 等待超时或计算进程没有写入结果，自行计算
+    return _compute_entry(cache_key, compute, timeout, stale_timeout, cache_none)
+
+def _local_get(local_timeout, cache_key):
+    """
+    从一级缓存读取，未启用一级缓存时返回_MISSING
+    """
+    if not local_timeout:
+        return _MISSING
+    return get_local_cache().get(cache_key)
+
+def _local_set(local_timeout, cache_key, value, tags):
+    """
+    写入一级缓存，未启用一级缓存时忽略
+    """
+    if local_timeout:
+        get_local_cache().set(cache_key, value, local_timeout, tags=tags)
+
+def cache_result(timeout=300, prefix='cache', tags=None, local_timeout=None,
+                 stale_timeout=60, beta=1.0, cache_none=True):
     """
     缓存装饰器，缓存函数返回结果
+    缓存失效时只有一个进程重新计算，其他进程返回旧值或等待计算结果，详见 get_or_compute
+    :param timeout: 缓存过期时间，单位为秒
+    :param prefix: 缓存键前缀
+    :param tags: 缓存标签，例如 ['user:{user_id}']，调用 invalidate_tags 即可使其失效
+    :param local_timeout: 进程内一级缓存的存活时间，单位为秒，为None时不使用一级缓存；
+                          其他进程触发的失效最多延迟该时间才会在本进程生效
+    :param stale_timeout: 过期后旧值继续保留的时间，单位为秒
+    :param beta: 提前刷新系数，为0时不提前刷新
+    :param cache_none: 是否缓存返回值None
     """
+    if local_timeout and timeout is not None:
+        local_timeout = min(local_timeout, timeout)
+    
     def decorator(func):
+        signature = inspect.signature(func)
+        key_prefix = f"{prefix}:{func.__name__}"
+        
+        def build_key(*args, **kwargs):
+            base_key = generate_cache_key(key_prefix, *args, **kwargs)
+            if not tags:
+                return base_key, []
+            
+            # 使用绑定后的参数格式化标签，位置参数和关键字参数都可以引用
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            call_tags = _resolve_tags(tags, bound.arguments, *args, **kwargs)
+            return _versioned_key(base_key, call_tags, local_timeout), call_tags
+        
+        def get_cache_key(*args, **kwargs):
+            return build_key(*args, **kwargs)[0]
+        
         @wraps(func)
         def wrapper(*args, **kwargs):
             # 生成缓存键
-            cache_key = generate_cache_key(f"{prefix}:{func.__name__}", *args, **kwargs)
+            cache_key, call_tags = build_key(*args, **kwargs)
             
-            # 尝试从缓存获取结果
-            result = cache.get(cache_key)
+            # 优先从一级缓存获取结果
+            result = _local_get(local_timeout, cache_key)
+            if result is not _MISSING:
+                return result
             
-            # 如果缓存中没有结果，则执行函数并缓存结果
-            if result is None:
-                result = func(*args, **kwargs)
-                cache.set(cache_key, result, timeout)
-                
+            # 从缓存获取结果，缓存中没有结果时执行函数并缓存结果
+            result = get_or_compute(
+                cache_key,
+                lambda: func(*args, **kwargs),
+                timeout=timeout,
+                stale_timeout=stale_timeout,
+                beta=beta,
+                cache_none=cache_none,
+            )
+            
+            if result is not None or cache_none:
+                _local_set(local_timeout, cache_key, result, call_tags)
             return result
+        
+        def invalidate(*args, **kwargs):
+            """
+            使指定参数对应的缓存失效
+            """
+            cache_key = get_cache_key(*args, **kwargs)
+            get_local_cache().delete(cache_key)
+            cache.delete(cache_key)
+        
+        wrapper.cache_key = get_cache_key
+        wrapper.invalidate = invalidate
         return wrapper
     return decorator
 
 def invalidate_cache(prefix, *args, **kwargs):
     """
     使缓存失效
+    :param prefix: 缓存键前缀，也可以直接传入被 cache_result 装饰的函数
     """
+    if callable(getattr(prefix, 'invalidate', None)):
+        prefix.invalidate(*args, **kwargs)
+        return
+    
     cache_key = generate_cache_key(prefix, *args, **kwargs)
+    get_local_cache().delete(cache_key)
     cache.delete(cache_key)
 
-def cache_page_result(timeout=300, prefix='page'):
+def _etag_matches(request, etag):
+    """
+    判断请求头If-None-Match是否与ETag匹配（按RFC 7232使用弱比较）
+    """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    
+    etags = parse_etags(header)
+    if '*' in etags:
+        return True
+    return any(candidate.removeprefix('W/') == etag for candidate in etags)
+
+def _page_response(page):
+    """
+    根据缓存的页面构造响应
+    """
+    response = HttpResponse(page.content, content_type=page.content_type, status=page.status)
+    response['ETag'] = page.etag
+    return response
+
+def cache_page_result(timeout=300, prefix='page', tags=None, local_timeout=None):
     """
     缓存视图返回结果的装饰器
+    缓存的是渲染后的响应体和强ETag，请求头If-None-Match与ETag匹配时直接返回304，
+    不会执行视图函数和序列化；只有状态码为200的响应会被缓存
+    :param timeout: 缓存过期时间，单位为秒
+    :param prefix: 缓存键前缀
+    :param tags: 缓存标签，格式化字符串可以引用URL参数和当前用户ID，
+                 例如 ['user:{pk}']；可调用对象接收 (request, *args, **kwargs)
+    :param local_timeout: 进程内一级缓存的存活时间，单位为秒，为None时不使用一级缓存
     """
+    if local_timeout and timeout is not None:
+        local_timeout = min(local_timeout, timeout)
+    
     def decorator(view_func):
         @wraps(view_func)
         def wrapper(self, request, *args, **kwargs):
@@ -56,38 +511,138 @@ def cache_page_result(timeout=300, prefix='page'):
             if request.method != 'GET':
                 return view_func(self, request, *args, **kwargs)
             
-            # 生成缓存键
+            # 生成缓存键，不同的渲染格式（如JSON和可浏览API）分别缓存
             path = request.path
             query_string = request.META.get('QUERY_STRING', '')
             user_id = request.user.id if request.user.is_authenticated else 'anonymous'
-            cache_key = generate_cache_key(f"{prefix}:{path}", query_string, user_id)
+            media_type = getattr(request, 'accepted_media_type', '')
+            cache_key = generate_cache_key(f"{prefix}:{path}", query_string, user_id, media_type)
+            
+            view_tags = []
+            if tags:
+                format_kwargs = dict(kwargs, user_id=user_id)
+                view_tags = _resolve_tags(tags, format_kwargs, request, *args, **kwargs)
+                cache_key = _versioned_key(cache_key, view_tags, local_timeout)
             
-            # 尝试从缓存获取结果
-            result = cache.get(cache_key)
+            fresh = {}
             
-            # 如果缓存中没有结果，则执行视图函数并缓存结果
-            if result is None:
-                result = view_func(self, request, *args, **kwargs)
-                cache.set(cache_key, result, timeout)
+            def render_page():
+                """
+                执行视图函数并渲染响应，返回可缓存的页面，不可缓存时返回None
+                """
+                response = view_func(self, request, *args, **kwargs)
+                fresh['response'] = response
+                if response.status_code != 200 or getattr(response, 'streaming', False):
+                    return None
                 
-            return result
+                # DRF的Response需要先由finalize_response确定渲染器才能渲染
+                if hasattr(response, 'render'):
+                    if not hasattr(response, 'accepted_renderer') and hasattr(self, 'finalize_response'):
+                        response = self.finalize_response(request, response, *args, **kwargs)
+                        fresh['response'] = response
+                    response.render()
+                
+                content = response.content
+                etag = '"%s"' % hashlib.md5(content).hexdigest()
+                response['ETag'] = etag
+                return CachedPage(content, response.get('Content-Type'), response.status_code, etag)
+            
+            # 优先从一级缓存获取结果
+            page = _local_get(local_timeout, cache_key)
+            if page is _MISSING:
+                page = get_or_compute(cache_key, render_page, timeout=timeout, cache_none=False)
+                if page is not None:
+                    _local_set(local_timeout, cache_key, page, view_tags)
+            
+            # 客户端持有的版本与缓存一致，返回304
+            if page is not None and _etag_matches(request, page.etag):
+                response = HttpResponseNotModified()
+                response['ETag'] = page.etag
+                return response
+            
+            # 本次请求执行了视图函数，直接返回其响应
+            if 'response' in fresh:
+                return fresh['response']
+            
+            return _page_response(page)
         return wrapper
     return decorator
 
+# 值相等时删除的Lua脚本，在Redis服务端原子执行
+_COMPARE_AND_DELETE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+def compare_and_delete(key, expected):
+    """
+    缓存值等于expected时删除，用于一次性凭证（如验证码）的核销，并发核销时只有一个调用方成功
+    缓存后端提供 compare_and_delete 时直接使用（如SQLiteCache）；Redis通过Lua脚本原子执行；
+    其他后端先用cache.add占用一个短时锁，再比较和删除；并发核销同一个键时，未抢到锁的调用方直接返回False
+    :return: 是否删除
+    """
+    if hasattr(cache, 'compare_and_delete'):
+        return cache.compare_and_delete(key, expected)
+
+    backend = cache._cache if hasattr(cache, '_cache') else None
+    if hasattr(backend, 'get_client') and hasattr(backend, '_serializer'):
+        # Django自带的RedisCache，按其序列化方式序列化期望值后在服务端比较
+        cache_key = cache.make_and_validate_key(key)
+        client = backend.get_client(cache_key, write=True)
+        script = client.register_script(_COMPARE_AND_DELETE_SCRIPT)
+        return bool(script(keys=[cache_key], args=[backend._serializer.dumps(expected)]))
+
+    lock_key = f"{key}:cad_lock"
+    if not cache.add(lock_key, 1, COMPARE_AND_DELETE_LOCK_TIMEOUT):
+        return False
+    try:
+        if cache.get(key, _MISSING) != expected:
+            return False
+        return bool(cache.delete(key))
+    finally:
+        cache.delete(lock_key)
+
+
+def _incr(key, timeout, delta=1):
+    """
+    原子递增计数器，计数器不存在时以delta为初始值创建
+    :return: 递增后的值
+    """
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # 计数器不存在，使用add创建；并发创建失败时说明其他请求已创建，再次递增
+        if cache.add(key, delta, timeout):
+            return delta
+        return cache.incr(key, delta)
+
 class RateLimiter:
     """
     速率限制器，用于限制API请求频率
+    所有计数都基于缓存的原子操作add/incr/decr，并发请求不会丢失计数，支持两种算法：
+    - sliding_window: 滑动窗口计数，按上一窗口剩余比例加权估算当前请求数
+    - token_bucket: 令牌桶（GCRA实现），允许突发limit次请求，之后按 period/limit 的间隔恢复
     """
-    def __init__(self, key_prefix, limit=100, period=60):
+    SLIDING_WINDOW = 'sliding_window'
+    TOKEN_BUCKET = 'token_bucket'
+    
+    def __init__(self, key_prefix, limit=100, period=60, algorithm=SLIDING_WINDOW):
         """
         初始化速率限制器
         :param key_prefix: 缓存键前缀
         :param limit: 在period时间内允许的最大请求次数
         :param period: 时间周期，单位为秒
+        :param algorithm: 限流算法，sliding_window 或 token_bucket
         """
+        if algorithm not in (self.SLIDING_WINDOW, self.TOKEN_BUCKET):
+            raise ValueError(f"不支持的限流算法: {algorithm}")
+        
         self.key_prefix = key_prefix
         self.limit = limit
         self.period = period
+        self.algorithm = algorithm
         
     def is_allowed(self, identifier):
         """
@@ -95,44 +650,182 @@ class RateLimiter:
         :param identifier: 请求标识符，通常是用户ID或IP地址
         :return: 是否允许请求
         """
-        cache_key = f"{self.key_prefix}:{identifier}"
-        
-        # 获取当前计数和过期时间
-        count, expire_at = cache.get(cache_key, (0, 0))
-        
-        # 获取当前时间
-        now = time.time()
-        
-        # 如果已过期，重置计数
-        if now > expire_at:
-            count = 0
-            expire_at = now + self.period
-            
-        # 增加计数
-        count += 1
-        
-        # 更新缓存
-        cache.set(cache_key, (count, expire_at), self.period)
-        
-        # 检查是否超过限制
-        return count <= self.limit
+        allowed, _ = self.check([identifier])
+        return allowed
+    
+    def check(self, identifiers):
+        """
+        同时检查多个标识符（如用户、IP、手机号），全部未超限时才允许请求并计数
+        :param identifiers: 请求标识符列表
+        :return: (是否允许请求, 超限的标识符)
+        """
+        identifiers = list(dict.fromkeys(identifiers))
+        if not identifiers:
+            return True, None
         
+        if self.algorithm == self.TOKEN_BUCKET:
+            return self._check_token_bucket(identifiers)
+        return self._check_sliding_window(identifiers)
+
+    def release(self, identifier):
+        """
+        撤销一次已放行的计数，用于请求通过本限制器后又被其他限制拒绝的情况，避免白白消耗配额
+        滑动窗口只回滚当前窗口的计数，放行和撤销之间恰好跨越窗口边界时不回滚
+        :param identifier: 请求标识符
+        """
+        if self.algorithm == self.TOKEN_BUCKET:
+            key, delta = self._bucket_key(identifier), self._interval_ms()
+        else:
+            key, _, _ = self._window_keys(identifier, time.time())
+            delta = 1
+
+        if (cache.get(key) or 0) < delta:
+            return
+        try:
+            cache.decr(key, delta)
+        except ValueError:
+            # 计数器在读取后已过期
+            pass
+
     def get_remaining(self, identifier):
         """
         获取剩余的请求次数
         :param identifier: 请求标识符
         :return: 剩余的请求次数
         """
-        cache_key = f"{self.key_prefix}:{identifier}"
+        now = time.time()
         
-        # 获取当前计数和过期时间
-        count, expire_at = cache.get(cache_key, (0, 0))
+        if self.algorithm == self.TOKEN_BUCKET:
+            interval_ms = self._interval_ms()
+            now_ms = int(now * 1000)
+            tat = cache.get(self._bucket_key(identifier)) or now_ms
+            backlog = max(tat - now_ms, 0)
+            return max(0, (self.period * 1000 - backlog) // interval_ms)
         
-        # 获取当前时间
+        current_key, previous_key, ratio = self._window_keys(identifier, now)
+        counts = cache.get_many([current_key, previous_key])
+        estimate = self._estimate(counts.get(previous_key, 0), counts.get(current_key, 0), ratio)
+        return max(0, self.limit - math.ceil(estimate))
+    
+    def get_wait(self, identifier):
+        """
+        估算距离下一次允许请求的等待时间
+        :param identifier: 请求标识符
+        :return: 等待时间，单位为秒
+        """
         now = time.time()
         
-        # 如果已过期，重置计数
-        if now > expire_at:
-            return self.limit
+        if self.algorithm == self.TOKEN_BUCKET:
+            now_ms = int(now * 1000)
+            tat = cache.get(self._bucket_key(identifier)) or now_ms
+            wait_ms = tat + self._interval_ms() - self.period * 1000 - now_ms
+            return max(wait_ms, 0) / 1000
+        
+        current_key, previous_key, ratio = self._window_keys(identifier, now)
+        counts = cache.get_many([current_key, previous_key])
+        previous, current = counts.get(previous_key, 0), counts.get(current_key, 0)
+        window_left = (1 - ratio) * self.period
+        if current >= self.limit or not previous:
+            # 当前窗口已用完，需要等到下一个窗口
+            return window_left
+        # 上一窗口的权重随时间线性下降，求估算值降到 limit - 1 的时刻
+        target_ratio = 1 - (self.limit - 1 - current) / previous
+        return min(max(target_ratio - ratio, 0) * self.period, window_left)
+    
+    def _window_keys(self, identifier, now):
+        """
+        获取当前窗口和上一窗口的缓存键，以及当前窗口已经过的比例
+        """
+        window = int(now // self.period)
+        ratio = (now % self.period) / self.period
+        current_key = f"{self.key_prefix}:{identifier}:{window}"
+        previous_key = f"{self.key_prefix}:{identifier}:{window - 1}"
+        return current_key, previous_key, ratio
+    
+    @staticmethod
+    def _estimate(previous, current, ratio):
+        """
+        滑动窗口估算请求数：上一窗口按未过去的比例加权，加上当前窗口计数
+        """
+        return previous * (1 - ratio) + current
+    
+    def _check_sliding_window(self, identifiers):
+        """
+        滑动窗口计数检查
+        先一次性批量读取所有标识符的计数，已超限时直接拒绝且不计数；
+        否则原子递增当前窗口计数，递增后超限则回滚本次已递增的计数
+        """
+        now = time.time()
+        windows = [self._window_keys(identifier, now) for identifier in identifiers]
+        counts = cache.get_many([key for current_key, previous_key, _ in windows
+                                 for key in (current_key, previous_key)])
+        
+        for identifier, (current_key, previous_key, ratio) in zip(identifiers, windows):
+            estimate = self._estimate(counts.get(previous_key, 0), counts.get(current_key, 0), ratio)
+            if estimate + 1 > self.limit:
+                return False, identifier
+        
+        incremented = []
+        for identifier, (current_key, previous_key, ratio) in zip(identifiers, windows):
+            # 计数器需要保留到下一个窗口，作为下一个窗口的“上一窗口”
+            current = _incr(current_key, self.period * 2)
+            incremented.append(current_key)
+            if self._estimate(counts.get(previous_key, 0), current, ratio) > self.limit:
+                for key in incremented:
+                    cache.decr(key)
+                return False, identifier
+        
+        return True, None
+    
+    def _bucket_key(self, identifier):
+        """
+        令牌桶的缓存键，值为理论到达时间（TAT，毫秒时间戳）
+        """
+        return f"{self.key_prefix}:{identifier}:tb"
+    
+    def _interval_ms(self):
+        """
+        令牌恢复间隔，单位为毫秒
+        """
+        return max(int(self.period * 1000 / self.limit), 1)
+    
+    def _check_token_bucket(self, identifiers):
+        """
+        令牌桶检查（GCRA）
+        每次请求把TAT原子递增一个间隔，TAT超出当前时间一个周期以上说明令牌耗尽，回滚并拒绝；
+        TAT落后于当前时间说明桶已满，需要补齐到当前时间。补齐通过1秒的短锁保证不会被并发重复执行，
+        未抢到锁的请求直接按满桶放行，因此桶满后的1秒内最多多放行 1秒 * 速率 个请求
+        """
+        interval_ms = self._interval_ms()
+        burst_ms = self.period * 1000
+        # 键在最后一次放行后 2 * period 内有效，过期时TAT必然已落后于当前时间，等同于满桶
+        timeout = self.period * 2
+        
+        consumed = []
+        for identifier in identifiers:
+            key = self._bucket_key(identifier)
+            now_ms = int(time.time() * 1000)
+            
+            try:
+                tat = cache.incr(key, interval_ms)
+            except ValueError:
+                # 令牌桶不存在，从当前时间开始计算
+                if cache.add(key, now_ms + interval_ms, timeout):
+                    tat = now_ms + interval_ms
+                else:
+                    tat = cache.incr(key, interval_ms)
+            
+            previous = tat - interval_ms
+            if previous < now_ms and cache.add(f"{key}:sync", 1, 1):
+                tat = cache.incr(key, now_ms - previous)
             
-        return max(0, self.limit - count) 
\ No newline at end of file
+            if tat - now_ms > burst_ms:
+                cache.decr(key, interval_ms)
+                for consumed_key in consumed:
+                    cache.decr(consumed_key, interval_ms)
+                return False, identifier
+            
+            consumed.append(key)
+            cache.touch(key, timeout)
+        
+        return True, None
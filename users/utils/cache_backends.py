@@ -0,0 +1,232 @@
+"""
+基于SQLite文件的Django缓存后端
+同一台机器上的多个worker进程共用一个数据库文件，验证码、限流计数等状态在进程间共享；
+add、incr、compare_and_delete 在 BEGIN IMMEDIATE 事务中完成，并发调用是原子的。
+适用于单机部署和本地测试，多台机器部署时应使用Redis
+"""
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# 当前线程在各数据库文件上的连接。Django为每个线程、每个异步上下文创建新的缓存对象，
+# 连接保存在缓存对象上会使每个请求都重新连接，因此按线程保存，同一线程的缓存对象共用一个连接
+_local = threading.local()
+# 当前进程中已初始化表结构的数据库文件
+_initialized = set()
+_initialized_lock = threading.Lock()
+
+
+class SQLiteCache(BaseCache):
+    """
+    SQLite缓存后端，LOCATION为数据库文件路径
+    """
+    # 每次写入时检查是否需要淘汰的概率，避免每次写入都统计条目数
+    CULL_PROBABILITY = 0.01
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+
+    def _connections(self):
+        """
+        当前线程的连接字典，fork后的子进程不使用父进程的连接
+        """
+        if getattr(_local, 'pid', None) != os.getpid():
+            _local.connections = {}
+            _local.pid = os.getpid()
+        return _local.connections
+
+    def _initialize(self):
+        """
+        每个进程对每个数据库文件只初始化一次表结构，WAL模式记录在数据库文件中，不需要每个连接设置
+        """
+        key = (os.getpid(), self._path)
+        if key in _initialized:
+            return
+        with _initialized_lock:
+            if key in _initialized:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            try:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS cache ('
+                    'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)'
+                )
+                conn.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            finally:
+                conn.close()
+            _initialized.add(key)
+
+    @property
+    def connection(self):
+        """
+        当前线程的数据库连接，不跨线程使用
+        """
+        connections = self._connections()
+        conn = connections.get(self._path)
+        if conn is None:
+            self._initialize()
+            # isolation_level=None 即自动提交，需要原子性的操作显式开启事务
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            connections[self._path] = conn
+        return conn
+
+    def get_backend_timeout(self, timeout=DEFAULT_TIMEOUT):
+        """
+        返回过期时间戳，永不过期时返回None
+        """
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return None
+        return time.time() + timeout
+
+    @staticmethod
+    def _alive(expires, now):
+        return expires is None or expires > now
+
+    def _write(self, key, value, expires):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires),
+        )
+
+    def _maybe_cull(self):
+        """
+        条目数超过MAX_ENTRIES时，先删除已过期的条目，仍然超出时按过期时间淘汰1/CULL_FREQUENCY
+        """
+        if random.random() >= self.CULL_PROBABILITY:
+            return
+        conn = self.connection
+        conn.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+        count = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries and self._cull_frequency:
+            conn.execute(
+                'DELETE FROM cache WHERE key IN ('
+                'SELECT key FROM cache ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count // self._cull_frequency,),
+            )
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self.connection.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or not self._alive(row[1], time.time()):
+            return default
+        return pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+        if not key_map:
+            return {}
+        now = time.time()
+        placeholders = ','.join('?' * len(key_map))
+        rows = self.connection.execute(
+            f'SELECT key, value, expires FROM cache WHERE key IN ({placeholders})',
+            list(key_map),
+        ).fetchall()
+        return {key_map[key]: pickle.loads(value) for key, value, expires in rows if self._alive(expires, now)}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._write(key, value, self.get_backend_timeout(timeout))
+        self._maybe_cull()
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT expires FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is not None and self._alive(row[0], time.time()):
+                conn.execute('ROLLBACK')
+                return False
+            self._write(key, value, self.get_backend_timeout(timeout))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._maybe_cull()
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self.connection.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self.connection.execute(
+            'DELETE FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        if keys:
+            placeholders = ','.join('?' * len(keys))
+            self.connection.execute(f'DELETE FROM cache WHERE key IN ({placeholders})', keys)
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self.connection.execute('SELECT expires FROM cache WHERE key = ?', (key,)).fetchone()
+        return row is not None and self._alive(row[0], time.time())
+
+    def incr(self, key, delta=1, version=None):
+        """
+        原子递增，保留原有的过期时间
+        """
+        key = self.make_and_validate_key(key, version=version)
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None or not self._alive(row[1], time.time()):
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            self._write(key, value, row[1])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return value
+
+    def compare_and_delete(self, key, expected, version=None):
+        """
+        缓存值等于expected时删除，比较和删除在同一事务中完成
+        :return: 是否删除
+        """
+        key = self.make_and_validate_key(key, version=version)
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+            matched = row is not None and self._alive(row[1], time.time()) and pickle.loads(row[0]) == expected
+            if matched:
+                conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return matched
+
+    def clear(self):
+        self.connection.execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        """
+        请求结束时关闭当前线程的连接，下次使用时重新连接
+        """
+        conn = self._connections().pop(self._path, None)
+        if conn is not None:
+            conn.close()
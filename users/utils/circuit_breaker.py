@@ -0,0 +1,168 @@
+"""
+熔断器，依赖的外部服务出错或变慢时快速失败，避免请求线程堆积在超时等待上
+"""
+import threading
+import time
+from collections import deque
+from . import metrics
+
+# 熔断器状态
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 状态在指标中对应的数值
+STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+CIRCUIT_STATE = metrics.registry.gauge(
+    'circuit_breaker_state',
+    '熔断器状态（0关闭，1打开，2半开）',
+    ['name'],
+)
+CIRCUIT_CALLS = metrics.registry.counter(
+    'circuit_breaker_calls_total',
+    '经过熔断器的调用次数，按结果分类（success/failure/slow/rejected）',
+    ['name', 'state', 'outcome'],
+)
+CIRCUIT_TRANSITIONS = metrics.registry.counter(
+    'circuit_breaker_transitions_total',
+    '熔断器状态切换次数',
+    ['name', 'state'],
+)
+
+
+class CircuitOpenError(Exception):
+    """
+    熔断器处于打开状态，调用被拒绝
+    """
+    def __init__(self, name, retry_after=None):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"熔断器 {name} 已打开")
+
+
+class CircuitBreaker:
+    """
+    基于最近N次调用结果的熔断器
+    关闭状态下统计最近 window_size 次调用，调用数达到 minimum_calls 后，
+    失败率或慢调用率超过阈值即打开；打开 open_timeout 秒后进入半开状态，
+    放行最多 half_open_max_calls 次探测调用，全部成功则关闭，任意一次失败或过慢则重新打开
+    """
+    def __init__(self, name, failure_rate_threshold=0.5, slow_call_duration=3.0,
+                 slow_call_rate_threshold=0.8, window_size=20, minimum_calls=10,
+                 open_timeout=30, half_open_max_calls=3):
+        """
+        :param name: 名称，用于指标标签
+        :param failure_rate_threshold: 失败率阈值
+        :param slow_call_duration: 超过该耗时（秒）的调用视为慢调用
+        :param slow_call_rate_threshold: 慢调用率阈值
+        :param window_size: 统计的最近调用次数
+        :param minimum_calls: 开始计算失败率的最少调用次数
+        :param open_timeout: 打开状态持续时间（秒），之后进入半开状态
+        :param half_open_max_calls: 半开状态下放行的探测调用次数
+        """
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.open_timeout = open_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self._state = CLOSED
+        self._opened_at = 0
+        # 最近调用的结果 (是否失败, 是否过慢)
+        self._results = deque(maxlen=window_size)
+        self._half_open_calls = 0
+        self._half_open_successes = 0
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(STATE_VALUES[CLOSED], name)
+
+    @property
+    def state(self):
+        """
+        当前状态，打开时间已到时返回半开
+        """
+        with self._lock:
+            self._check_timeout()
+            return self._state
+
+    def _transition(self, state):
+        """
+        切换状态，调用方需持有锁
+        """
+        self._state = state
+        self._results.clear()
+        self._half_open_calls = 0
+        self._half_open_successes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        CIRCUIT_STATE.set(STATE_VALUES[state], self.name)
+        CIRCUIT_TRANSITIONS.inc(self.name, state)
+
+    def _check_timeout(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_timeout:
+            self._transition(HALF_OPEN)
+
+    def allow(self):
+        """
+        检查是否放行调用，放行后必须调用 record 记录结果
+        :raises CircuitOpenError: 熔断器打开，或半开状态下探测调用已满
+        """
+        with self._lock:
+            self._check_timeout()
+            state = self._state
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return
+            retry_after = max(0.0, self.open_timeout - (time.monotonic() - self._opened_at)) if state == OPEN else None
+
+        CIRCUIT_CALLS.inc(self.name, state, 'rejected')
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record(self, duration, failed):
+        """
+        记录一次调用的结果
+        :param duration: 调用耗时（秒）
+        :param failed: 是否失败
+        """
+        slow = duration >= self.slow_call_duration
+        outcome = 'failure' if failed else ('slow' if slow else 'success')
+
+        with self._lock:
+            state = self._state
+            if state == HALF_OPEN:
+                if failed or slow:
+                    self._transition(OPEN)
+                else:
+                    self._half_open_successes += 1
+                    if self._half_open_successes >= self.half_open_max_calls:
+                        self._transition(CLOSED)
+            elif state == CLOSED:
+                self._results.append((failed, slow))
+                if len(self._results) >= self.minimum_calls:
+                    total = len(self._results)
+                    failure_rate = sum(1 for f, _ in self._results if f) / total
+                    slow_rate = sum(1 for _, s in self._results if s) / total
+                    if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_call_rate_threshold:
+                        self._transition(OPEN)
+            # 打开状态下完成的调用是打开之前放行的，不再计入
+
+        CIRCUIT_CALLS.inc(self.name, state, outcome)
+
+    def call(self, func, *args, **kwargs):
+        """
+        通过熔断器调用函数，函数抛出的异常计为失败并原样抛出
+        :raises CircuitOpenError: 熔断器打开
+        """
+        self.allow()
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record(time.perf_counter() - start, True)
+            raise
+        self.record(time.perf_counter() - start, False)
+        return result
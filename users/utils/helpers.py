@@ -1,9 +1,11 @@
 import re
 import uuid
+import ipaddress
 import random
 import string
 import hashlib
 from datetime import datetime, timedelta
+from functools import lru_cache
 from django.utils import timezone
 from django.conf import settings
 from django.core.mail import send_mail
@@ -75,15 +77,42 @@ def send_verification_email(user, subject, template_name, context=None):
         fail_silently=False,
     )
 
+@lru_cache(maxsize=8)
+def _parse_networks(values):
+    """
+    把IP地址或CIDR列表解析为网络对象
+    """
+    return tuple(ipaddress.ip_network(value.strip(), strict=False) for value in values if value.strip())
+
+def _is_trusted_proxy(ip, networks):
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
 def get_client_ip(request):
     """
     获取客户端IP地址
-    """
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
+    只有直接连接的地址（REMOTE_ADDR）属于settings.TRUSTED_PROXIES时才读取X-Forwarded-For，
+    从右向左跳过可信代理，取第一个不可信的地址；客户端可以任意伪造X-Forwarded-For中靠左的部分，
+    因此不能直接取第一个地址。未配置可信代理时只使用REMOTE_ADDR
+    """
+    ip = request.META.get('REMOTE_ADDR')
+    networks = _parse_networks(tuple(getattr(settings, 'TRUSTED_PROXIES', ())))
+    if not networks or not _is_trusted_proxy(ip, networks):
+        return ip
+    
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    for hop in reversed([hop.strip() for hop in x_forwarded_for.split(',') if hop.strip()]):
+        try:
+            ipaddress.ip_address(hop)
+        except ValueError:
+            # 格式错误的地址不是可信代理写入的，以最后一个可信代理看到的地址为准
+            break
+        ip = hop
+        if not _is_trusted_proxy(hop, networks):
+            break
     return ip
 
 def format_datetime(dt, format_str='%Y-%m-%d %H:%M:%S'):
@@ -1,14 +1,43 @@
+import contextvars
 import logging
 import json
+import os
+import queue
+import random
+import threading
+import time
 import traceback
 import uuid
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from collections.abc import Mapping
 from functools import wraps
 from django.conf import settings
+from django.core.files.base import File
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework.request import Empty
 
 # 创建日志记录器
 logger = logging.getLogger('django')
 
+# 当前请求的日志上下文，由RequestLogMiddleware创建，api_logger等装饰器向其中补充信息，
+# 请求结束时由中间件统一输出一条日志
+_request_log = contextvars.ContextVar('request_log', default=None)
+
+# API日志默认配置，可在settings.API_LOG中覆盖
+API_LOG_DEFAULTS = {
+    'DEFAULT_SAMPLE_RATE': 1.0,
+    'SAMPLE_RATES': {},
+    'MAX_BODY_BYTES': 2048,
+    'MAX_DEPTH': 3,
+    'REDACT_FIELDS': (),
+    'REDACT_REQUEST_FIELDS': (),
+    'LOG_RESPONSE_DATA': False,
+}
+
+# 脱敏后的字段值
+REDACTED = '******'
+
 # 自定义JSON编码器，处理UUID类型
 class UUIDEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -17,113 +46,385 @@ class UUIDEncoder(json.JSONEncoder):
             return str(obj)
         return super().default(obj)
 
+class LazyJSON:
+    """
+    延迟序列化的JSON日志参数
+    作为日志参数传入（logger.info("...%s", LazyJSON(data))），只有日志真正被输出时才会序列化
+    """
+    __slots__ = ('data',)
+    
+    def __init__(self, data):
+        self.data = data
+    
+    def __str__(self):
+        return json.dumps(self.data, ensure_ascii=False, cls=UUIDEncoder)
+
+
+class QueuedFileHandler(logging.Handler):
+    """
+    异步文件日志处理器
+    请求线程只把日志记录放入有界队列，由后台线程批量格式化并写入文件，每批只刷新一次磁盘；
+    队列已满时丢弃新的日志记录并计数，磁盘变慢不会阻塞请求
+    """
+    def __init__(self, filename, mode='a', encoding='utf-8', queue_size=10000, batch_size=200):
+        """
+        :param filename: 日志文件路径
+        :param queue_size: 队列最大长度，超出后丢弃日志
+        :param batch_size: 后台线程每批最多写入的日志条数
+        """
+        super().__init__()
+        self.filename = os.path.abspath(os.fspath(filename))
+        self.mode = mode
+        self.encoding = encoding
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._stream = None
+        self._start_lock = threading.Lock()
+        
+        # fork后子进程中没有后台线程，需要在子进程中重新启动
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+    
+    def _after_fork(self):
+        """
+        fork后重置子进程中的状态
+        """
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stream = None
+    
+    def _ensure_worker(self):
+        """
+        确保当前进程的后台写入线程已启动
+        """
+        if self._pid == os.getpid():
+            return
+        
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+    
+    def prepare(self, record):
+        """
+        入队前的处理，只在当前线程格式化异常堆栈（堆栈对象不能跨线程延迟格式化），
+        消息本身的格式化留给后台线程
+        """
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+    
+    def emit(self, record):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+    
+    def _run(self):
+        """
+        后台线程：阻塞等待日志记录，取出后尽量批量写入
+        """
+        log_queue = self._queue
+        while True:
+            batch = [log_queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            if not self._write(batch):
+                return
+    
+    def _write(self, batch):
+        """
+        写入一批日志记录，遇到结束标记（None）时返回False
+        """
+        if self._stream is None:
+            self._stream = open(self.filename, self.mode, encoding=self.encoding)
+        
+        running = True
+        for record in batch:
+            if record is None:
+                running = False
+                continue
+            try:
+                self._stream.write(self.format(record) + '\n')
+            except Exception:
+                self.handleError(record)
+        
+        dropped = self.dropped
+        if dropped != self._reported_dropped:
+            self._stream.write(f"WARNING 日志队列已满，累计丢弃 {dropped} 条日志\n")
+            self._reported_dropped = dropped
+        
+        self._stream.flush()
+        return running
+    
+    def close(self):
+        """
+        关闭处理器，等待后台线程写完队列中的日志
+        """
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=1)
+                self._thread.join(timeout=5)
+            except queue.Full:
+                pass
+        
+        if self._stream is not None and (self._thread is None or not self._thread.is_alive()):
+            self._stream.close()
+            self._stream = None
+        super().close()
+
+
 def log_exception(exc):
     """
     记录异常日志
     """
-    logger.error(f"Exception: {str(exc)}")
-    logger.error(f"Traceback: {traceback.format_exc()}")
+    logger.error("Exception: %s", exc)
+    logger.error("Traceback: %s", traceback.format_exc())
+
+def get_request_log():
+    """
+    获取当前请求的日志上下文，不在请求处理过程中时返回None
+    """
+    return _request_log.get()
+
+def _get_user_id(request):
+    """
+    获取请求的用户ID，未登录时返回None
+    """
+    user = getattr(request, 'user', None)
+    return user.id if user is not None and user.is_authenticated else None
+
+def get_api_log_config():
+    """
+    获取API日志配置
+    """
+    return {**API_LOG_DEFAULTS, **getattr(settings, 'API_LOG', {})}
+
+class _Budget:
+    """
+    日志数据的剩余字节数
+    """
+    __slots__ = ('remaining', 'truncated')
+    
+    def __init__(self, remaining):
+        self.remaining = remaining
+        self.truncated = False
+
+def _summarize(value, budget, redact_fields, depth):
+    """
+    生成有大小上限的数据摘要
+    只读取原数据，不复制超出上限的部分：字符串按剩余字节数截断，文件只记录文件名和大小，
+    容器超出深度或剩余字节数耗尽时停止遍历
+    """
+    if isinstance(value, File):
+        return {'file': getattr(value, 'name', None), 'size': getattr(value, 'size', None)}
+    
+    if isinstance(value, (Mapping, list, tuple)):
+        if depth <= 0:
+            budget.truncated = True
+            return '...'
+        
+        if isinstance(value, Mapping):
+            # QueryDict.items() 只取每个键的最后一个值，不会像dict()那样复制全部列表
+            items = value.items()
+            result = {}
+        else:
+            items = enumerate(value)
+            result = []
+        
+        for key, item in items:
+            if budget.remaining <= 0:
+                budget.truncated = True
+                break
+            if isinstance(result, dict):
+                key = str(key)
+                budget.remaining -= len(key.encode('utf-8'))
+                if key.lower() in redact_fields:
+                    result[key] = REDACTED
+                    continue
+                result[key] = _summarize(item, budget, redact_fields, depth - 1)
+            else:
+                result.append(_summarize(item, budget, redact_fields, depth - 1))
+        return result
+    
+    if value is None or isinstance(value, (bool, int, float)):
+        budget.remaining -= 8
+        return value
+    
+    text = value if isinstance(value, str) else str(value)
+    limit = max(budget.remaining, 0)
+    # 每个字符至少占1个字节，先按字符数截取，避免编码超长字符串的全部内容
+    encoded = text[:limit + 1].encode('utf-8')
+    if len(encoded) > limit:
+        # 按UTF-8字节数截断，丢弃被截断的不完整字符
+        text = encoded[:limit].decode('utf-8', errors='ignore')
+        budget.truncated = True
+        encoded = text.encode('utf-8')
+    budget.remaining -= len(encoded)
+    return text
+
+def summarize_payload(data, config=None, is_request=True):
+    """
+    生成用于日志的请求或响应数据摘要：限制大小、跳过文件内容、字段脱敏
+    :param data: 请求或响应数据
+    :param config: API日志配置，默认读取settings.API_LOG
+    :param is_request: 是否是请求数据，请求数据额外按REDACT_REQUEST_FIELDS脱敏
+    :return: 数据摘要，被截断时包装为 {'truncated': True, 'data': 摘要}
+    """
+    if data is None:
+        return None
+    
+    config = config or get_api_log_config()
+    redact_fields = {field.lower() for field in config['REDACT_FIELDS']}
+    if is_request:
+        redact_fields.update(field.lower() for field in config['REDACT_REQUEST_FIELDS'])
+    budget = _Budget(config['MAX_BODY_BYTES'])
+    summary = _summarize(data, budget, redact_fields, config['MAX_DEPTH'])
+    if budget.truncated:
+        return {'truncated': True, 'data': summary}
+    return summary
+
+def _should_sample(request, config):
+    """
+    按路由名称的采样率决定是否记录请求体和响应数据
+    """
+    resolver_match = getattr(request, 'resolver_match', None)
+    route = resolver_match.url_name if resolver_match else None
+    rate = config['SAMPLE_RATES'].get(route, config['DEFAULT_SAMPLE_RATE'])
+    return rate >= 1 or random.random() < rate
+
+def _extract_query_params(request, config):
+    """
+    获取请求的查询参数
+    """
+    # 检查是否是DRF请求对象，它有query_params属性
+    if hasattr(request, 'query_params'):
+        return summarize_payload(request.query_params, config)
+    # 对于普通Django请求，使用GET
+    if hasattr(request, 'GET'):
+        return summarize_payload(request.GET, config)
+    return {}
+
+def _extract_request_data(request, config):
+    """
+    获取请求体数据摘要，只处理POST、PUT、PATCH请求
+    视图没有读取过请求体时（如请求被限流或拒绝）不为记录日志而解析请求体，避免解析大的上传文件
+    """
+    if request.method not in ['POST', 'PUT', 'PATCH']:
+        return None
+    
+    # 只处理DRF请求对象，且请求体已被解析
+    if getattr(request, '_full_data', Empty) is Empty:
+        return None
+    
+    try:
+        return summarize_payload(request.data, config)
+    except Exception:
+        return "无法解析的请求数据"
+
+def _get_drf_request(view, request):
+    """
+    获取DRF请求对象，装饰dispatch时收到的是Django原始请求，DRF请求对象在视图的request属性上
+    """
+    if hasattr(request, 'data'):
+        return request
+    return getattr(view, 'request', request)
 
 def api_logger(func):
     """
     API日志装饰器，记录API请求和响应
+    在RequestLogMiddleware处理的请求中，只向请求日志上下文补充视图名称、查询参数、请求体、
+    响应数据和异常信息，由中间件统一输出一条日志；不在中间件处理的请求中时单独输出一条日志
     """
     @wraps(func)
     def wrapper(self, request, *args, **kwargs):
-        # 记录请求开始时间
-        start_time = timezone.now()
-        
-        # 获取请求信息
-        method = request.method
-        path = request.path
-        query_params = {}
+        request_log = _request_log.get()
+        standalone = request_log is None
         
-        # 检查是否是DRF请求对象，它有query_params属性
-        if hasattr(request, 'query_params'):
-            query_params = dict(request.query_params)
-        # 对于普通Django请求，使用GET
-        elif hasattr(request, 'GET'):
-            query_params = dict(request.GET)
+        # 未启用INFO级别日志时，不提取请求信息，只记录异常
+        if standalone and not logger.isEnabledFor(logging.INFO):
+            try:
+                return func(self, request, *args, **kwargs)
+            except Exception as exc:
+                log_exception(exc)
+                raise
         
-        data = None
+        start_time = timezone.now()
+        if standalone:
+            request_log = {
+                'timestamp': start_time.isoformat(),
+                'method': request.method,
+                'path': request.path,
+            }
         
-        # 尝试获取请求体数据
-        try:
-            if method in ['POST', 'PUT', 'PATCH']:
-                # 检查是否是DRF请求对象
-                if hasattr(request, 'data'):
-                    data = request.data
-                    # 如果data是QueryDict，转换为dict
-                    if hasattr(data, 'dict'):
-                        data = data.dict()
-                # 对于普通Django请求，使用POST
-                elif hasattr(request, 'POST'):
-                    data = request.POST
-                    if hasattr(data, 'dict'):
-                        data = data.dict()
-        except Exception:
-            data = "无法解析的请求数据"
-        
-        # 记录请求日志
-        request_log = {
-            'timestamp': start_time.isoformat(),
-            'method': method,
-            'path': path,
-            'query_params': query_params,
-            'data': data,
-            'user_id': request.user.id if hasattr(request, 'user') and request.user.is_authenticated else None,
-        }
+        config = get_api_log_config()
         
-        logger.info(f"API Request: {json.dumps(request_log, ensure_ascii=False, cls=UUIDEncoder)}")
+        # 多个装饰器（如dispatch和具体的视图方法）共用同一个上下文，各字段只提取一次
+        request_log.setdefault('views', []).append(f"{type(self).__name__}.{func.__name__}")
         
-        # 执行视图函数
         try:
             response = func(self, request, *args, **kwargs)
-            
-            # 计算执行时间
-            end_time = timezone.now()
-            execution_time = (end_time - start_time).total_seconds()
-            
-            # 记录响应日志
-            response_log = {
-                'timestamp': end_time.isoformat(),
-                'method': method,
-                'path': path,
-                'status_code': response.status_code,
-                'execution_time': execution_time,
-                'user_id': request.user.id if hasattr(request, 'user') and request.user.is_authenticated else None,
-            }
-            
-            # 如果是调试模式，记录响应数据
-            if settings.DEBUG:
-                try:
-                    response_log['data'] = response.data
-                except Exception:
-                    response_log['data'] = "无法解析的响应数据"
-            
-            logger.info(f"API Response: {json.dumps(response_log, ensure_ascii=False, cls=UUIDEncoder)}")
-            
-            return response
-            
         except Exception as exc:
-            # 记录异常日志
-            end_time = timezone.now()
-            execution_time = (end_time - start_time).total_seconds()
-            
-            error_log = {
-                'timestamp': end_time.isoformat(),
-                'method': method,
-                'path': path,
-                'execution_time': execution_time,
-                'user_id': request.user.id if hasattr(request, 'user') and request.user.is_authenticated else None,
-                'exception': str(exc),
-                'traceback': traceback.format_exc(),
-            }
+            if 'exception' not in request_log:
+                request_log['exception'] = str(exc)
+                request_log['traceback'] = traceback.format_exc()
+            # 出错的请求总是记录请求数据
+            if 'data' not in request_log:
+                drf_request = _get_drf_request(self, request)
+                request_log['sampled'] = True
+                request_log['query_params'] = _extract_query_params(drf_request, config)
+                request_log['data'] = _extract_request_data(drf_request, config)
             
-            logger.error(f"API Exception: {json.dumps(error_log, ensure_ascii=False, cls=UUIDEncoder)}")
+            if standalone:
+                request_log['execution_time'] = (timezone.now() - start_time).total_seconds()
+                request_log['user_id'] = _get_user_id(request)
+                logger.error("API Exception: %s", LazyJSON(request_log))
             
             # 重新抛出异常
             raise
+        
+        # 是否记录请求数据按采样率决定，出错的请求总是记录；同一请求只决定一次
+        if 'sampled' not in request_log:
+            request_log['sampled'] = response.status_code >= 400 or _should_sample(request, config)
+        
+        # 请求体在视图执行后提取，此时DRF已经解析过请求体，不会重复解析
+        if request_log['sampled'] and 'data' not in request_log:
+            drf_request = _get_drf_request(self, request)
+            request_log['query_params'] = _extract_query_params(drf_request, config)
+            request_log['data'] = _extract_request_data(drf_request, config)
+        
+        # 按配置记录响应数据（直接返回的缓存响应没有data属性，不记录）
+        if (request_log['sampled'] and config['LOG_RESPONSE_DATA']
+                and 'response_data' not in request_log and hasattr(response, 'data')):
+            try:
+                request_log['response_data'] = summarize_payload(response.data, config, is_request=False)
+            except Exception:
+                request_log['response_data'] = "无法解析的响应数据"
+        
+        if standalone:
+            request_log['status_code'] = response.status_code
+            request_log['execution_time'] = (timezone.now() - start_time).total_seconds()
+            request_log['user_id'] = _get_user_id(request)
+            logger.info("API Request: %s", LazyJSON(request_log))
+        
+        return response
     
     return wrapper
 
@@ -131,35 +432,79 @@ def api_logger(func):
 class RequestLogMiddleware:
     """
     请求日志中间件，记录所有HTTP请求
+    每个请求只输出一条结构化日志，包含api_logger补充的视图信息；
+    同时支持同步和异步请求，ASGI部署时异步视图不需要切换到线程中执行
     """
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
         
     def __call__(self, request):
-        # 记录请求开始时间
-        start_time = timezone.now()
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         
-        # 获取请求信息
-        method = request.method
-        path = request.path
+        # 未启用INFO级别日志时直接处理请求
+        if not logger.isEnabledFor(logging.INFO):
+            return self.get_response(request)
+        
+        # 记录请求开始时间
+        start_time = time.perf_counter()
+        request_log = self._start(request)
         
         # 执行请求
-        response = self.get_response(request)
-        
-        # 计算执行时间
-        end_time = timezone.now()
-        execution_time = (end_time - start_time).total_seconds()
-        
-        # 记录请求日志
-        log_data = {
-            'timestamp': end_time.isoformat(),
-            'method': method,
-            'path': path,
-            'status_code': response.status_code,
-            'execution_time': execution_time,
-            'user_id': request.user.id if hasattr(request, 'user') and request.user.is_authenticated else None,
-        }
+        token = _request_log.set(request_log)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_log.reset(token)
         
-        logger.info(f"HTTP Request: {json.dumps(log_data, ensure_ascii=False, cls=UUIDEncoder)}")
+        self._finish(request_log, response, start_time, _get_user_id(request))
+        return response
+    
+    async def __acall__(self, request):
+        if not logger.isEnabledFor(logging.INFO):
+            return await self.get_response(request)
+        
+        start_time = time.perf_counter()
+        request_log = self._start(request)
+        token = _request_log.set(request_log)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_log.reset(token)
+        
+        # 异步请求中不能触发基于会话的用户查询，只记录已经认证过的用户
+        user = getattr(request, 'user', None)
+        if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+            user_id = None
+        else:
+            user_id = _get_user_id(request)
+        self._finish(request_log, response, start_time, user_id)
+        return response
+    
+    @staticmethod
+    def _start(request):
+        """
+        创建请求日志上下文
+        """
+        return {
+            'timestamp': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.path,
+        }
+    
+    @staticmethod
+    def _finish(request_log, response, start_time, user_id):
+        """
+        补充响应信息并输出日志
+        """
+        request_log['status_code'] = response.status_code
+        request_log['execution_time'] = time.perf_counter() - start_time
+        request_log['user_id'] = user_id
         
-        return response 
\ No newline at end of file
+        level = logging.ERROR if response.status_code >= 500 else logging.INFO
+        logger.log(level, "HTTP Request: %s", LazyJSON(request_log))
@@ -0,0 +1,378 @@
+"""
+进程内指标统计工具，以Prometheus文本格式输出
+多进程部署（如gunicorn预fork多个worker）时，各进程定期把自己的指标写入共享目录，
+采集时合并所有进程的数据
+"""
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# Prometheus文本格式的内容类型
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 统计时保留的请求方法，其他方法归为OTHER
+KNOWN_METHODS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS'}
+
+# 默认的延迟分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    """
+    转义标签值
+    """
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    """
+    格式化标签
+    """
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.extend(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    """
+    格式化数值
+    """
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    指标基类，按标签值分组保存数据
+    每个指标一把锁，锁内只做常数次加法，竞争开销很小
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _check_labels(self, labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}")
+        return tuple(str(value) for value in labelvalues)
+
+    def reset(self):
+        """
+        清空数据
+        """
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self):
+        """
+        获取可序列化的数据快照
+        """
+        with self._lock:
+            series = [[list(labels), self._copy(value)] for labels, value in self._series.items()]
+        return {
+            'type': self.type,
+            'documentation': self.documentation,
+            'labelnames': list(self.labelnames),
+            'series': series,
+        }
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(Metric):
+    """
+    计数器，只增不减
+    """
+    type = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        labels = self._check_labels(labelvalues)
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    仪表盘，记录当前值；多进程合并时按进程分别输出
+    """
+    type = 'gauge'
+
+    def set(self, value, *labelvalues):
+        labels = self._check_labels(labelvalues)
+        with self._lock:
+            self._series[labels] = value
+
+
+class Histogram(Metric):
+    """
+    直方图，按分桶统计观测值的分布，用于计算p50/p95/p99
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        labels = self._check_labels(labelvalues)
+        # 分桶查找在锁外完成
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # [各分桶计数（最后一个为+Inf），总和]
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1]]
+
+    def snapshot(self):
+        data = super().snapshot()
+        data['buckets'] = list(self.buckets)
+        return data
+
+
+class MetricsRegistry:
+    """
+    指标注册表
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+
+        # fork后子进程清空从父进程继承的数据，避免重复统计
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        for metric in list(self._metrics.values()):
+            metric._lock = threading.Lock()
+            metric.reset()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.type}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """
+        获取或创建计数器
+        """
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        """
+        获取或创建仪表盘
+        """
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        获取或创建直方图
+        """
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def snapshot(self):
+        """
+        当前进程所有指标的快照
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    # ---- 多进程共享 ----
+
+    @staticmethod
+    def _multiproc_dir():
+        return getattr(settings, 'METRICS_MULTIPROC_DIR', None)
+
+    def ensure_flusher(self):
+        """
+        配置了共享目录时，确保当前进程的后台线程在定期写入指标快照
+        """
+        if not self._multiproc_dir() or self._flusher_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            thread = threading.Thread(target=self._flush_loop, name='metrics-flusher', daemon=True)
+            thread.start()
+
+    def _flush_loop(self):
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def flush(self):
+        """
+        把当前进程的指标快照写入共享目录，先写临时文件再重命名，保证读取方不会读到半个文件
+        """
+        directory = self._multiproc_dir()
+        if not directory:
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"metrics_{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def collect(self):
+        """
+        收集所有进程的指标快照
+        :return: [(进程ID, 快照)]
+        """
+        snapshots = [(str(os.getpid()), self.snapshot())]
+        directory = self._multiproc_dir()
+        if not directory:
+            return snapshots
+
+        own_path = os.path.join(directory, f"metrics_{os.getpid()}.json")
+        for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+            if path == own_path:
+                continue
+            try:
+                with open(path, encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            pid = os.path.basename(path)[len('metrics_'):-len('.json')]
+            snapshots.append((pid, snapshot))
+        return snapshots
+
+    def render(self):
+        """
+        以Prometheus文本格式输出所有进程合并后的指标
+        计数器和直方图按标签求和，仪表盘按进程分别输出
+        """
+        merged = {}
+        for pid, snapshot in self.collect():
+            for name, data in snapshot.items():
+                metric = merged.setdefault(name, dict(data, series={}))
+                for labels, value in data['series']:
+                    if data['type'] == 'gauge':
+                        labels = labels + [pid]
+                    key = tuple(labels)
+                    if data['type'] == 'histogram':
+                        current = metric['series'].get(key)
+                        if current is None:
+                            metric['series'][key] = [list(value[0]), value[1]]
+                        else:
+                            current[0] = [a + b for a, b in zip(current[0], value[0])]
+                            current[1] += value[1]
+                    elif data['type'] == 'counter':
+                        metric['series'][key] = metric['series'].get(key, 0) + value
+                    else:
+                        metric['series'][key] = value
+
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            labelnames = metric['labelnames']
+            if metric['type'] == 'gauge':
+                labelnames = labelnames + ['pid']
+            lines.append(f"# HELP {name} {metric['documentation']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+
+            for labels, value in sorted(metric['series'].items()):
+                if metric['type'] != 'histogram':
+                    lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+                    continue
+
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric['buckets'] + [float('inf')], counts):
+                    cumulative += count
+                    le = [('le', _format_value(float(bound)))]
+                    lines.append(f"{name}_bucket{_format_labels(labelnames, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labelnames, labels)} {cumulative}")
+
+        return '\n'.join(lines) + '\n'
+
+
+# 全局指标注册表
+registry = MetricsRegistry()
+
+# HTTP请求耗时
+REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds',
+    'HTTP请求处理耗时（秒）',
+    ['route', 'method', 'status'],
+)
+
+
+class RequestMetricsMiddleware:
+    """
+    请求指标中间件，按路由名称、请求方法和状态码类别统计请求耗时
+    同时支持同步和异步请求
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        registry.ensure_flusher()
+        start_time = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, start_time)
+        return response
+
+    async def __acall__(self, request):
+        registry.ensure_flusher()
+        start_time = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, start_time)
+        return response
+
+    @staticmethod
+    def _observe(request, response, start_time):
+        """
+        记录请求耗时
+        """
+        duration = time.perf_counter() - start_time
+        resolver_match = getattr(request, 'resolver_match', None)
+        # 使用路由名称而不是路径，避免路径中的ID导致标签数量无限增长
+        route = (resolver_match.view_name or resolver_match.route) if resolver_match else 'unmatched'
+        method = request.method if request.method in KNOWN_METHODS else 'OTHER'
+        status = f"{response.status_code // 100}xx"
+        REQUEST_DURATION.observe(duration, route, method, status)
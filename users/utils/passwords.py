@@ -0,0 +1,114 @@
+"""
+密码哈希线程池，供异步视图和批量创建用户使用
+PBKDF2等密码哈希每次需要上百毫秒的CPU时间，直接在事件循环中执行会阻塞同一进程的所有请求。
+hashlib在计算哈希时会释放GIL，因此使用线程池即可并行计算，不需要进程池
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PasswordHashPoolBusy(Exception):
+    """
+    等待计算的密码哈希任务已满
+    """
+    pass
+
+
+class PasswordHashPool:
+    """
+    有界的密码哈希线程池
+    正在计算和等待计算的任务数达到上限时直接拒绝，由调用方返回503，避免登录高峰时任务无限排队
+    """
+    def __init__(self, max_workers=4, max_pending=32):
+        """
+        :param max_workers: 计算线程数，一般不超过CPU核数
+        :param max_pending: 最多正在计算和等待计算的任务数
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pending = 0
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """
+        获取当前进程的线程池，fork后的子进程重新创建
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix='password-hash',
+                    )
+                    self._pending = 0
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, func, *args):
+        """
+        在线程池中执行函数并等待结果
+        :raises PasswordHashPoolBusy: 任务已满
+        """
+        executor = self._get_executor()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PasswordHashPoolBusy()
+            self._pending += 1
+
+        try:
+            future = executor.submit(func, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        # 计算完成时才释放名额，请求被取消时线程仍在计算，不能提前释放
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    async def check_password(self, password, encoded):
+        """
+        校验密码，不会在校验时升级哈希算法
+        """
+        return await self.run(hashers.check_password, password, encoded)
+
+    async def make_password(self, password):
+        """
+        计算密码哈希
+        """
+        return await self.run(hashers.make_password, password)
+    
+    def make_passwords(self, passwords):
+        """
+        同步计算多个密码哈希，在线程池中并行计算，供批量创建用户使用
+        不受max_pending限制，调用方需要限制单次的数量
+        :return: 与passwords顺序一致的哈希列表
+        """
+        return list(self._get_executor().map(hashers.make_password, passwords))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_password_hash_pool():
+    """
+    获取按settings.PASSWORD_HASH_POOL配置的密码哈希线程池
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = settings.PASSWORD_HASH_POOL
+                _pool = PasswordHashPool(
+                    max_workers=config.get('MAX_WORKERS', 4),
+                    max_pending=config.get('MAX_PENDING', 32),
+                )
+    return _pool
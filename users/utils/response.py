@@ -18,6 +18,7 @@ HTTP状态码:
 - 500: 服务器错误
 """
 
+from django.http import JsonResponse
 from rest_framework.response import Response
 from rest_framework import status
 
@@ -89,4 +90,18 @@ def unauthorized_response(msg="未授权", code=401, status_code=status.HTTP_401
     """
     未授权响应
     """
-    return APIResponse(msg=msg, code=code, status=status_code, **kwargs) 
\ No newline at end of file
+    return APIResponse(msg=msg, code=code, status=status_code, **kwargs) 
+
+
+def json_response(data=None, msg="操作成功", code=200, status_code=status.HTTP_200_OK, headers=None, **kwargs):
+    """
+    统一格式的JSON响应，用于不经过DRF的普通Django视图（如异步视图）
+    """
+    std_data = {
+        "code": code or 0,
+        "message": msg or "success",
+    }
+    if data is not None:
+        std_data["data"] = data
+    std_data.update(kwargs)
+    return JsonResponse(std_data, status=status_code, headers=headers, json_dumps_params={'ensure_ascii': False})
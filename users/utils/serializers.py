@@ -1,4 +1,8 @@
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 class BaseModelSerializer(serializers.ModelSerializer):
@@ -109,4 +113,144 @@ class RecursiveSerializer(serializers.Serializer):
     def to_representation(self, instance):
         # 获取序列化器类
         serializer = self.parent.parent.__class__(instance, context=self.context)
-        return serializer.data 
\ No newline at end of file
+        return serializer.data 
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    批量序列化器，通过子序列化器 Meta.list_serializer_class 使用
+
+    创建使用 bulk_create，更新使用 bulk_update，每批只执行一条INSERT或UPDATE语句；
+    字段的唯一性校验对所有条目合并为一次查询，不再每个条目查询一次。
+    批量更新时 instance 为待更新的对象列表，每个条目通过 id 对应到其中一个对象。
+    bulk_create/bulk_update 不调用模型的 save 方法，也不触发 post_save 信号，不支持多对多字段
+    """
+    default_error_messages = {
+        'not_found': _('对象不存在'),
+        'duplicate': _('与第{index}条重复'),
+    }
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', settings.BULK_OPERATIONS.get('MAX_ITEMS', 1000))
+        super().__init__(*args, **kwargs)
+        self._matched_instances = []
+        self._unique_fields = None
+
+    def _get_unique_fields(self):
+        """
+        取出子序列化器字段上的精确匹配唯一性校验器，改为在 validate_unique_fields 中批量校验
+        :return: [(字段名, 模型字段名, 查询集, 错误信息)]
+        """
+        if self._unique_fields is None:
+            self._unique_fields = []
+            for field_name, field in self.child.fields.items():
+                if field.read_only:
+                    continue
+                validators = []
+                for validator in field.validators:
+                    if isinstance(validator, UniqueValidator) and validator.lookup == 'exact':
+                        self._unique_fields.append((field_name, field.source, validator.queryset, validator.message))
+                    else:
+                        validators.append(validator)
+                field.validators = validators
+        return self._unique_fields
+
+    def _get_instance_map(self):
+        if not hasattr(self, '_instance_map'):
+            self._instance_map = {str(instance.pk): instance for instance in self.instance or []}
+        return self._instance_map
+
+    def run_child_validation(self, data):
+        """
+        批量更新时，按条目中的 id 找到对应的对象后再校验
+        """
+        if self.instance is not None:
+            pk = data.get('id') if isinstance(data, dict) else None
+            instance = self._get_instance_map().get(str(pk))
+            if instance is None:
+                raise serializers.ValidationError({'id': [self.error_messages['not_found']]}, code='not_found')
+            self.child.instance = instance
+            self.child.initial_data = data
+            self._matched_instances.append(instance)
+        return super().run_child_validation(data)
+
+    def to_internal_value(self, data):
+        self._get_unique_fields()
+        self._matched_instances = []
+        validated = super().to_internal_value(data)
+        errors = self.validate_unique_fields(validated)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return validated
+
+    def validate_unique_fields(self, validated):
+        """
+        批量校验唯一字段，包括与数据库中已有数据重复和同一批条目之间重复
+        :return: 与条目一一对应的错误列表
+        """
+        errors = [{} for _item in validated]
+        for field_name, source, queryset, message in self._unique_fields:
+            values = {}
+            for index, attrs in enumerate(validated):
+                value = attrs.get(source)
+                if value is None:
+                    continue
+                if value in values:
+                    errors[index].setdefault(field_name, []).append(
+                        self.error_messages['duplicate'].format(index=values[value] + 1)
+                    )
+                else:
+                    values[value] = index
+            if not values:
+                continue
+
+            owners = dict(queryset.filter(**{f'{source}__in': list(values)}).values_list(source, 'pk'))
+            for value, owner_pk in owners.items():
+                index = values[value]
+                instance = self._matched_instances[index] if self._matched_instances else None
+                # 更新时与对象自身原有的值相同不算重复
+                if instance is not None and instance.pk == owner_pk:
+                    continue
+                errors[index].setdefault(field_name, []).append(message)
+        return errors
+
+    def build_instances(self, validated_data):
+        """
+        由校验后的数据构造未保存的对象，子序列化器定义了 build_instances 时使用子序列化器的方法
+        """
+        if hasattr(self.child, 'build_instances'):
+            return self.child.build_instances(validated_data)
+        model = self.child.Meta.model
+        return [model(**attrs) for attrs in validated_data]
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        return model._default_manager.bulk_create(
+            self.build_instances([dict(attrs) for attrs in validated_data]),
+            batch_size=settings.BULK_OPERATIONS.get('BATCH_SIZE'),
+        )
+
+    def update(self, instances, validated_data):
+        model = self.child.Meta.model
+        fields = set()
+        for instance, attrs in zip(self._matched_instances, validated_data):
+            for attr, value in attrs.items():
+                setattr(instance, attr, value)
+            fields.update(attrs)
+        if not fields:
+            return self._matched_instances
+
+        # bulk_update 不会自动更新 auto_now 字段
+        now = timezone.now()
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.DateField) and field.auto_now:
+                for instance in self._matched_instances:
+                    setattr(instance, field.attname, now)
+                fields.add(field.name)
+
+        model._default_manager.bulk_update(
+            self._matched_instances,
+            sorted(fields),
+            batch_size=settings.BULK_OPERATIONS.get('BATCH_SIZE'),
+        )
+        return self._matched_instances
@@ -1,13 +1,23 @@
 """
 短信工具类，用于发送短信验证码
 """
+import math
+import os
 import random
 import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from django.conf import settings
 from django.core.cache import cache
-from tencentcloud.common import credential
-from tencentcloud.common.exception.tencent_cloud_sdk_exception import TencentCloudSDKException
-from tencentcloud.sms.v20210111 import sms_client, models
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from . import metrics
+from .cache import RateLimiter, compare_and_delete
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .sms_backends import SMSBackendError, get_backend, load_backend
 
 logger = logging.getLogger('django')
 
@@ -23,58 +33,240 @@ class SMSUtil:
         :return: 随机验证码
         """
         return ''.join(random.choice('0123456789') for _ in range(length))
-    
+
+    @staticmethod
+    def store_code(phone, code, issued_at=None):
+        """
+        将验证码及其生成时间存入缓存，验证码从生成时起计算过期时间
+        :param phone: 手机号
+        :param code: 验证码
+        :param issued_at: 生成时间戳，默认为当前时间
+        """
+        now = time.time()
+        issued_at = issued_at or now
+        timeout = settings.SMS_CODE_EXPIRE_MINUTES * 60 - (now - issued_at)
+        if timeout <= 0:
+            return
+        cache_key = f"{settings.SMS_CODE_CACHE_PREFIX}{phone}"
+        cache.set(cache_key, (code, issued_at), timeout)
+
+    @staticmethod
+    def get_code_entry(phone):
+        """
+        获取手机号当前有效的验证码及其生成时间
+        :param phone: 手机号
+        :return: (验证码, 生成时间戳)，没有时返回None；旧格式的缓存值生成时间为None
+        """
+        return SMSUtil._parse_code_entry(cache.get(f"{settings.SMS_CODE_CACHE_PREFIX}{phone}"))
+
+    @staticmethod
+    def _parse_code_entry(value):
+        """
+        解析缓存中的验证码，兼容只保存验证码字符串的旧格式
+        """
+        if not value:
+            return None
+        if isinstance(value, str):
+            return value, None
+        return tuple(value)
+
+    @staticmethod
+    def get_code(phone):
+        """
+        获取手机号当前有效的验证码，没有时返回None
+        :param phone: 手机号
+        :return: 验证码
+        """
+        entry = SMSUtil.get_code_entry(phone)
+        return entry[0] if entry else None
+
     @staticmethod
-    def send_verification_code(phone):
+    def check_send_limits(phone, ip=None):
+        """
+        发送前检查手机号和IP地址的发送间隔及每日发送次数，只访问缓存，不调用短信服务
+        发送间隔用cache.add原子占位，并发请求中只有一个能通过；每日次数按最近24小时滑动窗口计数
+        :param phone: 手机号
+        :param ip: 客户端IP地址，应通过get_client_ip按可信代理解析，客户端可以伪造X-Forwarded-For
+        :return: (bool, str) - (是否允许发送, 拒绝原因)
+        """
+        config = settings.SMS_SEND_LIMITS
+        now = time.time()
+        acquired = []
+        for kind, identifier, cooldown in (
+            ('phone', phone, config.get('PHONE_COOLDOWN', 60)),
+            ('ip', ip, config.get('IP_COOLDOWN', 0)),
+        ):
+            if not identifier or not cooldown:
+                continue
+            key = f"sms_cooldown:{kind}:{identifier}"
+            # 值为冷却结束时间，用于计算剩余等待时间
+            if cache.add(key, now + cooldown, cooldown):
+                acquired.append(key)
+                continue
+            cache.delete_many(acquired)
+            remaining = max(1, math.ceil((cache.get(key) or now + 1) - now))
+            return False, f"发送过于频繁，请{remaining}秒后重试"
+
+        counted = []
+        for kind, identifier, limit in (
+            ('phone', phone, config.get('PHONE_DAILY_LIMIT')),
+            ('ip', ip, config.get('IP_DAILY_LIMIT')),
+        ):
+            if not identifier or not limit:
+                continue
+            limiter = RateLimiter(f"sms_daily:{kind}", limit, 86400)
+            if not limiter.is_allowed(identifier):
+                # 被后面的限制拒绝时，撤销前面已计入的每日次数，拒绝的请求不消耗配额
+                for counted_limiter, counted_identifier in counted:
+                    counted_limiter.release(counted_identifier)
+                cache.delete_many(acquired)
+                return False, "今日发送次数已达上限，请明天再试"
+            counted.append((limiter, identifier))
+
+        return True, None
+
+    @staticmethod
+    def release_send_limits(phone, ip=None):
+        """
+        发送失败时解除发送间隔限制并撤销本次计入的每日次数，允许用户立即重试，失败的发送不消耗配额
+        :param phone: 手机号
+        :param ip: 客户端IP地址
+        """
+        config = settings.SMS_SEND_LIMITS
+        keys = [f"sms_cooldown:phone:{phone}"]
+        if ip:
+            keys.append(f"sms_cooldown:ip:{ip}")
+        cache.delete_many(keys)
+
+        for kind, identifier, limit in (
+            ('phone', phone, config.get('PHONE_DAILY_LIMIT')),
+            ('ip', ip, config.get('IP_DAILY_LIMIT')),
+        ):
+            if identifier and limit:
+                RateLimiter(f"sms_daily:{kind}", limit, 86400).release(identifier)
+
+    @staticmethod
+    def discard_code(phone, code):
+        """
+        删除未能送达的验证码，缓存中已经是其他验证码时不删除
+        :param phone: 手机号
+        :param code: 验证码
+        """
+        cache_key = f"{settings.SMS_CODE_CACHE_PREFIX}{phone}"
+        value = cache.get(cache_key)
+        entry = SMSUtil._parse_code_entry(value)
+        if entry and entry[0] == code:
+            compare_and_delete(cache_key, value)
+
+    @staticmethod
+    def issue_code(phone):
+        """
+        获取要发送的验证码，上一个验证码生成后未超过复用时间时重新发送同一个验证码，
+        避免重复发送导致用户手中先收到的验证码失效
+        :param phone: 手机号
+        :return: (验证码, 生成时间戳)
+        """
+        reuse_seconds = settings.SMS_SEND_LIMITS.get('CODE_REUSE_SECONDS', 0)
+        entry = SMSUtil.get_code_entry(phone)
+        if reuse_seconds and entry and entry[1] and time.time() - entry[1] <= reuse_seconds:
+            return entry
+        return SMSUtil.generate_code(), time.time()
+
+    @staticmethod
+    def send_batch(phones, params):
+        """
+        通过settings.SMS_BACKEND配置的短信后端向一批手机号发送相同模板参数的短信，
+        经过熔断器，配置了备用后端时对慢请求进行对冲，网络或服务商异常直接抛出
+        :param phones: 手机号列表
+        :param params: 模板参数列表
+        :return: dict - {手机号: (是否成功, 服务商返回的消息)}
+        """
+        return get_sender().send(phones, params)
+
+    @staticmethod
+    def deliver(phone, code):
+        """
+        发送验证码短信，开启批量发送时与其他相同模板参数的短信合并为一次接口调用，网络或SDK异常直接抛出
+        :param phone: 手机号
+        :param code: 验证码
+        :return: (bool, str) - (是否成功, 消息)
+        """
+        if settings.SMS_BATCH.get('ENABLED'):
+            success, error = get_batcher().send(phone, [code])
+        else:
+            success, error = SMSUtil.send_batch([phone], [code]).get(phone, (False, "未返回发送结果"))
+
+        # 检查发送结果
+        if success:
+            # 验证码不写入日志
+            logger.info("短信验证码发送成功: %s", phone)
+            return True, "验证码发送成功"
+
+        logger.error("短信验证码发送失败: %s, 错误: %s", phone, error)
+        return False, f"验证码发送失败: {error}"
+
+    @staticmethod
+    def send_verification_code(phone, ip=None):
         """
         发送验证码
         :param phone: 手机号
+        :param ip: 客户端IP地址，用于按IP限制发送频率
         :return: (bool, str) - (是否成功, 消息)
         """
-        # 生成验证码
-        code = SMSUtil.generate_code()
-        
+        allowed, message = SMSUtil.check_send_limits(phone, ip)
+        if not allowed:
+            return False, message
+
+        # 生成或复用验证码
+        code, issued_at = SMSUtil.issue_code(phone)
+
         try:
-            # 实例化一个认证对象
-            cred = credential.Credential(
-                settings.TENCENT_CLOUD_SMS['SECRET_ID'], 
-                settings.TENCENT_CLOUD_SMS['SECRET_KEY']
-            )
-            
-            # 实例化要请求产品的client对象
-            client = sms_client.SmsClient(cred, "ap-guangzhou")
-            
-            # 实例化一个请求对象
-            req = models.SendSmsRequest()
-            
-            # 设置参数
-            req.SmsSdkAppId = settings.TENCENT_CLOUD_SMS['APP_ID']
-            req.SignName = settings.TENCENT_CLOUD_SMS['SIGN_NAME']
-            req.TemplateId = settings.TENCENT_CLOUD_SMS['TEMPLATE_ID']
-            req.TemplateParamSet = [code]
-            req.PhoneNumberSet = [f"+86{phone}"]
-            
-            # 发送短信
-            resp = client.SendSms(req)
-            
-            # 检查发送结果
-            if resp.SendStatusSet[0].Code == "Ok":
-                # 将验证码存入缓存，设置过期时间
-                cache_key = f"{settings.SMS_CODE_CACHE_PREFIX}{phone}"
-                cache.set(cache_key, code, settings.SMS_CODE_EXPIRE_MINUTES * 60)
-                logger.info(f"短信验证码发送成功: {phone}, 验证码: {code}")
-                return True, "验证码发送成功"
-            else:
-                logger.error(f"短信验证码发送失败: {phone}, 错误: {resp.SendStatusSet[0].Message}")
-                return False, f"验证码发送失败: {resp.SendStatusSet[0].Message}"
-                
-        except TencentCloudSDKException as err:
-            logger.error(f"腾讯云SDK异常: {err}")
-            return False, f"验证码发送失败: {err}"
+            success, message = SMSUtil.deliver(phone, code)
+        except SMSBackendError as err:
+            logger.error("短信服务异常: %s", err)
+            success, message = False, f"验证码发送失败: {err}"
         except Exception as e:
-            logger.error(f"发送短信验证码异常: {e}")
-            return False, "验证码发送失败，请稍后重试"
-    
+            logger.error("发送短信验证码异常: %s", e)
+            success, message = False, "验证码发送失败，请稍后重试"
+
+        if success:
+            SMSUtil.store_code(phone, code, issued_at)
+        else:
+            SMSUtil.release_send_limits(phone, ip)
+        return success, message
+
+    @staticmethod
+    def dispatch_verification_code(phone, ip=None):
+        """
+        按配置的发送方式发送验证码
+        异步模式下验证码先写入缓存，发送任务交给后台线程池后立即返回任务ID
+        :param phone: 手机号
+        :param ip: 客户端IP地址，用于按IP限制发送频率
+        :return: (bool, str, str) - (是否成功, 消息, 任务ID)，同步模式下任务ID为None
+        """
+        if not settings.SMS_DISPATCH.get('ASYNC'):
+            success, message = SMSUtil.send_verification_code(phone, ip)
+            return success, message, None
+
+        allowed, message = SMSUtil.check_send_limits(phone, ip)
+        if not allowed:
+            return False, message, None
+
+        started = time.time()
+        code, issued_at = SMSUtil.issue_code(phone)
+        # 复用的验证码之前已经送达，本次发送失败时不删除
+        discard_code = issued_at >= started
+        # 先写入验证码再提交任务，发送任务最终失败时由后台线程删除
+        SMSUtil.store_code(phone, code, issued_at)
+        task_id = get_dispatcher().submit(phone, code, ip=ip, discard_code=discard_code)
+        if task_id is None:
+            SMSUtil.release_send_limits(phone, ip)
+            if discard_code:
+                SMSUtil.discard_code(phone, code)
+            return False, "短信发送繁忙，请稍后重试", None
+
+        return True, "验证码发送中", task_id
+
     @staticmethod
     def verify_code(phone, code):
         """
@@ -84,14 +276,430 @@ class SMSUtil:
         :return: bool - 验证是否成功
         """
         cache_key = f"{settings.SMS_CODE_CACHE_PREFIX}{phone}"
-        cached_code = cache.get(cache_key)
-        
-        if not cached_code:
+        value = cache.get(cache_key)
+        entry = SMSUtil._parse_code_entry(value)
+
+        if not entry or entry[0] != code:
             return False
-        
-        # 验证成功后删除缓存中的验证码
-        if cached_code == code:
-            cache.delete(cache_key)
-            return True
-        
-        return False 
\ No newline at end of file
+
+        # 验证成功后原子地删除缓存中的验证码，缓存值已被替换或已被其他请求使用时验证失败
+        return compare_and_delete(cache_key, value)
+
+
+class SMSDispatcher:
+    """
+    短信异步发送器
+    发送任务提交到有界线程池后立即返回，待发送任务超过上限时拒绝新任务；
+    网络或SDK异常时在后台按指数退避重试，发送状态写入缓存，可通过任务ID查询
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    # 发送状态的缓存键前缀
+    STATUS_CACHE_PREFIX = 'sms_task_'
+
+    def __init__(self, sender=None, max_workers=4, max_pending=1000, max_retries=3,
+                 retry_backoff=0.5, status_timeout=3600):
+        """
+        :param sender: 发送函数，接收 (phone, code)，返回 (是否成功, 消息)，默认为 SMSUtil.deliver，
+                       测试时可以传入本地的模拟发送函数
+        :param max_workers: 发送线程数
+        :param max_pending: 最多等待发送和正在发送的任务数
+        :param max_retries: 异常时的最大重试次数
+        :param retry_backoff: 首次重试的等待时间（秒），之后每次翻倍
+        :param status_timeout: 发送状态的保留时间（秒）
+        """
+        self.sender = sender or SMSUtil.deliver
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.status_timeout = status_timeout
+        self._executor = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """
+        获取当前进程的线程池，fork后的子进程重新创建
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix='sms-dispatch',
+                    )
+                    self._slots = threading.BoundedSemaphore(self.max_pending)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, phone, code, ip=None, discard_code=True):
+        """
+        提交发送任务
+        :param phone: 手机号
+        :param code: 验证码
+        :param ip: 客户端IP地址，最终发送失败时解除该IP的发送限制
+        :param discard_code: 最终发送失败时是否删除缓存中的验证码
+        :return: 任务ID，待发送任务已满时返回None
+        """
+        executor = self._get_executor()
+        if not self._slots.acquire(blocking=False):
+            logger.warning("短信发送队列已满，拒绝发送: %s", phone)
+            return None
+
+        task_id = uuid.uuid4().hex
+        self._set_status(task_id, self.STATUS_QUEUED)
+        try:
+            executor.submit(self._run, task_id, phone, code, ip, discard_code)
+        except RuntimeError:
+            # 线程池已关闭（进程退出中）
+            self._slots.release()
+            self._set_status(task_id, self.STATUS_FAILED, message="短信发送服务不可用")
+            return None
+        return task_id
+
+    def get_status(self, task_id):
+        """
+        查询发送状态
+        :param task_id: 任务ID
+        :return: 状态字典，任务不存在或已过期时返回None
+        """
+        return cache.get(f"{self.STATUS_CACHE_PREFIX}{task_id}")
+
+    def _set_status(self, task_id, status, attempts=0, message=None):
+        cache.set(f"{self.STATUS_CACHE_PREFIX}{task_id}", {
+            'status': status,
+            'attempts': attempts,
+            'message': message,
+            'updated_at': time.time(),
+        }, self.status_timeout)
+
+    def _run(self, task_id, phone, code, ip=None, discard_code=True):
+        """
+        后台线程执行发送任务
+        最终发送失败时与同步发送一致：解除发送限制、删除未送达的验证码，用户可以立即重新获取
+        """
+        try:
+            for attempt in range(1, self.max_retries + 2):
+                self._set_status(task_id, self.STATUS_SENDING, attempt)
+                try:
+                    success, message = self.sender(phone, code)
+                except Exception as exc:
+                    logger.error("发送短信验证码异常: %s, 第%s次, %s", phone, attempt, exc)
+                    if attempt > self.max_retries:
+                        self._fail(task_id, attempt, "验证码发送失败，请稍后重试", phone, code, ip, discard_code)
+                        return
+                    time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+                    continue
+
+                # 服务商明确返回的失败（如号码无效）不重试
+                if success:
+                    self._set_status(task_id, self.STATUS_SENT, attempt, message)
+                else:
+                    self._fail(task_id, attempt, message, phone, code, ip, discard_code)
+                return
+        finally:
+            self._slots.release()
+
+    def _fail(self, task_id, attempt, message, phone, code, ip, discard_code):
+        """
+        记录发送失败，解除发送限制并删除未送达的验证码
+        """
+        SMSUtil.release_send_limits(phone, ip)
+        if discard_code:
+            SMSUtil.discard_code(phone, code)
+        self._set_status(task_id, self.STATUS_FAILED, attempt, message)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher():
+    """
+    获取按settings.SMS_DISPATCH配置的短信异步发送器
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                config = settings.SMS_DISPATCH
+                _dispatcher = SMSDispatcher(
+                    max_workers=config.get('MAX_WORKERS', 4),
+                    max_pending=config.get('MAX_PENDING', 1000),
+                    max_retries=config.get('MAX_RETRIES', 3),
+                    retry_backoff=config.get('RETRY_BACKOFF', 0.5),
+                    status_timeout=config.get('STATUS_TIMEOUT', 3600),
+                )
+    return _dispatcher
+
+
+class SMSBatcher:
+    """
+    短信批量发送器
+    腾讯云一次请求可以向多个号码发送同一模板参数的短信，但不支持为每个号码指定不同的参数，
+    因此只有模板参数完全相同的短信才能合并。同一组中最先到达的调用方等待一小段时间收集同组短信，
+    然后一次发出，再把每个号码的发送结果交还给对应的调用方；组内号码达到上限时立即发送
+    """
+    def __init__(self, sender=None, max_size=200, max_wait=0.005):
+        """
+        :param sender: 批量发送函数，接收 (手机号列表, 模板参数列表)，返回 {手机号: (是否成功, 消息)}，
+                       默认为 SMSUtil.send_batch
+        :param max_size: 每批最多的号码数，腾讯云单次请求上限为200
+        :param max_wait: 收集同组短信的最长等待时间（秒）
+        """
+        self.sender = sender or SMSUtil.send_batch
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def send(self, phone, params):
+        """
+        发送短信，阻塞到所在批次发送完成
+        :param phone: 手机号
+        :param params: 模板参数列表
+        :return: (bool, str) - (是否成功, 服务商返回的消息)
+        """
+        key = tuple(params)
+        future = Future()
+
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._pending[key] = {'waiters': [], 'full': threading.Event()}
+            batch['waiters'].append((phone, future))
+            if len(batch['waiters']) >= self.max_size:
+                del self._pending[key]
+                batch['full'].set()
+                # 由凑满批次的调用方负责发送
+                ready = batch
+            else:
+                ready = None
+
+        if ready is None and leader:
+            batch['full'].wait(self.max_wait)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+                    ready = batch
+
+        if ready is not None:
+            self._flush(key, ready['waiters'])
+
+        return future.result()
+
+    def _flush(self, params, waiters):
+        """
+        发送一个批次，并把结果分发给该批次的所有调用方
+        """
+        phones = list(dict.fromkeys(phone for phone, _ in waiters))
+        try:
+            results = self.sender(phones, list(params))
+        except BaseException as exc:
+            # 异常交给每个调用方各自抛出
+            for _, future in waiters:
+                future.set_exception(exc)
+            return
+
+        for phone, future in waiters:
+            future.set_result(results.get(phone, (False, "未返回发送结果")))
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+def get_batcher():
+    """
+    获取按settings.SMS_BATCH配置的短信批量发送器
+    """
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                config = settings.SMS_BATCH
+                _batcher = SMSBatcher(
+                    max_size=config.get('MAX_SIZE', 200),
+                    max_wait=config.get('MAX_WAIT', 0.005),
+                )
+    return _batcher
+
+
+SMS_HEDGES = metrics.registry.counter(
+    'sms_hedged_requests_total',
+    '短信对冲请求次数，按最先成功的后端分类（primary/secondary/none）',
+    ['winner'],
+)
+
+
+class SMSSender:
+    """
+    带熔断和对冲的短信发送器
+    主后端和备用后端各有一个熔断器，熔断打开时直接失败而不再等待服务商超时；
+    配置了备用后端时，主后端在最近耗时的指定分位数内未返回，就同时向备用后端发送，采用先成功的结果。
+    对冲可能导致用户收到两条内容相同的短信，以此换取服务商变慢时更低的尾延迟
+    """
+    # 计算对冲等待时间所需的最少耗时样本数
+    MIN_SAMPLES = 20
+
+    def __init__(self, primary, secondary=None, breaker_options=None, hedge_percentile=95,
+                 hedge_min_delay=0.2, hedge_default_delay=1.0, max_workers=16):
+        """
+        :param primary: 主后端
+        :param secondary: 备用后端，用于对冲，为None时不对冲
+        :param breaker_options: 熔断器参数，为None时不熔断
+        :param hedge_percentile: 主后端耗时的分位数，超过该耗时仍未返回时发出对冲请求
+        :param hedge_min_delay: 对冲等待的最短时间（秒）
+        :param hedge_default_delay: 耗时样本不足时的对冲等待时间（秒）
+        :param max_workers: 对冲发送的线程数
+        """
+        self.primary = primary
+        self.secondary = secondary
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.max_workers = max_workers
+
+        self.breakers = {}
+        if breaker_options is not None:
+            self.breakers[id(primary)] = CircuitBreaker('sms_primary', **breaker_options)
+            if secondary is not None:
+                self.breakers[id(secondary)] = CircuitBreaker('sms_secondary', **breaker_options)
+
+        # 主后端最近成功调用的耗时
+        self._latencies = deque(maxlen=200)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """
+        获取当前进程的线程池，fork后的子进程重新创建
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix='sms-hedge',
+                    )
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _call(self, backend, phones, params):
+        """
+        通过熔断器调用后端
+        """
+        breaker = self.breakers.get(id(backend))
+        if breaker is not None:
+            try:
+                breaker.allow()
+            except CircuitOpenError as exc:
+                raise SMSBackendError(str(exc)) from exc
+
+        start = time.perf_counter()
+        try:
+            result = backend.send(phones, params)
+        except Exception:
+            if breaker is not None:
+                breaker.record(time.perf_counter() - start, True)
+            raise
+
+        duration = time.perf_counter() - start
+        if breaker is not None:
+            breaker.record(duration, False)
+        if backend is self.primary:
+            self._latencies.append(duration)
+        return result
+
+    def hedge_delay(self):
+        """
+        发出对冲请求前等待主后端的时间（秒）
+        """
+        latencies = sorted(self._latencies)
+        if len(latencies) < self.MIN_SAMPLES:
+            return max(self.hedge_min_delay, self.hedge_default_delay)
+        index = min(len(latencies) - 1, len(latencies) * self.hedge_percentile // 100)
+        return max(self.hedge_min_delay, latencies[index])
+
+    def send(self, phones, params):
+        """
+        发送短信
+        :return: dict - {手机号: (是否成功, 服务商返回的消息)}
+        :raises SMSBackendError: 所有后端都失败或被熔断
+        """
+        if self.secondary is None:
+            return self._call(self.primary, phones, params)
+
+        executor = self._get_executor()
+        primary = executor.submit(self._call, self.primary, phones, params)
+        wait([primary], timeout=self.hedge_delay())
+        if primary.done() and primary.exception() is None:
+            return primary.result()
+
+        # 主后端过慢或失败，向备用后端发送
+        secondary = executor.submit(self._call, self.secondary, phones, params)
+        pending = {primary: 'primary', secondary: 'secondary'}
+        error = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                winner = pending.pop(future)
+                if future.exception() is None:
+                    SMS_HEDGES.inc(winner)
+                    return future.result()
+                error = future.exception()
+
+        SMS_HEDGES.inc('none')
+        raise error
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+def get_sender():
+    """
+    获取按settings.SMS_CIRCUIT_BREAKER和settings.SMS_HEDGE配置的短信发送器
+    """
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                breaker_config = settings.SMS_CIRCUIT_BREAKER
+                breaker_options = None
+                if breaker_config.get('ENABLED', True):
+                    breaker_options = {
+                        'failure_rate_threshold': breaker_config.get('FAILURE_RATE_THRESHOLD', 0.5),
+                        'slow_call_duration': breaker_config.get('SLOW_CALL_DURATION', 3.0),
+                        'slow_call_rate_threshold': breaker_config.get('SLOW_CALL_RATE_THRESHOLD', 0.8),
+                        'window_size': breaker_config.get('WINDOW_SIZE', 20),
+                        'minimum_calls': breaker_config.get('MINIMUM_CALLS', 10),
+                        'open_timeout': breaker_config.get('OPEN_TIMEOUT', 30),
+                        'half_open_max_calls': breaker_config.get('HALF_OPEN_MAX_CALLS', 3),
+                    }
+
+                hedge_config = settings.SMS_HEDGE
+                secondary = load_backend(hedge_config['BACKEND']) if hedge_config.get('BACKEND') else None
+                _sender = SMSSender(
+                    get_backend(),
+                    secondary,
+                    breaker_options=breaker_options,
+                    hedge_percentile=hedge_config.get('PERCENTILE', 95),
+                    hedge_min_delay=hedge_config.get('MIN_DELAY', 0.2),
+                    hedge_default_delay=hedge_config.get('DEFAULT_DELAY', 1.0),
+                    max_workers=hedge_config.get('MAX_WORKERS', 16),
+                )
+    return _sender
+
+@receiver(setting_changed)
+def reset_sender(*, setting, **kwargs):
+    """
+    短信后端、熔断或对冲配置变化时重新创建发送器
+    """
+    global _sender
+    if setting in ('SMS_BACKEND', 'SMS_CLIENT_POOL', 'SMS_CIRCUIT_BREAKER', 'SMS_HEDGE'):
+        _sender = None
@@ -0,0 +1,317 @@
+"""
+短信后端，封装不同短信服务商的发送接口
+通过 settings.SMS_BACKEND 选择后端，格式与Django的缓存、邮件后端配置类似：
+{'BACKEND': 后端类的导入路径, 'OPTIONS': 传给后端构造函数的参数}
+"""
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .logger import REDACTED
+
+logger = logging.getLogger('django')
+
+
+class SMSBackendError(Exception):
+    """
+    短信服务异常，如网络错误、鉴权失败、服务商限流等，调用方可以重试
+    """
+    pass
+
+
+class BaseSMSBackend:
+    """
+    短信后端基类
+    """
+    def __init__(self, **options):
+        pass
+
+    def send(self, phones, params):
+        """
+        向一批手机号发送相同模板参数的短信，子类重写
+        :param phones: 手机号列表
+        :param params: 模板参数列表
+        :return: dict - {手机号: (是否成功, 服务商返回的消息)}
+        :raises SMSBackendError: 网络或服务商异常
+        """
+        raise NotImplementedError('.send() must be overridden')
+
+
+# 当前进程中的客户端池，fork后由同一个钩子在子进程中统一重置
+_pools = weakref.WeakSet()
+
+
+def _reset_pools_after_fork():
+    """
+    fork后丢弃子进程从父进程继承的客户端
+    """
+    for pool in list(_pools):
+        pool._reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+class SMSClientPool:
+    """
+    腾讯云短信客户端池
+    客户端内部持有HTTP会话，复用客户端即可复用长连接，避免每次发送都重新建立TLS连接；
+    单个客户端不保证线程安全，因此每个线程借出独占的客户端，用完归还。
+    客户端在首次使用时创建，fork后的子进程丢弃从父进程继承的客户端
+    """
+    def __init__(self, max_size=8, region='ap-guangzhou', connect_timeout=3, read_timeout=10,
+                 acquire_timeout=5):
+        """
+        :param max_size: 最多创建的客户端数
+        :param region: 地域
+        :param connect_timeout: 建立连接超时时间（秒）
+        :param read_timeout: 读取响应超时时间（秒）
+        :param acquire_timeout: 客户端全部借出时的最长等待时间（秒）
+        """
+        self.max_size = max_size
+        self.region = region
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.acquire_timeout = acquire_timeout
+        self._reset()
+        _pools.add(self)
+
+    def _reset(self):
+        # 后进先出，优先复用最近使用过、连接仍然存活的客户端
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create_client(self):
+        """
+        创建客户端，开启长连接并设置超时时间
+        """
+        from tencentcloud.common import credential
+        from tencentcloud.common.profile.client_profile import ClientProfile
+        from tencentcloud.common.profile.http_profile import HttpProfile
+        from tencentcloud.sms.v20210111 import sms_client
+
+        cred = credential.Credential(
+            settings.TENCENT_CLOUD_SMS['SECRET_ID'],
+            settings.TENCENT_CLOUD_SMS['SECRET_KEY']
+        )
+        # SDK把reqTimeout原样传给requests，可以用元组分别指定连接和读取超时
+        http_profile = HttpProfile(
+            reqTimeout=(self.connect_timeout, self.read_timeout),
+            keepAlive=True,
+        )
+        return sms_client.SmsClient(cred, self.region, ClientProfile(httpProfile=http_profile))
+
+    def acquire(self):
+        """
+        借出客户端，没有空闲客户端且未达到上限时创建新的客户端
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.max_size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._create_client()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise SMSBackendError('短信客户端池已耗尽') from None
+
+    def release(self, client, discard=False):
+        """
+        归还客户端，发生异常的客户端直接丢弃，避免复用状态异常的连接
+        """
+        if discard:
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(client)
+
+    @contextmanager
+    def client(self):
+        """
+        以上下文管理器的方式借用客户端
+        """
+        client = self.acquire()
+        try:
+            yield client
+        except Exception:
+            self.release(client, discard=True)
+            raise
+        else:
+            self.release(client)
+
+
+class TencentSMSBackend(BaseSMSBackend):
+    """
+    腾讯云短信后端，SDK在首次发送时才导入
+    """
+    def __init__(self, **options):
+        """
+        :param options: 客户端池参数，未指定的使用settings.SMS_CLIENT_POOL中的配置
+        """
+        config = dict(getattr(settings, 'SMS_CLIENT_POOL', {}), **options)
+        self.pool = SMSClientPool(
+            max_size=config.get('MAX_SIZE', 8),
+            region=config.get('REGION', 'ap-guangzhou'),
+            connect_timeout=config.get('CONNECT_TIMEOUT', 3),
+            read_timeout=config.get('READ_TIMEOUT', 10),
+            acquire_timeout=config.get('ACQUIRE_TIMEOUT', 5),
+        )
+
+    def send(self, phones, params):
+        from tencentcloud.common.exception.tencent_cloud_sdk_exception import TencentCloudSDKException
+        from tencentcloud.sms.v20210111 import models
+
+        # 实例化一个请求对象
+        req = models.SendSmsRequest()
+
+        # 设置参数
+        req.SmsSdkAppId = settings.TENCENT_CLOUD_SMS['APP_ID']
+        req.SignName = settings.TENCENT_CLOUD_SMS['SIGN_NAME']
+        req.TemplateId = settings.TENCENT_CLOUD_SMS['TEMPLATE_ID']
+        req.TemplateParamSet = list(params)
+        req.PhoneNumberSet = [f"+86{phone}" for phone in phones]
+
+        # 从客户端池借用客户端发送短信
+        try:
+            with self.pool.client() as client:
+                resp = client.SendSms(req)
+        except TencentCloudSDKException as err:
+            raise SMSBackendError(str(err)) from err
+
+        # 按手机号对应每个号码的发送结果
+        results = {}
+        for send_status in resp.SendStatusSet:
+            phone = send_status.PhoneNumber[3:] if send_status.PhoneNumber.startswith('+86') else send_status.PhoneNumber
+            results[phone] = (send_status.Code == "Ok", send_status.Message)
+        return results
+
+
+class ConsoleSMSBackend(BaseSMSBackend):
+    """
+    控制台短信后端，只把短信内容写入日志，用于本地开发
+    模板参数中包含验证码，只在DEBUG模式下写入日志，否则脱敏
+    """
+    def send(self, phones, params):
+        logged_params = params if settings.DEBUG else REDACTED
+        for phone in phones:
+            logger.info("短信（控制台后端）: %s, 模板参数: %s", phone, logged_params)
+        return {phone: (True, "send success") for phone in phones}
+
+
+class InMemorySMSBackend(BaseSMSBackend):
+    """
+    内存短信后端，用于测试和压测
+    已发送的短信保存在 outbox 中，可以按手机号查询最近一次的模板参数；
+    支持模拟服务商延迟、拒绝发送和异常
+    """
+    def __init__(self, latency=0, failure_rate=0, error_rate=0, max_outbox=10000, **options):
+        """
+        :param latency: 每次发送的延迟（秒），可以是 (最小值, 最大值) 表示随机延迟
+        :param failure_rate: 服务商拒绝发送的比例，被拒绝的号码返回失败结果
+        :param error_rate: 发送时抛出SMSBackendError的比例
+        :param max_outbox: outbox最多保存的短信条数
+        """
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.outbox = deque(maxlen=max_outbox)
+        self.send_count = 0
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def _sleep(self):
+        if isinstance(self.latency, (list, tuple)):
+            time.sleep(random.uniform(*self.latency))
+        elif self.latency:
+            time.sleep(self.latency)
+
+    def send(self, phones, params):
+        self._sleep()
+        with self._lock:
+            self.send_count += 1
+
+        if self.error_rate and random.random() < self.error_rate:
+            raise SMSBackendError("模拟的短信服务异常")
+
+        results = {}
+        for phone in phones:
+            if self.failure_rate and random.random() < self.failure_rate:
+                results[phone] = (False, "模拟的发送失败")
+                continue
+            with self._lock:
+                self.outbox.append({'phone': phone, 'params': list(params), 'sent_at': time.time()})
+                self._latest[phone] = list(params)
+            results[phone] = (True, "send success")
+        return results
+
+    def last_params(self, phone):
+        """
+        获取发送给指定手机号的最近一条短信的模板参数，没有时返回None
+        """
+        with self._lock:
+            return self._latest.get(phone)
+
+    def clear(self):
+        """
+        清空已发送的短信
+        """
+        with self._lock:
+            self.outbox.clear()
+            self._latest.clear()
+            self.send_count = 0
+
+
+def load_backend(config):
+    """
+    按配置创建短信后端
+    :param config: {'BACKEND': 后端类的导入路径, 'OPTIONS': 构造参数}
+    """
+    backend_class = import_string(config['BACKEND'])
+    return backend_class(**config.get('OPTIONS', {}))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """
+    获取按settings.SMS_BACKEND配置的短信后端，每个进程只创建一次
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = load_backend(settings.SMS_BACKEND)
+    return _backend
+
+@receiver(setting_changed)
+def reset_backend(*, setting, **kwargs):
+    """
+    短信后端配置变化时（如测试中使用override_settings）重新创建后端
+    """
+    global _backend
+    if setting in ('SMS_BACKEND', 'SMS_CLIENT_POOL'):
+        _backend = None
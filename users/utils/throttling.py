@@ -0,0 +1,86 @@
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+from .cache import RateLimiter
+from .helpers import get_client_ip
+
+class RateLimitThrottle(BaseThrottle):
+    """
+    基于RateLimiter的DRF限流类
+    频率通过scope从 REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] 读取，格式与DRF一致，例如 '100/min'；
+    get_identifiers 返回的所有标识符在一次检查中同时计数，任意一个超限即拒绝请求
+    """
+    scope = None
+    algorithm = RateLimiter.SLIDING_WINDOW
+    
+    # 周期单位与秒数的对应关系
+    PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    
+    def __init__(self):
+        self.limiter = None
+        self.blocked_identifier = None
+        
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope) if self.scope else None
+        if rate:
+            limit, period = self.parse_rate(rate)
+            self.limiter = RateLimiter(f"throttle:{self.scope}", limit, period, self.algorithm)
+    
+    def parse_rate(self, rate):
+        """
+        解析频率字符串
+        :param rate: 频率，例如 '100/min'
+        :return: (请求次数, 周期秒数)
+        """
+        num, period = rate.split('/')
+        return int(num), self.PERIODS[period[0]]
+    
+    def get_identifiers(self, request, view):
+        """
+        获取请求的标识符列表，子类重写
+        """
+        raise NotImplementedError('.get_identifiers() must be overridden')
+    
+    def allow_request(self, request, view):
+        """
+        检查是否允许请求
+        """
+        if self.limiter is None:
+            return True
+        
+        allowed, self.blocked_identifier = self.limiter.check(self.get_identifiers(request, view))
+        return allowed
+    
+    def wait(self):
+        """
+        建议客户端等待的时间，单位为秒
+        """
+        if self.limiter is None or self.blocked_identifier is None:
+            return None
+        return self.limiter.get_wait(self.blocked_identifier)
+
+
+class UserRateLimitThrottle(RateLimitThrottle):
+    """
+    按用户限流，未登录时按IP地址限流
+    """
+    scope = 'user'
+    
+    def get_identifiers(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return [f"user:{request.user.id}"]
+        return [f"ip:{get_client_ip(request)}"]
+
+
+class SMSRateLimitThrottle(RateLimitThrottle):
+    """
+    短信相关接口限流，同时按IP地址和手机号限流，使用令牌桶允许少量突发请求
+    """
+    scope = 'sms'
+    algorithm = RateLimiter.TOKEN_BUCKET
+    
+    def get_identifiers(self, request, view):
+        identifiers = [f"ip:{get_client_ip(request)}"]
+        
+        phone = request.data.get('phone') if hasattr(request.data, 'get') else None
+        if phone:
+            identifiers.append(f"phone:{phone}")
+        return identifiers
@@ -1,7 +1,10 @@
 from rest_framework import viewsets, mixins, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.shortcuts import get_object_or_404
+from django.db import IntegrityError, transaction
 from .response import success_response, error_response
 from .logger import api_logger
 
@@ -97,6 +100,114 @@ class CRUDViewSet(BaseViewSet,
             
         serializer = self.get_serializer(queryset, many=True)
         return success_response(data=serializer.data)
+    
+    def clean_pks(self, values):
+        """
+        把请求中的主键转换为模型主键类型
+        :return: 与values一一对应的主键列表，格式不正确的主键为None
+        """
+        pk_field = self.get_queryset().model._meta.pk
+        pks = []
+        for value in values:
+            try:
+                pks.append(pk_field.to_python(value))
+            except (DjangoValidationError, TypeError, ValueError):
+                pks.append(None)
+        return pks
+    
+    def get_bulk_objects(self, pks):
+        """
+        批量获取对象，并逐个检查对象权限
+        """
+        queryset = self.filter_queryset(self.get_queryset()).filter(pk__in=[pk for pk in pks if pk is not None])
+        instances = list(queryset)
+        for instance in instances:
+            self.check_object_permissions(self.request, instance)
+        return instances
+    
+    def check_bulk_data(self, data):
+        """
+        检查批量请求的条目列表
+        :return: 错误响应，没有错误时返回None
+        """
+        max_items = settings.BULK_OPERATIONS.get('MAX_ITEMS', 1000)
+        if not isinstance(data, list) or not data:
+            return error_response(msg="请求数据必须是非空列表")
+        if len(data) > max_items:
+            return error_response(msg=f"单次最多处理{max_items}条")
+        return None
+    
+    def perform_bulk_create(self, serializer):
+        serializer.save()
+    
+    def perform_bulk_update(self, serializer):
+        serializer.save()
+    
+    def perform_bulk_destroy(self, queryset):
+        queryset.delete()
+    
+    @action(detail=False, methods=['post'])
+    def bulk_create(self, request):
+        """
+        批量创建，请求数据为对象列表
+        所有条目校验通过后在一个事务中批量插入，任意条目校验失败则全部不创建，返回与条目一一对应的错误
+        """
+        error = self.check_bulk_data(request.data)
+        if error is not None:
+            return error
+        
+        serializer = self.get_serializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return error_response(msg=serializer.errors, code=400)
+        
+        with transaction.atomic():
+            self.perform_bulk_create(serializer)
+        
+        results = [{'id': instance.pk, 'status': 'created'} for instance in serializer.instance]
+        return success_response(data=results, msg="批量创建成功", status_code=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['patch'])
+    def bulk_update(self, request):
+        """
+        批量部分更新，请求数据为对象列表，每个对象通过id指定要更新的对象
+        所有条目校验通过后在一个事务中批量更新，任意条目校验失败则全部不更新，返回与条目一一对应的错误
+        """
+        error = self.check_bulk_data(request.data)
+        if error is not None:
+            return error
+        
+        pks = self.clean_pks(item.get('id') for item in request.data if isinstance(item, dict))
+        instances = self.get_bulk_objects(pks)
+        serializer = self.get_serializer(instances, data=request.data, many=True, partial=True)
+        if not serializer.is_valid():
+            return error_response(msg=serializer.errors, code=400)
+        
+        with transaction.atomic():
+            self.perform_bulk_update(serializer)
+        
+        results = [{'id': instance.pk, 'status': 'updated'} for instance in serializer.instance]
+        return success_response(data=results, msg="批量更新成功")
+    
+    @action(detail=False, methods=['post'])
+    def bulk_delete(self, request):
+        """
+        批量删除，请求数据为 {"ids": [...]}，返回每个id的删除结果
+        """
+        ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        error = self.check_bulk_data(ids)
+        if error is not None:
+            return error
+        
+        pks = self.clean_pks(ids)
+        found = {instance.pk for instance in self.get_bulk_objects(pks)}
+        with transaction.atomic():
+            self.perform_bulk_destroy(self.get_queryset().filter(pk__in=found))
+        
+        results = [
+            {'id': value, 'status': 'deleted' if pk in found else 'not_found'}
+            for value, pk in zip(ids, pks)
+        ]
+        return success_response(data=results, msg="批量删除成功")
 
 
 class SoftDeleteViewSet(CRUDViewSet):
@@ -122,8 +233,12 @@ class SoftDeleteViewSet(CRUDViewSet):
         instance = get_object_or_404(queryset)
         self.check_object_permissions(request, instance)
         
-        # 恢复对象
-        instance.restore()
+        # 恢复对象，删除期间手机号等唯一字段可能已被其他对象使用
+        try:
+            with transaction.atomic():
+                instance.restore()
+        except IntegrityError:
+            return error_response(msg="恢复失败，唯一字段与现有数据冲突")
         
         serializer = self.get_serializer(instance)
         return success_response(data=serializer.data, msg="恢复成功")
@@ -149,7 +264,7 @@ class SoftDeleteViewSet(CRUDViewSet):
         获取已删除的对象列表
         """
         # 使用only_deleted方法获取已删除的对象
-        queryset = self.get_queryset().model.objects.only_deleted()
+        queryset = self.get_queryset().model.objects.only_deleted().order_by('-deleted_at')
         
         page = self.paginate_queryset(queryset)
         if page is not None:
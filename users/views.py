@@ -1,10 +1,12 @@
 from django.shortcuts import render
+from django.http import HttpResponse
 from rest_framework import status, viewsets
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.decorators import action
 from django.contrib.auth import get_user_model
+from django.conf import settings
 from .serializers import (
     UserSerializer, 
     UserCreateSerializer, 
@@ -16,9 +18,14 @@ from .serializers import (
 )
 from .utils.views import SoftDeleteViewSet
 from .utils.permissions import IsSelf, IsAdminUserOrReadOnly
-from .utils.response import success_response, error_response
+from .utils.response import success_response, error_response, forbidden_response, not_found_response
 from .utils.logger import api_logger
-from .utils.sms import SMSUtil
+from .utils.cache import cache_page_result
+from .utils.throttling import UserRateLimitThrottle, SMSRateLimitThrottle
+from .utils.sms import SMSUtil, get_dispatcher
+from .utils.helpers import get_client_ip
+from .utils import metrics
+from .authentication import UserRefreshToken
 
 User = get_user_model()
 
@@ -27,6 +34,7 @@ class SMSVerificationView(APIView):
     短信验证码视图
     """
     permission_classes = [AllowAny]
+    throttle_classes = [SMSRateLimitThrottle]
     
     @api_logger
     def post(self, request):
@@ -36,17 +44,35 @@ class SMSVerificationView(APIView):
         serializer = PhoneSerializer(data=request.data)
         if serializer.is_valid():
             phone = serializer.validated_data['phone']
-            success, message = SMSUtil.send_verification_code(phone)
+            success, message, task_id = SMSUtil.dispatch_verification_code(phone, get_client_ip(request))
             if success:
-                return success_response(msg=message)
+                # 异步发送时返回任务ID，可通过发送状态接口查询
+                data = {'task_id': task_id} if task_id else None
+                return success_response(data=data, msg=message)
             return error_response(msg=message)
         return error_response(msg=serializer.errors)
 
+class SMSStatusView(APIView):
+    """
+    短信发送状态视图
+    """
+    permission_classes = [AllowAny]
+    
+    def get(self, request, task_id):
+        """
+        查询异步发送任务的状态
+        """
+        result = get_dispatcher().get_status(task_id)
+        if result is None:
+            return not_found_response(msg="发送任务不存在或已过期")
+        return success_response(data=result)
+
 class SMSLoginView(APIView):
     """
     短信验证码登录视图
     """
     permission_classes = [AllowAny]
+    throttle_classes = [SMSRateLimitThrottle]
     
     @api_logger
     def post(self, request):
@@ -59,25 +85,45 @@ class SMSLoginView(APIView):
             user_serializer = UserSerializer(result['user'])
             return success_response(data={
                 'user': user_serializer.data,
+                'is_new_user': result['created'],
                 'refresh': result['refresh'],
                 'access': result['access']
             })
         return error_response(msg=serializer.errors)
 
+class MetricsView(APIView):
+    """
+    指标视图，以Prometheus文本格式输出请求耗时等指标
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    throttle_classes = []
+    
+    def get(self, request):
+        """
+        获取指标，只允许METRICS_ALLOWED_IPS中的地址访问，未配置时只允许本机访问
+        """
+        allowed_ips = getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+        if get_client_ip(request) not in allowed_ips:
+            return forbidden_response()
+        return HttpResponse(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 class UserViewSet(SoftDeleteViewSet):
     """
     用户视图集，提供用户的增删改查功能
     """
-    queryset = User.objects.all()
+    # 按创建时间倒序，与未删除用户的部分索引一致
+    queryset = User.objects.order_by('-created_at')
     permission_classes = [IsAuthenticated]
+    throttle_classes = [UserRateLimitThrottle]
     
     def get_serializer_class(self):
         """
         根据不同的操作返回不同的序列化器
         """
-        if self.action == 'create':
+        if self.action in ['create', 'bulk_create']:
             return UserCreateSerializer
-        elif self.action in ['update', 'partial_update']:
+        elif self.action in ['update', 'partial_update', 'bulk_update']:
             return UserUpdateSerializer
         elif self.action == 'change_password':
             return ChangePasswordSerializer
@@ -93,11 +139,22 @@ class UserViewSet(SoftDeleteViewSet):
             permission_classes = [IsSelf]
         elif self.action in ['list', 'deleted']:
             permission_classes = [IsAdminUserOrReadOnly]
+        elif self.action in ['bulk_create', 'bulk_update', 'bulk_delete']:
+            # 批量操作不逐个检查是否本人，只允许管理员
+            permission_classes = [IsAdminUser]
         else:
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
     
+    @cache_page_result(timeout=3600, prefix='user_retrieve', tags=['user:{pk}'])
+    def retrieve(self, request, *args, **kwargs):
+        """
+        获取用户详情，结果按用户缓存，用户数据变更时失效
+        """
+        return super().retrieve(request, *args, **kwargs)
+    
     @action(detail=False, methods=['get'])
+    @cache_page_result(timeout=3600, prefix='user_me', tags=['user:{user_id}'])
     def me(self, request):
         """
         获取当前用户信息
@@ -110,7 +167,8 @@ class UserViewSet(SoftDeleteViewSet):
         """
         修改密码
         """
-        user = request.user
+        # 令牌认证得到的可能是轻量用户对象，修改密码需要从数据库获取最新的用户对象
+        user = User.objects.get(pk=request.user.pk)
         serializer = self.get_serializer(data=request.data)
         
         if serializer.is_valid():
@@ -118,13 +176,28 @@ class UserViewSet(SoftDeleteViewSet):
             if not user.check_password(serializer.validated_data['old_password']):
                 return error_response(msg="旧密码不正确", code=400)
             
-            # 设置新密码
+            # 设置新密码，保存时撤销之前签发的所有令牌
             user.set_password(serializer.validated_data['new_password'])
             user.save()
-            return success_response(msg="密码修改成功")
+            
+            # 当前设备使用新令牌继续登录
+            refresh = UserRefreshToken.for_user(user)
+            return success_response(data={
+                'refresh': str(refresh),
+                'access': str(refresh.access_token),
+            }, msg="密码修改成功")
         
         return error_response(msg=serializer.errors, code=400)
     
+    @action(detail=False, methods=['post'])
+    def logout(self, request):
+        """
+        退出登录，撤销当前用户在所有设备上的令牌
+        """
+        user = User.objects.get(pk=request.user.pk)
+        user.revoke_tokens()
+        return success_response(msg="已退出登录")
+    
     @api_logger
     def create(self, request, *args, **kwargs):
         """
@@ -132,12 +205,27 @@ class UserViewSet(SoftDeleteViewSet):
         """
         return super().create(request, *args, **kwargs)
     
+    def perform_update(self, serializer):
+        version = serializer.instance.token_version
+        super().perform_update(serializer)
+        # 修改了用户名等令牌声明字段时，保存会撤销之前签发的令牌
+        self.revoked_user = serializer.instance if serializer.instance.token_version != version else None
+    
     @api_logger
     def update(self, request, *args, **kwargs):
         """
         重写更新方法，添加日志记录
-        """
-        return super().update(request, *args, **kwargs)
+        用户修改了自己的令牌声明字段（如用户名）时，当前令牌已被撤销，响应中返回新令牌供当前设备继续使用
+        """
+        response = super().update(request, *args, **kwargs)
+        user = getattr(self, 'revoked_user', None)
+        if user is not None and user.pk == request.user.pk:
+            refresh = UserRefreshToken.for_user(user)
+            response.data['tokens'] = {
+                'refresh': str(refresh),
+                'access': str(refresh.access_token),
+            }
+        return response
     
     @api_logger
     def destroy(self, request, *args, **kwargs):